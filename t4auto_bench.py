@@ -0,0 +1,330 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict
+from pathlib import Path
+from urllib.request import urlopen
+
+from t4autolibs.cores import URL, AgentV2, AgentSettings, UserInfo, ActionRowV2, ActionType
+from t4autolibs.logs import configure_logging, shutdown_logging
+from t4autolibs.mock_server import WORDS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measures schedules of several sizes against the local stand-in '
+                                                 'server (t4autolibs/mock_server.py).')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1, 10, 100, 1000, 10000])
+    parser.add_argument('--items', type=int, default=5000, help='size of the catalog')
+    parser.add_argument('--stores', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added by the server to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--lead', type=float, default=5, help='seconds from starting the scheduler to the offline time')
+    parser.add_argument('--window', type=float, default=60, help='seconds between the offline and the online time')
+    parser.add_argument('--timeout', type=float, default=600,
+                        help='seconds after the online time after which a run is given up')
+    parser.add_argument('--search', action='store_true',
+                        help='instead measures the memory of searching the whole catalog, keeping the JSON records '
+                             'as before or compact items')
+    parser.add_argument('--gui', action='store_true',
+                        help='instead measures how long the event loop of the window stalls while it logs in and '
+                             'downloads the catalog, on worker threads or on the GUI thread')
+    parser.add_argument('--json', type=Path, help='also writes the results to this file')
+    return parser.parse_args()
+
+
+def start_mock_server(args) -> tuple[subprocess.Popen, str]:
+    # The server runs in its own process, so that it affects neither the timing nor the memory of the agent.
+    process = subprocess.Popen(
+        [sys.executable, '-m', 't4autolibs.mock_server', '--items', str(args.items), '--stores', str(args.stores),
+         '--latency', str(args.latency), '--error-rate', str(args.error_rate)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    return process, process.stdout.readline().strip()
+
+
+def get_stats(host: str) -> dict:
+    with urlopen(f'{host}/mock/stats') as response:
+        return json.load(response)
+
+
+def create_action_rows(n_rows: int, n_stores: int, offline_time: datetime.datetime,
+                       online_time: datetime.datetime) -> list[ActionRowV2]:
+    rng = random.Random(n_rows)
+    action_rows = []
+    for _ in range(n_rows):
+        keyword = rng.choice(WORDS)
+        store_id = rng.randint(1, n_stores)
+        action_rows.append(ActionRowV2(keyword, offline_time, ActionType.START, '', store_id))
+        action_rows.append(ActionRowV2(keyword, online_time, ActionType.END, '', store_id))
+    return action_rows
+
+
+def wait_until_online(agent: AgentV2, action_rows: list[ActionRowV2], online_time: datetime.datetime,
+                      deadline: float) -> bool:
+    """
+    Waits until the job store has every row back online, or until the deadline. Returns whether the run finished.
+    """
+    row_keys = {action_row.row_key for action_row in action_rows}
+    while time.time() < deadline:
+        applied_states = agent.job_store.load_applied_states()
+        if all(
+            row_key in applied_states and applied_states[row_key].action_type == ActionType.END
+            and applied_states[row_key].applied_at >= online_time
+            for row_key in row_keys
+        ):
+            return True
+        time.sleep(0.5)
+    return False
+
+
+def run(args, n_rows: int) -> dict:
+    process, host = start_mock_server(args)
+    working_dir = os.getcwd()
+    try:
+        URL.use_host(host)
+        with tempfile.TemporaryDirectory() as data_dir:
+            # The log file and the other files of the agent are written in the temporary directory.
+            os.chdir(data_dir)
+            settings = AgentSettings(prefetch_lead_seconds=int(args.lead) // 2)
+            # Keeps the log lines of thousands of rows out of the terminal, but not out of the log file.
+            configure_logging(settings.log_max_bytes, settings.log_backup_count, console_level=logging.WARNING)
+            agent = AgentV2(settings, data_dir=Path(data_dir))
+            agent.login(UserInfo('benchmark', 'benchmark'))
+
+            now = datetime.datetime.now().replace(microsecond=0)
+            offline_time = now + datetime.timedelta(seconds=args.lead)
+            online_time = offline_time + datetime.timedelta(seconds=args.window)
+            action_rows = create_action_rows(n_rows, args.stores, offline_time, online_time)
+
+            tracemalloc.start()
+            started_at = time.time()
+            agent.start_scheduler(action_rows)
+            finished = wait_until_online(agent, action_rows, online_time, online_time.timestamp() + args.timeout)
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stats = get_stats(host)
+
+            agent.stop_scheduler()
+            agent.logout()
+            # Closes the log files in the temporary directory; the next run writes its own.
+            shutdown_logging()
+            os.chdir(working_dir)
+    finally:
+        process.terminate()
+        process.wait()
+
+    post_times = stats['request_times'].get('POST /api/v1/pluavailabilityrules', [])
+    delete_times = stats['request_times'].get('DELETE /api/v1/pluavailabilityrules', [])
+    all_times = [t for times in stats['request_times'].values() for t in times]
+    return {
+        'rows': n_rows,
+        'finished': finished,
+        'offline_lateness_seconds': max(post_times) - offline_time.timestamp() if post_times else None,
+        'online_lateness_seconds': max(delete_times) - online_time.timestamp() if delete_times else None,
+        'wall_seconds': max(all_times) - started_at,
+        'requests': sum(stats['request_counts'].values()),
+        'peak_memory_mib': peak_memory / 2 ** 20,
+        'rules_left': stats['n_rules'],
+    }
+
+
+def search_json_records(agent: AgentV2) -> list[dict]:
+    # How _search_items_from_api used to work: the full JSON records of every page are kept.
+    items = []
+    start_idx = 0
+    while True:
+        response = agent._get_items_page(URL.GET_ITEMS_API, {'qv': '', 'start': start_idx,
+                                                             'limit': agent.settings.n_items_per_page})
+        items += response['data']
+        start_idx += agent.settings.n_items_per_page
+        if start_idx >= response['total']:
+            return items
+
+
+def measure_search(args) -> list[dict]:
+    process, host = start_mock_server(args)
+    working_dir = os.getcwd()
+    results = []
+    try:
+        URL.use_host(host)
+        with tempfile.TemporaryDirectory() as data_dir:
+            os.chdir(data_dir)
+            agent = AgentV2(data_dir=Path(data_dir))
+            agent.login(UserInfo('benchmark', 'benchmark'))
+            for representation, search in [
+                ('json', search_json_records),
+                ('compact', lambda agent: agent._search_items_from_api('', URL.GET_ITEMS_API)),
+            ]:
+                tracemalloc.start()
+                started_at = time.perf_counter()
+                items = search(agent)
+                wall_seconds = time.perf_counter() - started_at
+                retained_memory, peak_memory = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                results.append({
+                    'representation': representation,
+                    'items': len(items),
+                    'wall_seconds': wall_seconds,
+                    'retained_memory_mib': retained_memory / 2 ** 20,
+                    'peak_memory_mib': peak_memory / 2 ** 20,
+                })
+                del items
+            agent.logout()
+            shutdown_logging()
+            os.chdir(working_dir)
+    finally:
+        process.terminate()
+        process.wait()
+    return results
+
+
+class Heartbeat:
+    """
+    A timer on the GUI thread that records how much later than its interval each tick arrives, i.e. how long the event
+    loop could not paint or handle input.
+    """
+
+    def __init__(self, interval_ms: int = 10):
+        from PySide6.QtCore import QTimer
+        self.interval_ms = interval_ms
+        self.stalls_ms = []
+        self._last_tick = time.perf_counter()
+        self._timer = QTimer()
+        self._timer.timeout.connect(self._tick)
+        self._timer.start(interval_ms)
+
+    def _tick(self):
+        now = time.perf_counter()
+        self.stalls_ms.append(max((now - self._last_tick) * 1000 - self.interval_ms, 0))
+        self._last_tick = now
+
+    def stop(self):
+        self._timer.stop()
+
+
+def process_events_until(app, condition, timeout_seconds: float):
+    from PySide6.QtCore import QEventLoop
+    deadline = time.perf_counter() + timeout_seconds
+    while not condition() and time.perf_counter() < deadline:
+        app.processEvents(QEventLoop.ProcessEventsFlag.WaitForMoreEvents)
+
+
+def measure_gui(args) -> list[dict]:
+    """
+    Logs in and starts a one-row schedule with the local catalog enabled, so that starting downloads the whole catalog,
+    first through the buttons of the window, which run the calls on worker threads, then by calling the agent on the
+    GUI thread, as the window used to.
+    """
+    from PySide6.QtWidgets import QApplication, QMainWindow
+    from t4autolibs.gui.item_model import ScheduleRow
+    from t4autolibs.gui.t4auto_gui import Composition
+    from t4autolibs.recurrence import Recurrence
+    from t4autolibs.stores import Store
+
+    app = QApplication.instance() or QApplication([])
+    process, host = start_mock_server(args)
+    working_dir = os.getcwd()
+    results = []
+    try:
+        URL.use_host(host)
+        for mode in ['worker', 'blocking']:
+            with tempfile.TemporaryDirectory() as data_dir:
+                os.chdir(data_dir)
+                composition = Composition(QMainWindow())
+                composition.agent.load_config({'AgentSettings': asdict(AgentSettings(local_catalog=True))})
+                # The row is not due for hours, so starting only loads the catalog and schedules it.
+                offline_time = datetime.datetime.now() + datetime.timedelta(hours=2)
+                online_time = offline_time + datetime.timedelta(hours=1)
+                composition.item_table.model.set_rows([ScheduleRow(
+                    [Store(1, 'Store 1')], WORDS[0], (offline_time.hour, offline_time.minute),
+                    (online_time.hour, online_time.minute), Recurrence(), '')])
+                login, item_table = composition.login, composition.item_table
+                login.username_edit.setText('benchmark')
+                login.password_edit.setText('benchmark')
+
+                heartbeat = Heartbeat()
+                started_at = time.perf_counter()
+                if mode == 'worker':
+                    login.login()
+                    process_events_until(app, lambda: login._worker is None, args.timeout)
+                    login_seconds = time.perf_counter() - started_at
+                    item_table.start_automation()
+                    process_events_until(app, lambda: item_table._start_worker is None, args.timeout)
+                else:
+                    composition.agent.login(UserInfo('benchmark', 'benchmark'))
+                    app.processEvents()
+                    login_seconds = time.perf_counter() - started_at
+                    composition.agent.start_scheduler(item_table.collect_action_rows_from_table())
+                    app.processEvents()
+                start_seconds = time.perf_counter() - started_at - login_seconds
+                heartbeat.stop()
+
+                stalls_ms = sorted(heartbeat.stalls_ms) or [0]
+                results.append({
+                    'mode': mode,
+                    'login_seconds': login_seconds,
+                    'start_seconds': start_seconds,
+                    'catalog_items': len(composition.agent.catalog or []),
+                    'max_stall_ms': stalls_ms[-1],
+                    'p99_stall_ms': stalls_ms[int(len(stalls_ms) * 0.99)],
+                })
+                composition.agent.stop_scheduler()
+                composition.agent.logout()
+                shutdown_logging()
+                os.chdir(working_dir)
+    finally:
+        process.terminate()
+        process.wait()
+    return results
+
+
+def format_seconds(value: float | None) -> str:
+    return f'{value:.3f}' if value is not None else '-'
+
+
+def main():
+    args = parse_args()
+    if args.gui:
+        results = measure_gui(args)
+        print(f'{"mode":>8} {"login (s)":>10} {"start (s)":>10} {"max stall (ms)":>15} {"p99 stall (ms)":>15}')
+        for result in results:
+            print(f'{result["mode"]:>8} {result["login_seconds"]:>10.3f} {result["start_seconds"]:>10.3f} '
+                  f'{result["max_stall_ms"]:>15.1f} {result["p99_stall_ms"]:>15.1f}')
+    elif args.search:
+        results = measure_search(args)
+        print(f'{"representation":>14} {"items":>7} {"wall (s)":>9} {"retained (MiB)":>15} {"peak (MiB)":>11}')
+        for result in results:
+            print(f'{result["representation"]:>14} {result["items"]:>7} {result["wall_seconds"]:>9.3f} '
+                  f'{result["retained_memory_mib"]:>15.1f} {result["peak_memory_mib"]:>11.1f}')
+    else:
+        results = measure_schedules(args)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+
+
+def measure_schedules(args) -> list[dict]:
+    results = []
+    print(f'{"rows":>6} {"offline late (s)":>17} {"online late (s)":>16} {"wall (s)":>9} {"requests":>9} '
+          f'{"peak (MiB)":>11} {"rules left":>11} {"finished":>9}')
+    for n_rows in args.rows:
+        result = run(args, n_rows)
+        results.append(result)
+        print(f'{result["rows"]:>6} {format_seconds(result["offline_lateness_seconds"]):>17} '
+              f'{format_seconds(result["online_lateness_seconds"]):>16} {result["wall_seconds"]:>9.3f} '
+              f'{result["requests"]:>9} {result["peak_memory_mib"]:>11.1f} {result["rules_left"]:>11} '
+              f'{"yes" if result["finished"] else "timed out":>9}')
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,514 @@
+import asyncio
+import datetime
+import logging
+import time
+from contextlib import AsyncExitStack, nullcontext
+from pathlib import Path
+from typing import Awaitable, Callable
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from t4autolibs.cores import URL, ActionRowV2, ActionType, AgentSettings, LoginStatus, Store, UserInfo, \
+    action_trigger, batch_action_rows, login_form, split_into_chunks, time_difference_seconds
+from t4autolibs.items import Item
+from t4autolibs.ledger import RuleLedger, LEDGER_FILE
+from t4autolibs.logs import AccountLogger, configure_logging
+from t4autolibs.metrics import Metrics
+from t4autolibs.transport import IDEMPOTENT_METHODS, THROTTLING_STATUS_CODES, AdaptiveRateLimiter, Transport, \
+    parse_retry_after
+
+
+def form_fields(payload: dict) -> list[tuple[str, str]]:
+    """
+    Encodes list values as repeated fields, the same way requests does for form data.
+    """
+    encoded = []
+    for key, value in payload.items():
+        for single_value in value if isinstance(value, list) else [value]:
+            encoded.append((key, str(single_value)))
+    return encoded
+
+
+class AsyncTransport(Transport):
+    """
+    The retry, throttling and relogin policy of Transport for an aiohttp session. Every attempt also holds a slot of
+    the limiter of its agent and of the global limiter, so that many agents on one event loop stay within both.
+
+    The body of the response is read before it is returned, so that response.json() can be awaited after the
+    connection has gone back to the pool.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, rate_limiter: AdaptiveRateLimiter, timeout_seconds: float,
+                 max_retries: int, backoff_base_seconds: float, backoff_max_seconds: float,
+                 relogin: Callable[[float], Awaitable[bool]] | None = None, metrics: Metrics | None = None,
+                 logger: logging.Logger | logging.LoggerAdapter | None = None,
+                 limiter: asyncio.Semaphore | None = None, global_limiter: asyncio.Semaphore | None = None):
+        super().__init__(session, rate_limiter, timeout_seconds, max_retries, backoff_base_seconds,
+                         backoff_max_seconds, relogin, metrics, logger)
+        self.limiter = limiter if limiter else nullcontext()
+        self.global_limiter = global_limiter if global_limiter else nullcontext()
+
+    @staticmethod
+    def _is_session_expired(response: aiohttp.ClientResponse) -> bool:
+        if response.status in (401, 403):
+            return True
+        # An expired session is redirected to the login page.
+        return bool(response.history) and 'login' in str(response.url)
+
+    async def _acquire(self):
+        while (wait_seconds := self.rate_limiter.try_acquire()) > 0:
+            await asyncio.sleep(wait_seconds)
+
+    async def request(self, method: str, url: str, allow_relogin: bool = True, **kwargs) -> aiohttp.ClientResponse:
+        is_idempotent = method.upper() in IDEMPOTENT_METHODS
+        path = urlsplit(url).path.rstrip('/')
+        if 'data' in kwargs:
+            kwargs['data'] = form_fields(kwargs['data'])
+        attempt = 0
+        while True:
+            await self._acquire()
+            started_at = time.perf_counter()
+            try:
+                async with self.limiter, self.global_limiter:
+                    async with self.session.request(method, url, timeout=aiohttp.ClientTimeout(self.timeout_seconds),
+                                                    **kwargs) as response:
+                        await response.read()
+            except (aiohttp.ClientConnectionError, TimeoutError) as e:
+                self._record(method, path, 'error', started_at)
+                if not is_idempotent or attempt >= self.max_retries:
+                    raise
+                self.class_logger.debug(f'{method} {url} failed: {e!r}. Retrying.')
+                await asyncio.sleep(self._backoff_seconds(attempt))
+                attempt += 1
+                continue
+
+            self._record(method, path, response.status, started_at)
+            if response.status == 429 or response.status >= 500:
+                retry_after_seconds = parse_retry_after(response.headers.get('Retry-After'))
+                if response.status in THROTTLING_STATUS_CODES:
+                    self.rate_limiter.on_throttled(retry_after_seconds)
+                can_retry = response.status == 429 or is_idempotent
+                if not can_retry or attempt >= self.max_retries:
+                    return response
+                self.class_logger.debug(f'{method} {url} returned HTTP {response.status}. Retrying.')
+                await asyncio.sleep(max(self._backoff_seconds(attempt), retry_after_seconds or 0))
+                attempt += 1
+                continue
+
+            if allow_relogin and self.relogin and self._is_session_expired(response):
+                self.class_logger.info('The session has expired. Logging in again.')
+                allow_relogin = False
+                if await self.relogin(started_at):
+                    continue
+                return response
+
+            self.rate_limiter.on_success()
+            return response
+
+
+class AsyncAgent:
+    """
+    The operations of AgentV2 on asyncio, so that one event loop can serve many stores and accounts at once.
+
+    Every account has its own AsyncAgent, i.e. its own cookie jar, store list and ledger. Agents may share one
+    connector, so that they draw from the same connection pool, one global limiter on top of their own
+    max_concurrent_requests, and one metrics registry, as the accounts of a SessionPool do. Requests go through the
+    same retry and relogin policy as AgentV2, updates are sent in chunks of update_chunk_size, and the rules created
+    offline are recorded in the ledger, so that the online action deletes exactly those.
+    """
+
+    def __init__(self, settings: AgentSettings | None = None, data_dir: Path = Path('.'),
+                 connector: aiohttp.BaseConnector | None = None, global_limiter: asyncio.Semaphore | None = None,
+                 metrics: Metrics | None = None, metrics_dir: Path | None = None, account: str = ''):
+        self.stores = []
+        self.settings = settings if settings else AgentSettings()
+        self.data_dir = data_dir
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.ledger = RuleLedger(self.data_dir / LEDGER_FILE)
+        self.account = account
+        if metrics is None:
+            self.metrics = Metrics()
+        else:
+            self.metrics = metrics.labelled(account=account) if account else metrics
+        self.metrics_dir = metrics_dir if metrics_dir else data_dir
+        configure_logging(self.settings.log_max_bytes, self.settings.log_backup_count, self.settings.log_rotate_when)
+        logger = logging.getLogger('t4auto')
+        self.class_logger = AccountLogger(logger, {'account': account}) if account else logger
+        self._connector = connector
+        self._global_limiter = global_limiter
+        self._user_info = None
+        # Requests of several tasks may find the session expired at once; one of them logs in again for all.
+        self._relogin_lock = asyncio.Lock()
+        self._session_renewed_at = time.perf_counter()
+        # The offline and online actions of a store and keyword run one after another, as on the dispatcher of
+        # AgentV2.
+        self._lanes = {}  # (store ID, keyword) -> asyncio.Lock
+        self.session = None
+        self.transport = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=self._connector,
+            connector_owner=self._connector is None,
+            # Also accepts cookies from IP hosts, such as a local stand-in server.
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+            headers={'User-Agent': ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
+                                    'AppleWebKit/537.36 (KHTML, like Gecko) '
+                                    'Chrome/124.0.0.0 Safari/537.36')},
+        )
+        self.transport = AsyncTransport(
+            self.session,
+            AdaptiveRateLimiter(
+                max_rate=self.settings.max_requests_per_second,
+                min_rate=self.settings.min_requests_per_second,
+                burst=self.settings.max_concurrent_requests,
+            ),
+            timeout_seconds=self.settings.request_timeout_seconds,
+            max_retries=self.settings.max_retries,
+            backoff_base_seconds=self.settings.backoff_base_seconds,
+            backoff_max_seconds=self.settings.backoff_max_seconds,
+            relogin=self._relogin,
+            metrics=self.metrics,
+            logger=self.class_logger,
+            limiter=asyncio.Semaphore(self.settings.max_concurrent_requests),
+            global_limiter=self._global_limiter,
+        )
+        return self
+
+    async def __aexit__(self, *args):
+        await self.session.close()
+
+    async def _relogin(self, sent_at: float) -> bool:
+        """
+        Logs in again after a request sent at sent_at found the session expired, unless another request has already
+        renewed the session since then.
+        """
+        async with self._relogin_lock:
+            if self._session_renewed_at > sent_at:
+                return True
+            if self._user_info is None:
+                return False
+
+            try:
+                response = await self.transport.request('POST', URL.LOGIN_API, allow_relogin=False,
+                                                        data=login_form(self._user_info))
+                success = response.status == 200 and (await response.json(content_type=None))['success']
+            except (aiohttp.ClientError, TimeoutError, ValueError) as e:
+                self.class_logger.debug(f'POST {URL.LOGIN_API} failed: {e!r}')
+                success = False
+            self.class_logger.info(f'Logging in again {"succeeded" if success else "failed"}.')
+            if success:
+                self._session_renewed_at = time.perf_counter()
+            return success
+
+    async def login(self, user_info: UserInfo) -> LoginStatus:
+        try:
+            response = await self.transport.request('POST', URL.LOGIN_API, allow_relogin=False,
+                                                    data=login_form(user_info))
+        except (aiohttp.ClientError, TimeoutError) as e:
+            message = f'Login failed with a connection error: {e!r}'
+            self.class_logger.info(f'{message}')
+            return LoginStatus(False, message)
+
+        if response.status == 200:
+            response = await response.json(content_type=None)
+            if response['success']:
+                self._user_info = user_info
+                self._session_renewed_at = time.perf_counter()
+                self.stores = await self._get_store_ids()
+                success = True
+                message = 'Login successfully'
+            else:
+                success = False
+                message = f'Login failed: {response['additional_info']['validation_errors'][0]['msg']}'
+        else:
+            success = False
+            message = f'Login failed with HTTP error: HTTP status code is {response.status}'
+
+        self.class_logger.info(f'{message}')
+        return LoginStatus(success, message)
+
+    async def _get_store_ids(self) -> list[Store]:
+        response = await self.transport.request('GET', URL.GET_STORES_API, params={'restricted': 'true'})
+        response = await response.json(content_type=None)
+        if not response['success']:
+            raise ValueError('Response["success"] is false.\n' + str(response))
+
+        stores = [Store(data['value'], data['name']) for data in response['data']]
+        self.class_logger.debug(f'_get_store_ids() -> {stores}')
+        return stores
+
+    async def logout(self) -> LoginStatus:
+        response = await self.transport.request('GET', URL.LOGOUT_API, allow_relogin=False)
+        if response.status == 200:
+            self._user_info = None
+            self.stores = []
+            self.session.cookie_jar.clear()
+            success = True
+            message = 'Logout successfully'
+        else:
+            success = False
+            message = f'Logout failed with HTTP error: HTTP status code is {response.status}'
+        self.class_logger.info(f'{message}')
+        return LoginStatus(success, message)
+
+    async def _get_items_page(self, api, params):
+        # A page that cannot be fetched fails the search like a page the server refused, not the whole action.
+        try:
+            response = await (await self.transport.request('GET', api, params=params)).json(content_type=None)
+        except (aiohttp.ClientError, TimeoutError, ValueError) as e:
+            self.class_logger.error(f'Failed to search items: {e!r}')
+            self.class_logger.debug(f'GET {api} with params: {params}')
+            return None
+        if not response['success']:
+            self.class_logger.error(f'Failed to search items.')
+            self.class_logger.debug(f'GET {api} with params: {params}')
+            self.class_logger.debug(f'Response: {response}')
+            return None
+        return response
+
+    async def _search_items_from_api(self, keyword, api) -> list[Item] | None:
+        n_items_per_page = self.settings.n_items_per_page
+        params = {
+            'qv': keyword,
+            'start': 0,
+            'limit': n_items_per_page,
+        }
+        response = await self._get_items_page(api, params)
+        if response is None:
+            return None
+
+        # The first page reports the total; the limiters of the transport bound how many of the rest are in flight.
+        items = [Item.from_json(data) for data in response['data']]
+        responses = await asyncio.gather(*[
+            self._get_items_page(api, params | {'start': start_idx})
+            for start_idx in range(n_items_per_page, response['total'], n_items_per_page)
+        ])
+        for response in responses:
+            if response is None:
+                return None
+            items += [Item.from_json(data) for data in response['data']]
+        return items
+
+    async def _search_keywords(self, action_rows: list[ActionRowV2], api) -> dict[str, list[Item] | None]:
+        keywords = list(dict.fromkeys(action_row.keyword for action_row in action_rows))
+        results = await asyncio.gather(*[self._search_items_from_api(keyword, api) for keyword in keywords])
+        return dict(zip(keywords, results))
+
+    async def _send_update(self, method: str, payload: dict) -> tuple[dict | None, bool]:
+        """
+        Returns the response, or None if the request failed, and whether the failure is definite. A request that timed
+        out, lost its connection or got no valid answer may still have been applied by the server.
+        """
+        try:
+            response = await self.transport.request(method, URL.UPDATE_ITEMS_API, data=payload)
+            response = await response.json(content_type=None)
+        except (aiohttp.ClientError, TimeoutError, ValueError) as e:
+            self.class_logger.debug(f'{method} {URL.UPDATE_ITEMS_API} failed: {e!r}')
+            return None, False
+
+        if not response['success']:
+            self.class_logger.debug(f'response["success"] == False')
+            self.class_logger.debug(f'response: {response}')
+            return None, True
+        return response, True
+
+    async def _send_updates(self, method: str, payloads: list[dict], action: str) -> list[dict | None]:
+        """
+        Sends the payloads concurrently, then sends the failed ones again, at most update_chunk_retries times, with the
+        same rule as AgentV2: a POST is sent again only after a definite failure.
+        """
+        responses = [None] * len(payloads)
+        pending = list(range(len(payloads)))
+        for attempt in range(self.settings.update_chunk_retries + 1):
+            if attempt > 0:
+                self.class_logger.info(f'Retrying {len(pending)} of {len(payloads)} update requests.')
+                self.metrics.inc('t4auto_update_retries_total', len(pending), action=action)
+            results = await asyncio.gather(*[self._send_update(method, payloads[i]) for i in pending])
+            retryable = []
+            for i, (response, is_definite) in zip(pending, results):
+                responses[i] = response
+                if response is None and (is_definite or method != 'POST'):
+                    retryable.append(i)
+            pending = retryable
+            if not pending:
+                break
+
+        n_failed = responses.count(None)
+        self.metrics.inc('t4auto_update_failures_total', n_failed, action=action)
+        if len(payloads) > 1:
+            self.class_logger.info(f'{len(payloads) - n_failed} of {len(payloads)} update requests succeeded.')
+        return responses
+
+    def _lane_locks(self, action_rows: list[ActionRowV2]) -> list[asyncio.Lock]:
+        # Taken in a fixed order, so that two batches sharing several lanes never wait for each other.
+        lanes = sorted({(action_row.store_id, action_row.keyword) for action_row in action_rows}, key=str)
+        return [self._lanes.setdefault(lane, asyncio.Lock()) for lane in lanes]
+
+    async def _run_in_lanes(self, action_rows: list[ActionRowV2], action: Callable[[list[ActionRowV2]], Awaitable]):
+        async with AsyncExitStack() as stack:
+            for lock in self._lane_locks(action_rows):
+                await stack.enter_async_context(lock)
+            await action(action_rows)
+        try:
+            await asyncio.to_thread(self.metrics.write, self.metrics_dir)
+        except OSError as e:
+            self.class_logger.error(f'Failed to write the metrics: {e}')
+
+    async def take_items_offline(self, action_rows: list[ActionRowV2]):
+        items_by_keyword = await self._search_keywords(action_rows, URL.GET_ITEMS_API)
+
+        # As in AgentV2, stores are merged into one request only when their rows resolve to the same PLU codes.
+        store_plu_codes = {}
+        for action_row in action_rows:
+            items = items_by_keyword[action_row.keyword]
+            if not items:
+                self.class_logger.info(f'No items were searched with the keyword: {action_row.keyword}. Skipped.')
+                continue
+            plu_codes = store_plu_codes.setdefault(action_row.store_id, {})
+            plu_codes |= dict.fromkeys(item.plu_code for item in items)
+
+        store_ids_by_plu_codes = {}
+        for store_id, plu_codes in store_plu_codes.items():
+            store_ids_by_plu_codes.setdefault(tuple(plu_codes), []).append(store_id)
+        payloads = []
+        for plu_codes, store_ids in store_ids_by_plu_codes.items():
+            for chunk in split_into_chunks(list(plu_codes), self.settings.update_chunk_size):
+                payloads.append({
+                    'PLUCode': chunk,
+                    'CustomReason': action_rows[0].reason if action_rows[0].reason else 'Deleted by t4auto',
+                    'Reason': 'Custom',
+                    'StoreID': store_ids,
+                })
+        responses = await self._send_updates('POST', payloads, 'offline')
+
+        # A store succeeds only if all chunks of its group do. The created rules are recorded per store and PLU code,
+        # or None if a response does not list them; the online action then searches for them instead.
+        store_success = dict.fromkeys(store_plu_codes, True)
+        store_rule_ids = {str(store_id): {} for store_id in store_plu_codes}
+        n_items_affected = 0
+        for payload, response in zip(payloads, responses):
+            if response is None:
+                for store_id in payload['StoreID']:
+                    store_success[store_id] = False
+                continue
+
+            n_items_affected += len(payload['PLUCode']) * len(payload['StoreID'])
+            rules = response.get('data')
+            if not isinstance(rules, list):
+                for store_id in payload['StoreID']:
+                    store_rule_ids[str(store_id)] = None
+                continue
+            for rule in rules:
+                rule_ids_by_plu_code = store_rule_ids.get(str(rule.get('StoreID')))
+                if rule_ids_by_plu_code is not None:
+                    rule_ids_by_plu_code.setdefault(str(rule.get('PLUCode')), []).append(rule['ID'])
+        self.metrics.inc('t4auto_items_affected_total', n_items_affected, action='offline')
+
+        rule_ids_by_row_key = {}
+        for action_row in action_rows:
+            if action_row.store_id not in store_success:
+                continue
+            if not store_success[action_row.store_id]:
+                self.class_logger.error(f'Failed to take items offline with the keyword: {action_row.keyword}')
+                continue
+            self.class_logger.info(f'The items were offline with the keyword: {action_row.keyword}, '
+                                   f'total {len(store_plu_codes[action_row.store_id])} items in the store.')
+            rule_ids_by_plu_code = store_rule_ids[str(action_row.store_id)]
+            if rule_ids_by_plu_code is not None:
+                rule_ids_by_row_key[action_row.row_key] = [
+                    rule_id
+                    for item in items_by_keyword[action_row.keyword]
+                    for rule_id in rule_ids_by_plu_code.get(str(item.plu_code), [])
+                ]
+        if rule_ids_by_row_key:
+            await asyncio.to_thread(self.ledger.record_many, rule_ids_by_row_key)
+
+    async def take_items_online(self, action_rows: list[ActionRowV2]):
+        ledger_max_age = datetime.timedelta(hours=self.settings.ledger_max_age_hours)
+        row_item_ids = []
+        searched_rows = []
+        for action_row in action_rows:
+            rule_ids = await asyncio.to_thread(self.ledger.get, action_row.row_key, ledger_max_age)
+            if rule_ids is None:
+                searched_rows.append(action_row)
+            else:
+                row_item_ids.append((action_row, rule_ids))
+
+        # Rows without a fresh ledger entry fall back to searching the rules by keyword.
+        items_by_keyword = await self._search_keywords(searched_rows, URL.UPDATE_ITEMS_API)
+        for action_row in searched_rows:
+            items = items_by_keyword[action_row.keyword]
+            if not items:
+                self.class_logger.info(f'No items were searched with the keyword: {action_row.keyword}. Skipped.')
+                continue
+            row_item_ids.append((action_row, [item.id for item in items]))
+
+        # Rules that rows outside this batch still hold, e.g. an overlapping row whose window is still open, are kept.
+        held_rule_ids = await asyncio.to_thread(
+            self.ledger.held_rule_ids,
+            [item_id for _, ids in row_item_ids for item_id in ids],
+            [action_row.row_key for action_row in action_rows],
+        )
+        if held_rule_ids:
+            row_item_ids = [
+                (action_row, [item_id for item_id in ids if str(item_id) not in held_rule_ids])
+                for action_row, ids in row_item_ids
+            ]
+            self.class_logger.info(f'{len(held_rule_ids)} rules are still held by other rows. Kept.')
+
+        item_ids = dict.fromkeys(item_id for _, ids in row_item_ids for item_id in ids)
+        payloads = [{'IDs': chunk} for chunk in split_into_chunks(list(item_ids), self.settings.update_chunk_size)]
+        responses = await self._send_updates('DELETE', payloads, 'online')
+        deleted_ids = {
+            item_id for payload, response in zip(payloads, responses) if response is not None
+            for item_id in payload['IDs']
+        }
+        self.metrics.inc('t4auto_items_affected_total', len(deleted_ids), action='online')
+
+        applied_row_keys = []
+        remaining_ids_by_row_key = {}
+        for action_row, ids in row_item_ids:
+            remaining_ids = [item_id for item_id in ids if item_id not in deleted_ids]
+            if not remaining_ids:
+                self.class_logger.info(f'The items were online with the keyword: {action_row.keyword}, '
+                                       f'total {len(ids)} items.')
+                applied_row_keys.append(action_row.row_key)
+            else:
+                self.class_logger.error(f'Failed to take items online with the keyword: {action_row.keyword}, '
+                                        f'{len(remaining_ids)} of {len(ids)} items are still offline.')
+                # The next attempt deletes only the rules that are left.
+                remaining_ids_by_row_key[action_row.row_key] = remaining_ids
+        await asyncio.to_thread(self.ledger.remove, applied_row_keys)
+        if remaining_ids_by_row_key:
+            await asyncio.to_thread(self.ledger.record_many, remaining_ids_by_row_key)
+
+    async def _run_recurring(self, action_rows: list[ActionRowV2]):
+        if action_rows[0].action_type == ActionType.START:
+            action = self.take_items_offline
+        else:
+            action = self.take_items_online
+        trigger = action_trigger(action_rows[0])
+        fire_time = trigger.next_fire_time(None, datetime.datetime.now())
+        while fire_time is not None:
+            await asyncio.sleep(max(time_difference_seconds(fire_time, datetime.datetime.now()), 0))
+
+            # As on the timeline, a run later than the grace, e.g. after the computer slept, is skipped.
+            lateness = time_difference_seconds(datetime.datetime.now(), fire_time)
+            if lateness > self.settings.misfire_grace_seconds:
+                self.class_logger.warning(f'Skipped {action.__name__}, which was due at '
+                                          f'{fire_time.strftime('%Y-%m-%d %H:%M:%S')}, {lateness:.0f} seconds ago.')
+            else:
+                try:
+                    await self._run_in_lanes(action_rows, action)
+                except Exception as e:
+                    # The next occurrences still run.
+                    self.class_logger.exception(f'{action.__name__} failed: {e}')
+            fire_time = trigger.next_fire_time(fire_time, datetime.datetime.now())
+
+    async def run_scheduler(self, actions: list[ActionRowV2]):
+        """
+        Runs the actions on the days of their rows until cancelled.
+        """
+        await asyncio.gather(*[self._run_recurring(action_rows) for action_rows in batch_action_rows(actions).values()])
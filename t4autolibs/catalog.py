@@ -0,0 +1,166 @@
+import datetime
+import re
+import sqlite3
+from array import array
+from bisect import bisect_right
+from contextlib import closing
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from t4autolibs.items import Item
+
+TOKEN_PATTERN = re.compile(r'\w+')
+CATALOG_SNAPSHOT_FILE = 'catalog.sqlite3'
+
+
+class Catalog:
+    """
+    In-memory index of the active PLUs, used to resolve keywords without searching on the server.
+
+    A keyword query is a comma-separated list of terms:
+        * `chicken burger` matches items whose online name or PLU code contains the phrase.
+        * `-spicy` excludes items matching the phrase.
+        * `#1001` matches the item whose PLU code is exactly 1001.
+    """
+
+    def __init__(self, items: Iterable[Item]):
+        self.plu_codes = []
+        self.long_names = []
+        self._search_texts = []
+        self._rows_by_plu_code = {}
+        self._index = {}  # token -> array of row indices
+
+        for item in items:
+            row_idx = len(self.plu_codes)
+            self.plu_codes.append(item.plu_code)
+            self.long_names.append(item.long_name)
+            search_text = f'{item.long_name} {item.plu_code}'.lower()
+            self._search_texts.append(search_text)
+            self._rows_by_plu_code[str(item.plu_code)] = row_idx
+            for token in set(TOKEN_PATTERN.findall(search_text)):
+                self._index.setdefault(token, array('I')).append(row_idx)
+
+        # All indexed tokens joined in one string, so that tokens containing a substring are found by str.find.
+        self._tokens = list(self._index)
+        self._vocabulary = '\n'.join(self._tokens)
+        self._token_offsets = array('I')
+        offset = 0
+        for token in self._tokens:
+            self._token_offsets.append(offset)
+            offset += len(token) + 1
+
+    def __len__(self):
+        return len(self.plu_codes)
+
+    def _tokens_containing(self, substring: str):
+        position = self._vocabulary.find(substring)
+        while position != -1:
+            token_idx = bisect_right(self._token_offsets, position) - 1
+            yield self._tokens[token_idx]
+            if token_idx + 1 == len(self._tokens):
+                return
+            position = self._vocabulary.find(substring, self._token_offsets[token_idx + 1])
+
+    def _match_phrase(self, phrase: str) -> set[int]:
+        phrase = phrase.lower()
+        tokens = TOKEN_PATTERN.findall(phrase)
+        if not tokens:
+            return set()
+
+        # Narrow down candidates with the inverted index, then confirm the whole phrase as a substring.
+        candidates = None
+        for token in tokens:
+            rows = set()
+            for indexed_token in self._tokens_containing(token):
+                rows.update(self._index[indexed_token])
+            candidates = rows if candidates is None else candidates & rows
+            if not candidates:
+                return set()
+
+        return {row_idx for row_idx in candidates if phrase in self._search_texts[row_idx]}
+
+    def search(self, query: str) -> list[Item]:
+        included = set()
+        excluded = set()
+        for term in query.split(','):
+            term = term.strip()
+            if term.startswith('#'):
+                row_idx = self._rows_by_plu_code.get(term[1:].strip())
+                if row_idx is not None:
+                    included.add(row_idx)
+            elif term.startswith('-'):
+                excluded |= self._match_phrase(term[1:].strip())
+            elif term:
+                included |= self._match_phrase(term)
+
+        return [Item(self.plu_codes[row_idx], self.long_names[row_idx]) for row_idx in sorted(included - excluded)]
+
+
+class CatalogSnapshot:
+    """
+    On-disk copy of the active PLUs, so that a restart does not download every page again.
+    """
+
+    def __init__(self, path: Path = Path(CATALOG_SNAPSHOT_FILE)):
+        self.path = path
+        with closing(self._connect()) as connection, connection:
+            # plu_code has no declared type so that integer and text PLU codes keep their type.
+            connection.execute('CREATE TABLE IF NOT EXISTS items (plu_code PRIMARY KEY, long_name TEXT NOT NULL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+    def load(self) -> Iterator[Item]:
+        """
+        Yields the stored items in the order they were added, reading them from disk as they are consumed.
+        """
+        with closing(self._connect()) as connection:
+            for plu_code, long_name in connection.execute('SELECT plu_code, long_name FROM items ORDER BY rowid'):
+                yield Item(plu_code, long_name)
+
+    def _get_meta(self, key):
+        with closing(self._connect()) as connection:
+            row = connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    @property
+    def last_synced(self) -> datetime.datetime | None:
+        value = self._get_meta('last_synced')
+        return datetime.datetime.fromisoformat(value) if value else None
+
+    @property
+    def n_changed_rows(self) -> int | None:
+        return self._get_meta('n_changed_rows')
+
+    def sync(self, items: Iterable[Item], batch_size: int = 500) -> int:
+        """
+        Writes only the rows that were added, renamed or removed since the last sync. Returns the number of them.
+
+        The items are compared with the stored rows batch by batch as they arrive, so neither side is held in memory
+        at once. If consuming the items raises, nothing is written.
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.execute('CREATE TEMP TABLE seen (plu_code PRIMARY KEY)')
+            n_changed_rows = 0
+            items = iter(items)
+            while batch := list(islice(items, batch_size)):
+                latest = {item.plu_code: item.long_name for item in batch}
+                placeholders = ', '.join('?' * len(latest))
+                stored = dict(connection.execute(
+                    f'SELECT plu_code, long_name FROM items WHERE plu_code IN ({placeholders})', list(latest)))
+                upserted = [(plu_code, long_name) for plu_code, long_name in latest.items()
+                            if stored.get(plu_code) != long_name]
+                connection.executemany('INSERT OR REPLACE INTO items (plu_code, long_name) VALUES (?, ?)', upserted)
+                connection.executemany('INSERT OR IGNORE INTO seen (plu_code) VALUES (?)',
+                                       [(plu_code,) for plu_code in latest])
+                n_changed_rows += len(upserted)
+
+            n_changed_rows += connection.execute(
+                'DELETE FROM items WHERE plu_code NOT IN (SELECT plu_code FROM seen)').rowcount
+            connection.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', [
+                ('last_synced', datetime.datetime.now().isoformat()),
+                ('n_changed_rows', n_changed_rows),
+            ])
+        return n_changed_rows
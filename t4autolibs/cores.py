@@ -1,22 +1,50 @@
 import datetime
+import functools
 import logging
-from dataclasses import dataclass
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields, asdict, replace
 from enum import IntEnum
-from threading import Event
+from pathlib import Path
+from threading import Event, Lock
+from typing import Callable
 
 import requests
-from apscheduler.schedulers.qt import QtScheduler
+from requests.adapters import HTTPAdapter
 
-SECONDS_REQUEST_INTERVAL = 10
+from t4autolibs.catalog import Catalog, CatalogSnapshot, CATALOG_SNAPSHOT_FILE
+from t4autolibs.dispatcher import Dispatcher
+from t4autolibs.items import Item
+from t4autolibs.job_store import JobStore, JOB_STORE_FILE
+from t4autolibs.ledger import RuleLedger, LEDGER_FILE
+from t4autolibs.logs import AccountLogger, configure_logging, shutdown_logging
+from t4autolibs.metrics import Metrics, MetricsServer
+from t4autolibs.recurrence import Recurrence, RecurrenceTrigger
+from t4autolibs.rule_cache import RuleCache
+from t4autolibs.saved_session import SavedSession, SESSION_FILE
+from t4autolibs.stores import Store, StoreCache, StoreIndex, STORE_CACHE_FILE
+from t4autolibs.timeline import IntervalTrigger, Timeline, TimelineEvent
+from t4autolibs.transport import AdaptiveRateLimiter, Transport
 
 
 @dataclass
 class URL:
-    LOGIN_API = 'https://t4australia.redcatcloud.com.au/api/v1/login'
-    LOGOUT_API = 'https://t4australia.redcatcloud.com.au/auth/logout'
-    GET_ITEMS_API = 'https://t4australia.redcatcloud.com.au/api/v1/plus-active/'
-    UPDATE_ITEMS_API = 'https://t4australia.redcatcloud.com.au/api/v1/pluavailabilityrules'
-    GET_STORES_API = 'https://t4australia.redcatcloud.com.au/api/v1/config/lookup/stores/'
+    HOST = 'https://t4australia.redcatcloud.com.au'
+    LOGIN_API = f'{HOST}/api/v1/login'
+    LOGOUT_API = f'{HOST}/auth/logout'
+    GET_ITEMS_API = f'{HOST}/api/v1/plus-active/'
+    UPDATE_ITEMS_API = f'{HOST}/api/v1/pluavailabilityrules'
+    GET_STORES_API = f'{HOST}/api/v1/config/lookup/stores/'
+
+    @classmethod
+    def use_host(cls, host: str):
+        """
+        Points every API at another host, e.g. a local stand-in server.
+        """
+        for name in ['LOGIN_API', 'LOGOUT_API', 'GET_ITEMS_API', 'UPDATE_ITEMS_API', 'GET_STORES_API']:
+            setattr(cls, name, getattr(cls, name).replace(cls.HOST, host, 1))
+        cls.HOST = host
 
 
 class ActionType(IntEnum):
@@ -47,6 +75,14 @@ class ActionRowV2:
     action_type: ActionType
     reason: str
     store_id: int
+    # The days on which the action fires, at the time of day of action_time.
+    recurrence: Recurrence = Recurrence()
+    # Identifies the schedule row in the job store and the ledger; the offline and online actions of a row share it.
+    row_key: str = ''
+
+    def __post_init__(self):
+        if not self.row_key:
+            self.row_key = f'{self.store_id}|{self.keyword}|{self.reason}'
 
 
 @dataclass
@@ -55,18 +91,57 @@ class UserInfo:
     password: str
 
 
-@dataclass
-class Store:
-    id: int
-    name: str
-
-
 @dataclass
 class LoginStatus:
     success: bool
     message: str
 
 
+class SearchError(Exception):
+    pass
+
+
+class Cancelled(Exception):
+    """
+    Raised when a long operation, e.g. starting the scheduler while the catalog downloads, is cancelled.
+    """
+
+
+@dataclass
+class AgentSettings:
+    n_items_per_page: int = 100
+    max_concurrent_requests: int = 4
+    prefetch_lead_seconds: int = 60
+    prefetch_max_age_seconds: int = 180
+    local_catalog: bool = False
+    catalog_refresh_minutes: int = 60
+    ledger_max_age_hours: int = 24
+    misfire_grace_seconds: int = 300
+    max_concurrent_jobs: int = 2
+    request_timeout_seconds: float = 30
+    max_retries: int = 3
+    backoff_base_seconds: float = 0.5
+    backoff_max_seconds: float = 30
+    max_requests_per_second: float = 50
+    min_requests_per_second: float = 1
+    log_max_bytes: int = 10 * 2 ** 20
+    log_backup_count: int = 5
+    log_rotate_when: str = ''
+    log_item_details: bool = False
+    update_chunk_size: int = 500
+    update_chunk_retries: int = 2
+    rule_cache_max_age_seconds: int = 180
+    max_concurrent_actions: int = 4
+    store_cache_max_age_hours: int = 24
+    persist_session: bool = False
+    metrics_port: int = 0
+
+    @classmethod
+    def from_dict(cls, config: dict):
+        names = {field.name for field in fields(cls)}
+        return cls(**{key: value for key, value in config.items() if key in names})
+
+
 def time_difference_seconds(time1: datetime.datetime, time2: datetime.datetime):
     """
     Returns seconds of (time1 - time2).
@@ -74,6 +149,148 @@ def time_difference_seconds(time1: datetime.datetime, time2: datetime.datetime):
     return (time1 - time2).total_seconds()
 
 
+def latest_fire_time(action_time: datetime.datetime, now: datetime.datetime):
+    """
+    Returns the latest daily occurrence of action_time that is not after now.
+    """
+    n_days = max((now - action_time) // datetime.timedelta(days=1), 0)
+    return action_time + datetime.timedelta(days=n_days)
+
+
+def login_form(user_info: UserInfo) -> dict:
+    return {
+        'username': user_info.username,
+        'psw': user_info.password,
+        'auth_type': 'U',
+        'next': '/admin',
+        'save_session': True,
+    }
+
+
+def split_into_chunks(values: list, chunk_size: int) -> list[list]:
+    return [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+
+
+def measured_job(action: str):
+    """
+    Records how late a batch of action rows started, how long it took and whether it failed, then exports the metrics.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, action_rows: list[ActionRowV2]):
+            now = datetime.datetime.now()
+            lateness = time_difference_seconds(now, latest_fire_time(action_rows[0].action_time, now))
+            self.metrics.observe('t4auto_job_start_lateness_seconds', lateness, action=action)
+            started_at = time.perf_counter()
+            try:
+                return method(self, action_rows)
+            except Exception:
+                self.metrics.inc('t4auto_job_failures_total', action=action)
+                raise
+            finally:
+                self.metrics.observe('t4auto_job_duration_seconds', time.perf_counter() - started_at, action=action)
+                self._export_metrics()
+        return wrapper
+    return decorator
+
+
+def row_stores(row: dict) -> list[Store]:
+    """
+    Returns the locations of a row of the ItemTable section of config.json. Rows saved by earlier versions have a
+    single store.
+    """
+    stores = row.get('stores')
+    if stores is None:
+        stores = [row['store']] if row['store']['id'] != -1 else []
+    return [Store(store['id'], store['name']) for store in stores]
+
+
+def collect_action_rows_from_config(config: dict, now: datetime.datetime) -> list[ActionRowV2]:
+    """
+    Converts the ItemTable section of config.json into the offline and online actions of today, for every location of
+    every row.
+    """
+    action_row_list = []
+    for row in config['ItemTable'] or []:
+        if row['keyword'] == '':
+            # Keyword is not set; skipped.
+            continue
+
+        start_hour, start_minute = row['start_time']
+        end_hour, end_minute = row['end_time']
+        recurrence = Recurrence.from_dict(row.get('recurrence'))
+        # Rows of the same store, keyword and reason are told apart by their windows and recurrences.
+        window = f'{start_hour:02}:{start_minute:02}-{end_hour:02}:{end_minute:02}|{recurrence.to_text()}'
+        # A row whose location is not set has no stores and is skipped.
+        for store in row_stores(row):
+            row_key = f'{store.id}|{row['keyword']}|{row['reason']}|{window}'
+            action_row_list.append(ActionRowV2(
+                keyword=row['keyword'],
+                action_time=now.replace(hour=start_hour, minute=start_minute, second=0, microsecond=0),
+                action_type=ActionType.START,
+                reason=row['reason'],
+                store_id=store.id,
+                recurrence=recurrence,
+                row_key=row_key,
+            ))
+            action_row_list.append(ActionRowV2(
+                keyword=row['keyword'],
+                action_time=now.replace(hour=end_hour, minute=end_minute, second=0, microsecond=0),
+                action_type=ActionType.END,
+                reason=row['reason'],
+                store_id=store.id,
+                # The items of a window that crosses midnight are taken online on the next day.
+                recurrence=(recurrence.shifted(1) if (end_hour, end_minute) < (start_hour, start_minute)
+                            else recurrence),
+                row_key=row_key,
+            ))
+
+    return action_row_list
+
+
+def batch_action_rows(actions: list[ActionRowV2]) -> dict[tuple, list[ActionRowV2]]:
+    """
+    Groups the actions sharing the fire time, the action type, the reason and the recurrence, which are sent in the
+    same requests.
+    """
+    batches = {}
+    for action in actions:
+        batches.setdefault((action.action_time, action.action_type, action.reason, action.recurrence),
+                           []).append(action)
+    return batches
+
+
+def action_trigger(action_row: ActionRowV2, lead: datetime.timedelta = datetime.timedelta()) -> RecurrenceTrigger:
+    """
+    Returns the trigger firing lead before every occurrence of the action.
+    """
+    fire_time = action_row.action_time - lead
+    # E.g. a prefetch a minute before an action at midnight fires on the day before.
+    n_days = (fire_time.date() - action_row.action_time.date()).days
+    return RecurrenceTrigger(fire_time.time(), action_row.recurrence.shifted(n_days))
+
+
+def is_within_offline_window(offline_action: ActionRowV2, online_action: ActionRowV2, moment: datetime.datetime):
+    """
+    Returns whether moment is between an offline time of the row and the following online time. The window crosses
+    midnight if the online time is earlier.
+    """
+    offline_time = offline_action.action_time.time()
+    online_time = online_action.action_time.time()
+    # Only a window that started today or yesterday can include moment.
+    for n_days in [0, 1]:
+        day = moment.date() - datetime.timedelta(days=n_days)
+        if not offline_action.recurrence.occurs_on(day):
+            continue
+        window_start = datetime.datetime.combine(day, offline_time)
+        window_end = datetime.datetime.combine(day, online_time)
+        if online_time < offline_time:
+            window_end += datetime.timedelta(days=1)
+        if window_start <= moment < window_end:
+            return True
+    return False
+
+
 class Agent:
 
     def __init__(self):
@@ -201,49 +418,177 @@ class Agent:
 
 class AgentV2:
 
-    def __init__(self):
+    def __init__(self, settings: AgentSettings | None = None, timeline: Timeline | None = None,
+                 data_dir: Path = Path('.'), metrics: Metrics | None = None, metrics_dir: Path | None = None,
+                 account: str = ''):
         self.stores = []
+        self.store_index = StoreIndex()
+        self.settings = settings if settings else AgentSettings()
+        self._prefetched_items = {}
+        self.catalog = None
+        self.data_dir = data_dir
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self._catalog_snapshot = None
+        self.ledger = RuleLedger(self.data_dir / LEDGER_FILE)
+        self.rule_cache = RuleCache(datetime.timedelta(seconds=self.settings.rule_cache_max_age_seconds))
+        self.job_store = JobStore(self.data_dir / JOB_STORE_FILE)
+        self.store_cache = StoreCache(self.data_dir / STORE_CACHE_FILE)
+        self.saved_session = SavedSession(self.data_dir / SESSION_FILE)
+        # The credentials that logging in again uses, once the server has accepted them.
+        self._user_info = None
+        # The credentials typed when a saved session was resumed, which the server has not checked yet.
+        self._unverified_user_info = None
+        # Requests on several threads may find the session expired at once; one of them logs in again for all.
+        self._relogin_lock = Lock()
+        self._session_renewed_at = time.perf_counter()
+        # Names the account in the log and the metrics when several agents share the process, e.g. in a SessionPool.
+        self.account = account
+        # A registry may be shared by several agents; its owner serves it, and every agent writes it into metrics_dir.
+        self._owns_metrics = metrics is None
+        if metrics is None:
+            self.metrics = Metrics()
+        else:
+            self.metrics = metrics.labelled(account=account) if account else metrics
+        self.metrics_dir = metrics_dir if metrics_dir else data_dir
+        self._metrics_server = None
         self._initialize_class_logger()
+        self._rate_limiter = self._create_rate_limiter()
         self._start_new_session()
-        self._scheduler = QtScheduler()
-        self._scheduler.start()
+        self._executor = ThreadPoolExecutor(max_workers=self.settings.max_concurrent_requests)
+        self.dispatcher = Dispatcher(self.settings.max_concurrent_actions, self.metrics, self.class_logger)
+        # Prefetches and catalog refreshes; the actions themselves run on the dispatcher.
+        self._job_executor = ThreadPoolExecutor(max_workers=self.settings.max_concurrent_jobs)
+        # A timeline may be shared by several agents, e.g. the accounts of a SessionPool.
+        self._timeline = timeline if timeline else Timeline()
+        self._batch_events = {}  # (action time, action type, reason) -> (action rows, events)
+        self._catalog_event = None
+        if not self._timeline.running:
+            self._timeline.start()
 
-    def _initialize_class_logger(self):
-        self.class_logger = logging.getLogger('t4auto')
-        self.class_logger.setLevel(logging.DEBUG)
+    def load_config(self, config: dict):
+        if config.get('AgentSettings') is None:
+            return
+
+        log_settings = self._log_settings()
+        self.settings = AgentSettings.from_dict(config['AgentSettings'])
+        if self._log_settings() != log_settings:
+            shutdown_logging()
+            self._initialize_class_logger()
+        self.rule_cache.max_age = datetime.timedelta(seconds=self.settings.rule_cache_max_age_seconds)
+        self.dispatcher.shutdown(wait=False)
+        self.dispatcher = Dispatcher(self.settings.max_concurrent_actions, self.metrics, self.class_logger)
+        self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(max_workers=self.settings.max_concurrent_requests)
+        self._job_executor.shutdown(wait=False)
+        self._job_executor = ThreadPoolExecutor(max_workers=self.settings.max_concurrent_jobs)
+        self._mount_adapters()
+        self._rate_limiter = self._create_rate_limiter()
+        self.transport = self._create_transport()
+        self.class_logger.debug(f'load_config() -> {self.settings}')
+
+    def dump_config(self) -> dict:
+        config = {
+            'AgentSettings': asdict(self.settings),
+        }
+        return config
 
-        formatter = logging.Formatter('[%(asctime)s] %(name)s (%(levelname)s): %(message)s',
-                                      '%Y-%m-%d %H:%M:%S')
-        fh = logging.FileHandler('t4auto_log.txt')
-        fh.setLevel(logging.DEBUG)
-        fh.setFormatter(formatter)
-        self.class_logger.addHandler(fh)
+    def _log_settings(self) -> tuple:
+        return self.settings.log_max_bytes, self.settings.log_backup_count, self.settings.log_rotate_when
 
-        ch = logging.StreamHandler()
-        ch.setLevel(logging.INFO)
-        ch.setFormatter(formatter)
-        self.class_logger.addHandler(ch)
+    def _initialize_class_logger(self):
+        # The handlers are shared by every agent in the process and set up by the first one.
+        configure_logging(*self._log_settings())
+        logger = logging.getLogger('t4auto')
+        self.class_logger = AccountLogger(logger, {'account': self.account}) if self.account else logger
 
     def _start_new_session(self):
         self.session = requests.session()
         self.session.headers['User-Agent'] = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) '
                                               'AppleWebKit/537.36 (KHTML, like Gecko) '
                                               'Chrome/124.0.0.0 Safari/537.36')
+        self._mount_adapters()
+        self.transport = self._create_transport()
         self.class_logger.debug('_start_new_session()')
 
+    def _create_rate_limiter(self):
+        return AdaptiveRateLimiter(
+            max_rate=self.settings.max_requests_per_second,
+            min_rate=self.settings.min_requests_per_second,
+            burst=self.settings.max_concurrent_requests,
+        )
+
+    def _create_transport(self):
+        return Transport(
+            self.session,
+            self._rate_limiter,
+            timeout_seconds=self.settings.request_timeout_seconds,
+            max_retries=self.settings.max_retries,
+            backoff_base_seconds=self.settings.backoff_base_seconds,
+            backoff_max_seconds=self.settings.backoff_max_seconds,
+            relogin=self._relogin,
+            metrics=self.metrics,
+            logger=self.class_logger,
+        )
+
+    def _mount_adapters(self):
+        # The connection pool must hold at least as many connections as pages fetched concurrently.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.settings.max_concurrent_requests)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _relogin(self, sent_at: float) -> bool:
+        """
+        Logs in again after a request sent at sent_at found the session expired, unless another request has already
+        renewed the session since then.
+        """
+        with self._relogin_lock:
+            if self._session_renewed_at > sent_at:
+                return True
+            user_info = self._user_info or self._unverified_user_info
+            if user_info is None:
+                return False
+
+            try:
+                response = self.transport.request('POST', URL.LOGIN_API, allow_relogin=False,
+                                                  data=login_form(user_info))
+                success = response.status_code == 200 and response.json()['success']
+            except (requests.RequestException, ValueError) as e:
+                self.class_logger.debug(f'POST {URL.LOGIN_API} failed: {e}')
+                success = False
+            self.class_logger.info(f'Logging in again {"succeeded" if success else "failed"}.')
+            if success:
+                self._user_info = user_info
+                self._unverified_user_info = None
+                self._session_renewed_at = time.perf_counter()
+                self._save_session(user_info.username)
+            elif user_info is self._unverified_user_info:
+                # Not tried again, so that a mistyped password does not lock the account.
+                self._unverified_user_info = None
+                self.class_logger.error('The saved session has expired and the password entered at login was '
+                                        'rejected. Log out and log in again with the right password.')
+            return success
+
     def login(self, user_info: UserInfo) -> LoginStatus:
-        data = {
-            'username': user_info.username,
-            'psw': user_info.password,
-            'auth_type': 'U',
-            'next': '/admin',
-            'save_session': True,
-        }
-        response = self.session.post(URL.LOGIN_API, data=data)
+        if self.settings.persist_session and self._resume_session(user_info):
+            message = 'Login successfully with the saved session; the password is checked when the session expires'
+            self.class_logger.info(f'{message}')
+            return LoginStatus(True, message)
+
+        try:
+            response = self.transport.request('POST', URL.LOGIN_API, allow_relogin=False,
+                                              data=login_form(user_info))
+        except requests.RequestException as e:
+            message = f'Login failed with a connection error: {e}'
+            self.class_logger.info(f'{message}')
+            return LoginStatus(False, message)
+
         if response.status_code == 200:
             response = response.json()
             if response['success']:
-                self._get_store_ids()
+                self._user_info = user_info
+                self._session_renewed_at = time.perf_counter()
+                self._save_session(user_info.username)
+                self._load_stores()
                 success = True
                 message = 'Login successfully'
             else:
@@ -256,20 +601,80 @@ class AgentV2:
         self.class_logger.info(f'{message}')
         return LoginStatus(success, message)
 
-    def _get_store_ids(self):
-        response = self.session.get(URL.GET_STORES_API, params={'restricted': 'true'}).json()
+    def _resume_session(self, user_info: UserInfo) -> bool:
+        """
+        Reuses the saved cookies of the account if the server still accepts them. The store lookup checks them, so the
+        stores are up to date as well.
+        """
+        cookies = self.saved_session.load(user_info.username)
+        if cookies is None:
+            return False
+
+        self.session.cookies.update(cookies)
+        try:
+            stores = self._get_store_ids(allow_relogin=False)
+        except (requests.RequestException, ValueError) as e:
+            self.class_logger.info(f'The saved session could not be used: {e}')
+            self.session.cookies.clear()
+            return False
+
+        self._user_info = None
+        self._unverified_user_info = user_info
+        self.store_cache.save(user_info.username, stores)
+        self._set_stores(stores)
+        return True
+
+    def _save_session(self, username: str):
+        if self.settings.persist_session:
+            self.saved_session.save(username, self.session.cookies)
+
+    def _load_stores(self):
+        """
+        Uses the cached stores of the account at once, and fetches them in the background if they are missing or older
+        than store_cache_max_age_hours, so that login does not wait for the store lookup.
+        """
+        username = self._user_info.username
+        stores, synced_at = self.store_cache.load(username)
+        self._set_stores(stores)
+        max_age = datetime.timedelta(hours=self.settings.store_cache_max_age_hours)
+        if synced_at is None or datetime.datetime.now() - synced_at > max_age:
+            self._job_executor.submit(self._refresh_stores, username)
+
+    def _refresh_stores(self, username: str):
+        try:
+            stores = self._get_store_ids()
+        except (requests.RequestException, ValueError) as e:
+            self.class_logger.error(f'Failed to refresh the stores: {e}')
+            return
+        self.store_cache.save(username, stores)
+        if self._user_info is not None and self._user_info.username == username:
+            # Not logged out or logged in as another user in the meantime.
+            self._set_stores(stores)
+        self.class_logger.info(f'The stores were refreshed, total {len(stores)} stores.')
+
+    def _set_stores(self, stores: list[Store]):
+        # The index is built once per store list; the location editors search it as the user types.
+        self.store_index = StoreIndex(stores)
+        self.stores = list(self.store_index)
+
+    def _get_store_ids(self, allow_relogin: bool = True) -> list[Store]:
+        response = self.transport.request('GET', URL.GET_STORES_API, allow_relogin=allow_relogin,
+                                          params={'restricted': 'true'}).json()
         if not response['success']:
             raise ValueError('Response["success"] is false.\n' + str(response))
 
-        for data in response['data']:
-            store_name = data['name']
-            store_id = data['value']
-            self.stores.append(Store(store_id, store_name))
-        self.class_logger.debug(f'_get_store_ids() -> {self.stores}')
+        stores = [Store(data['value'], data['name']) for data in response['data']]
+        self.class_logger.debug(f'_get_store_ids() -> {stores}')
+        return stores
 
     def logout(self) -> LoginStatus:
-        response = self.session.get(URL.LOGOUT_API)
+        response = self.transport.request('GET', URL.LOGOUT_API, allow_relogin=False)
         if response.status_code == 200:
+            self._user_info = None
+            self._unverified_user_info = None
+            self._set_stores([])
+            # The server has ended the session.
+            self.saved_session.delete()
             self.session.close()
             self._start_new_session()
             success = True
@@ -280,14 +685,15 @@ class AgentV2:
         self.class_logger.info(f'{message}')
         return LoginStatus(success, message)
 
-    def _search_items_from_api(self, keyword, api):
-        n_items_per_page = 100
-        params = {
-            'qv': keyword,
-            'start': 0,
-            'limit': n_items_per_page,
-        }
-        response = self.session.get(api, params=params).json()
+    def _get_items_page(self, api, params):
+        # A page that cannot be fetched fails the search like a page the server refused, not the whole action.
+        try:
+            response = self.transport.request('GET', api, params=params).json()
+        except (requests.RequestException, ValueError) as e:
+            self.class_logger.error(f'Failed to search items: {e}')
+            self.class_logger.debug(f'GET {api} with params:')
+            self.class_logger.debug(f'\t{params}')
+            return None
         if not response['success']:
             self.class_logger.error(f'Failed to search items.')
             self.class_logger.debug(f'GET {api} with params:')
@@ -295,102 +701,607 @@ class AgentV2:
             self.class_logger.debug(f'Response:')
             self.class_logger.debug(f'\t{response}')
             return None
+        return response
 
-        items = response['data']
-        start_idx = 0
-        while start_idx + response['count'] < response['total']:
-            start_idx += n_items_per_page
-            params['start'] = start_idx
-            response = self.session.get(api, params=params).json()
-            if not response['success']:
-                self.class_logger.error(f'Failed to search items.')
-                self.class_logger.debug(f'GET {api} with params:')
-                self.class_logger.debug(f'\t{params}')
-                self.class_logger.debug(f'Response:')
-                self.class_logger.debug(f'\t{response}')
-                return None
-            items += response['data']
+    def _search_items_from_api(self, keyword, api, cancel_event: Event | None = None) -> list[Item] | None:
+        try:
+            return list(self._stream_items_from_api(keyword, api, cancel_event))
+        except SearchError:
+            return None
+
+    def _stream_items_from_api(self, keyword, api, cancel_event: Event | None = None):
+        """
+        Yields the items of a search one by one, page by page as the pages arrive. Raises SearchError if a page cannot
+        be fetched.
+        """
+        path = api.removeprefix(URL.HOST).rstrip('/')
+        with self.metrics.time('t4auto_search_seconds', path=path):
+            try:
+                for page_items in self._iter_items_from_api(keyword, api, path, cancel_event):
+                    yield from page_items
+            except SearchError:
+                self.metrics.inc('t4auto_search_failures_total', path=path)
+                raise
+
+    def _iter_items_from_api(self, keyword, api, path, cancel_event: Event | None = None):
+        """
+        Yields the items of every page in page order, as soon as the page arrives, while the next pages are fetched.
+        Raises SearchError if a page cannot be fetched, and Cancelled if cancel_event is set between two pages.
+        """
+        n_items_per_page = self.settings.n_items_per_page
+        params = {
+            'qv': keyword,
+            'start': 0,
+            'limit': n_items_per_page,
+        }
+        response = self._get_items_page(api, params)
+        self.metrics.inc('t4auto_search_pages_total', path=path)
+        yield self._project_page(keyword, response)
+        if response['count'] >= response['total']:
+            return
+
+        # The first page reports the total. At most max_concurrent_requests of the remaining pages are fetched ahead,
+        # so that a slow consumer never holds more than that many full pages.
+        remaining_params = [
+            params | {'start': start_idx}
+            for start_idx in range(n_items_per_page, response['total'], n_items_per_page)
+        ]
+        self.metrics.inc('t4auto_search_pages_total', len(remaining_params), path=path)
+        pending = deque()
+        try:
+            for page_params in remaining_params:
+                pending.append(self._executor.submit(self._get_items_page, api, page_params))
+                if len(pending) >= self.settings.max_concurrent_requests:
+                    self._check_cancelled(keyword, cancel_event)
+                    yield self._project_page(keyword, pending.popleft().result())
+            while pending:
+                self._check_cancelled(keyword, cancel_event)
+                yield self._project_page(keyword, pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
+
+    @staticmethod
+    def _check_cancelled(keyword, cancel_event: Event | None):
+        if cancel_event is not None and cancel_event.is_set():
+            raise Cancelled(f'Cancelled the search with the keyword: {keyword}')
+
+    @staticmethod
+    def _project_page(keyword, response) -> list[Item]:
+        if response is None:
+            raise SearchError(f'Failed to search items with the keyword: {keyword}')
+        return [Item.from_json(data) for data in response['data']]
+
+    def _load_catalog(self, cancel_event: Event | None = None):
+        self._catalog_snapshot = CatalogSnapshot(self.data_dir / CATALOG_SNAPSHOT_FILE)
+        last_synced = self._catalog_snapshot.last_synced
+        if last_synced is not None:
+            self.catalog = Catalog(self._catalog_snapshot.load())
+            self.class_logger.info(f'The local catalog was loaded, total {len(self.catalog)} items, '
+                                   f'last synced at {last_synced.strftime('%Y-%m-%d %H:%M:%S')}.')
+
+        max_age = datetime.timedelta(minutes=self.settings.catalog_refresh_minutes)
+        if last_synced is None or datetime.datetime.now() - last_synced > max_age:
+            self._refresh_catalog(cancel_event)
+
+    def _refresh_catalog(self, cancel_event: Event | None = None):
+        # An empty keyword lists every active PLU. The pages are written to the snapshot as they arrive and the catalog
+        # is built from the snapshot, so the search result is never held in memory as a whole.
+        try:
+            n_changed_rows = self._catalog_snapshot.sync(
+                self._stream_items_from_api('', URL.GET_ITEMS_API, cancel_event))
+        except SearchError:
+            self.class_logger.error('Failed to refresh the local catalog.')
+            return
+
+        self.catalog = Catalog(self._catalog_snapshot.load())
+        self.class_logger.info(f'The local catalog was refreshed, total {len(self.catalog)} items, '
+                               f'{n_changed_rows} items changed.')
+
+    def _find_items(self, keyword):
+        if self.catalog is not None:
+            return self.catalog.search(keyword)
+
+        items = self._get_prefetched_items(keyword)
+        if items is None:
+            items = self._search_items_from_api(keyword, URL.GET_ITEMS_API)
         return items
 
-    def _take_items_offline_by_search(self, action_row: ActionRowV2):
-        items = self._search_items_from_api(action_row.keyword, URL.GET_ITEMS_API)
-        self.class_logger.info(f'Taking items offline with the keyword: {action_row.keyword}')
-        if items:
-            self.class_logger.info('The following items were searched:')
-            for item in items:
-                self.class_logger.debug(f'\t* PLU code: {item["PLUCode"]}')
-                self.class_logger.info(f'\t* Online name: {item["LongName"]}')
-        else:
-            self.class_logger.info('No items were searched. Skipped.')
+    def _refresh_rule_cache(self, cancel_event: Event | None = None):
+        if not self.settings.rule_cache_max_age_seconds:
             return
 
-        plu_codes = [item['PLUCode'] for item in items]
-        payload = {
-            'PLUCode': plu_codes,
-            'CustomReason': action_row.reason if action_row.reason else 'Deleted by t4auto',
-            'Reason': 'Custom',
-            'StoreID': [action_row.store_id],
+        # An empty keyword lists every availability rule.
+        load_started_at = self.rule_cache.begin_load()
+        try:
+            rules = self._search_items_from_api('', URL.UPDATE_ITEMS_API, cancel_event)
+        except BaseException:
+            self.rule_cache.abort_load()
+            raise
+        if rules is None:
+            self.rule_cache.abort_load()
+            self.rule_cache.invalidate()
+            self.class_logger.error('Failed to load the availability rules. Existing rules will not be skipped.')
+            return
+
+        self.rule_cache.replace(rules, load_started_at)
+        self.metrics.inc('t4auto_rule_cache_refreshes_total')
+        self.metrics.set('t4auto_cached_rules', len(self.rule_cache))
+        self.class_logger.debug(f'_refresh_rule_cache() -> {len(self.rule_cache)} rules')
+
+    def _prefetch_items(self, action_rows: list[ActionRowV2]):
+        # Searching ahead of the fire time also leaves warm connections in the session's pool. Keywords that no action
+        # used in time would otherwise stay in memory until the next search of the same keyword.
+        self._evict_stale_prefetched_items()
+        if self.catalog is None:
+            for keyword in dict.fromkeys(action_row.keyword for action_row in action_rows):
+                items = self._search_items_from_api(keyword, URL.GET_ITEMS_API)
+                if items is not None:
+                    self._prefetched_items[keyword] = (datetime.datetime.now(), items)
+                    self.class_logger.debug(f'_prefetch_items() -> {keyword}: {len(items)} items')
+
+        # The rules are loaded last, as they take the most pages, and only if the view would be stale at the action.
+        if not self.rule_cache.is_fresh(datetime.timedelta(seconds=self.settings.prefetch_lead_seconds)):
+            self._refresh_rule_cache()
+
+    def _get_prefetched_items(self, keyword):
+        # An entry is kept while it is fresh, as the tasks of several stores with the keyword may all use it.
+        prefetched = self._prefetched_items.get(keyword)
+        if prefetched is None:
+            return None
+
+        resolved_at, items = prefetched
+        if time_difference_seconds(datetime.datetime.now(), resolved_at) > self.settings.prefetch_max_age_seconds:
+            self.class_logger.debug(f'The prefetched items of {keyword} are stale. Searching again.')
+            self._prefetched_items.pop(keyword, None)
+            return None
+        return items
+
+    def _evict_stale_prefetched_items(self):
+        now = datetime.datetime.now()
+        for keyword, (resolved_at, _) in list(self._prefetched_items.items()):
+            if time_difference_seconds(now, resolved_at) > self.settings.prefetch_max_age_seconds:
+                self._prefetched_items.pop(keyword, None)
+
+    def _log_lateness(self, action_row: ActionRowV2, action: str) -> float:
+        now = datetime.datetime.now()
+        lateness = time_difference_seconds(now, latest_fire_time(action_row.action_time, now))
+        self.metrics.observe('t4auto_update_lateness_seconds', lateness, action=action)
+        self.metrics.set('t4auto_last_update_lateness_seconds', lateness, action=action)
+        self.class_logger.info(f'Finished {lateness:.3f} seconds after the scheduled time.')
+        return lateness
+
+    def _log_summary(self, action: str, action_rows: list[ActionRowV2], applied_rows: list[ActionRowV2],
+                     n_items: int, n_requests: int, n_failed_requests: int, lateness: float | None):
+        # One record per action; it also goes to t4auto_actions.jsonl.
+        self.metrics.inc('t4auto_items_affected_total', n_items, action=action)
+        now = datetime.datetime.now()
+        summary = {
+            'action': action,
+            'scheduled_at': latest_fire_time(action_rows[0].action_time, now).isoformat(),
+            'rows': len(action_rows),
+            'applied_rows': len(applied_rows),
+            'stores': len({action_row.store_id for action_row in action_rows}),
+            'keywords': len({action_row.keyword for action_row in action_rows}),
+            'items': n_items,
+            'update_requests': n_requests,
+            'failed_update_requests': n_failed_requests,
+            'lateness_seconds': lateness,
         }
-        response = self.session.post(URL.UPDATE_ITEMS_API, data=payload).json()
-        if response['success']:
-            self.class_logger.info(f'The items were offline, total {len(items)} items.')
-        else:
-            self.class_logger.error(f'Failed to take items offline.')
+        self.class_logger.info(f'Taking items {action}: {len(applied_rows)} of {len(action_rows)} rows applied, '
+                               f'{n_items} items.', extra={'summary': summary})
+
+    def _export_metrics(self):
+        try:
+            self.metrics.write(self.metrics_dir)
+        except OSError as e:
+            self.class_logger.error(f'Failed to write the metrics: {e}')
+
+    def _send_update(self, method: str, payload: dict) -> tuple[dict | None, bool]:
+        """
+        Returns the response, or None if the request failed, and whether the failure is definite. A request that timed
+        out, lost its connection or got no valid answer may still have been applied by the server.
+        """
+        try:
+            response = self.transport.request(method, URL.UPDATE_ITEMS_API, data=payload).json()
+        except (requests.RequestException, ValueError) as e:
+            self.class_logger.debug(f'{method} {URL.UPDATE_ITEMS_API} failed: {e}')
+            return None, False
+
+        if not response['success']:
             self.class_logger.debug(f'response["success"] == False')
             self.class_logger.debug(f'response: {response}')
+            return None, True
+        return response, True
 
-    def _take_items_online_by_search(self, action_row: ActionRowV2):
-        items = self._search_items_from_api(action_row.keyword, URL.UPDATE_ITEMS_API)
-        self.class_logger.info(f'Taking items online with the keyword: {action_row.keyword}')
-        if items:
-            self.class_logger.info('The following items were searched:')
-            for item in items:
-                self.class_logger.debug(f'\t* ID: {item["ID"]}')
-                self.class_logger.info(f'\t* Online name: {item["LongName"]}')
-        else:
-            self.class_logger.info('No items were searched. Skipped.')
+    def _send_updates(self, method: str, payloads: list[dict], action: str) -> list[dict | None]:
+        """
+        Sends the payloads concurrently, then sends the failed ones again, at most update_chunk_retries times.
+        Returns the response to every payload, or None for the payloads that failed.
+
+        A POST is sent again only after a definite failure, since sending a POST the server may have applied would
+        create its rules twice. Sending a DELETE again is harmless.
+        """
+        responses = [None] * len(payloads)
+        pending = list(range(len(payloads)))
+        for attempt in range(self.settings.update_chunk_retries + 1):
+            if attempt > 0:
+                self.class_logger.info(f'Retrying {len(pending)} of {len(payloads)} update requests.')
+                self.metrics.inc('t4auto_update_retries_total', len(pending), action=action)
+            retryable = []
+            for i, (response, is_definite) in zip(pending, self._executor.map(
+                    lambda i: self._send_update(method, payloads[i]), pending)):
+                responses[i] = response
+                if response is None and (is_definite or method != 'POST'):
+                    retryable.append(i)
+            pending = retryable
+            if not pending:
+                break
+
+        n_failed = responses.count(None)
+        self.metrics.inc('t4auto_update_failures_total', n_failed, action=action)
+        if len(payloads) > 1:
+            self.class_logger.info(f'{len(payloads) - n_failed} of {len(payloads)} update requests succeeded.')
+        return responses
+
+    @measured_job('offline')
+    def _take_items_offline_by_search(self, action_rows: list[ActionRowV2]):
+        # Rows of the same batch share the fire time and the reason. Stores whose rows resolve to the same PLU codes
+        # are merged into one request, so a request never takes an item offline in a store that did not ask for it.
+        store_plu_codes = {}
+        items_by_keyword = {}
+        for action_row in action_rows:
+            if action_row.keyword not in items_by_keyword:
+                items_by_keyword[action_row.keyword] = self._find_items(action_row.keyword)
+            items = items_by_keyword[action_row.keyword]
+            self.class_logger.info(f'Taking items offline with the keyword: {action_row.keyword}')
+            if items:
+                self.class_logger.info(f'{len(items)} items were searched.')
+                if self.settings.log_item_details:
+                    self.class_logger.debug('The following items were searched:\n' + '\n'.join(
+                        f'\t* PLU code: {item.plu_code}, online name: {item.long_name}' for item in items
+                    ))
+            else:
+                self.class_logger.info('No items were searched. Skipped.')
+                continue
+
+            plu_codes = store_plu_codes.setdefault(action_row.store_id, {})
+            plu_codes |= dict.fromkeys(item.plu_code for item in items)
+
+        # PLUs that already have a rule in a store, e.g. after a restart or from an overlapping row, are not posted
+        # again. Only the existing rules that t4auto created for other rows are recorded for this row as well, so that
+        # the last row to take the items online deletes them; rules made on the website are left alone.
+        store_rule_ids = {}  # store ID -> PLU code -> rule IDs, or None if the created rules are unknown
+        store_ids_by_plu_codes = {}
+        n_skipped = 0
+        use_rule_cache = self.rule_cache.is_fresh()
+        existing_rule_ids_by_store = {
+            store_id: self.rule_cache.rule_ids_by_plu_code(store_id, plu_codes) if use_rule_cache else {}
+            for store_id, plu_codes in store_plu_codes.items()
+        }
+        recorded_rule_ids = self.ledger.held_rule_ids(
+            rule_id
+            for existing_rule_ids in existing_rule_ids_by_store.values()
+            for rule_ids in existing_rule_ids.values()
+            for rule_id in rule_ids
+        )
+        for store_id, plu_codes in store_plu_codes.items():
+            existing_rule_ids = existing_rule_ids_by_store[store_id]
+            store_rule_ids[str(store_id)] = {
+                plu_code: shared_rule_ids
+                for plu_code, rule_ids in existing_rule_ids.items()
+                if (shared_rule_ids := [rule_id for rule_id in rule_ids if str(rule_id) in recorded_rule_ids])
+            }
+            missing_plu_codes = tuple(plu_code for plu_code in plu_codes if str(plu_code) not in existing_rule_ids)
+            n_skipped += len(plu_codes) - len(missing_plu_codes)
+            if missing_plu_codes:
+                store_ids_by_plu_codes.setdefault(missing_plu_codes, []).append(store_id)
+        if n_skipped:
+            self.class_logger.info(f'{n_skipped} items were already offline. Skipped.')
+            self.metrics.inc('t4auto_rules_skipped_total', n_skipped, action='offline')
+
+        # Every group of stores is sent in chunks of PLU codes. A store succeeds only if all chunks of its group do;
+        # the rules of its other chunks are then found by searching when the items are taken online.
+        payloads = []
+        for plu_codes, store_ids in store_ids_by_plu_codes.items():
+            for chunk in split_into_chunks(list(plu_codes), self.settings.update_chunk_size):
+                payloads.append({
+                    'PLUCode': chunk,
+                    'CustomReason': action_rows[0].reason if action_rows[0].reason else 'Deleted by t4auto',
+                    'Reason': 'Custom',
+                    'StoreID': store_ids,
+                })
+        responses = self._send_updates('POST', payloads, 'offline')
+
+        store_success = dict.fromkeys(store_plu_codes, True)
+        n_items_affected = 0
+        for payload, response in zip(payloads, responses):
+            if response is None:
+                for store_id in payload['StoreID']:
+                    store_success[store_id] = False
+                continue
+
+            n_items_affected += len(payload['PLUCode']) * len(payload['StoreID'])
+            rules = response.get('data')
+            if not isinstance(rules, list):
+                # The response does not list the created rules; the online action will search for them instead.
+                self.rule_cache.invalidate()
+                for store_id in payload['StoreID']:
+                    store_rule_ids[str(store_id)] = None
+                continue
+
+            created_rules = [
+                Item(rule.get('PLUCode'), rule.get('LongName', ''), rule['ID'], rule.get('StoreID')) for rule in rules
+            ]
+            self.rule_cache.add(created_rules)
+            payload_store_ids = {str(store_id) for store_id in payload['StoreID']}
+            for rule in created_rules:
+                rule_ids_by_plu_code = store_rule_ids.get(str(rule.store_id))
+                if str(rule.store_id) in payload_store_ids and rule_ids_by_plu_code is not None:
+                    rule_ids_by_plu_code.setdefault(str(rule.plu_code), []).append(rule.id)
+
+        lateness = self._log_lateness(action_rows[0], 'offline') if store_plu_codes else None
+        applied_rows = []
+        for action_row in action_rows:
+            if action_row.store_id not in store_success:
+                continue
+            if store_success[action_row.store_id]:
+                self.class_logger.info(f'The items were offline with the keyword: {action_row.keyword}, '
+                                       f'total {len(store_plu_codes[action_row.store_id])} items in the store.')
+                applied_rows.append(action_row)
+            else:
+                self.class_logger.error(f'Failed to take items offline with the keyword: {action_row.keyword}')
+        self._record_rules(applied_rows, items_by_keyword, store_rule_ids)
+        self.job_store.record_applied(applied_rows, datetime.datetime.now())
+        self._log_summary('offline', action_rows, applied_rows, n_items_affected, len(payloads),
+                          responses.count(None), lateness)
+
+    def _record_rules(self, action_rows: list[ActionRowV2], items_by_keyword: dict, store_rule_ids: dict):
+        rule_ids_by_row_key = {}
+        for action_row in action_rows:
+            rule_ids_by_plu_code = store_rule_ids.get(str(action_row.store_id))
+            if rule_ids_by_plu_code is None:
+                continue
+            rule_ids = [
+                rule_id
+                for item in items_by_keyword[action_row.keyword]
+                for rule_id in rule_ids_by_plu_code.get(str(item.plu_code), [])
+            ]
+            # An empty entry tells the online action that the row holds no rules, rather than to search for them.
+            rule_ids_by_row_key[action_row.row_key] = rule_ids
+        if rule_ids_by_row_key:
+            self.ledger.record_many(rule_ids_by_row_key)
+
+    @measured_job('online')
+    def _take_items_online_by_search(self, action_rows: list[ActionRowV2]):
+        row_item_ids = []
+        items_by_keyword = {}
+        ledger_max_age = datetime.timedelta(hours=self.settings.ledger_max_age_hours)
+        use_rule_cache = self.rule_cache.is_fresh()
+        n_skipped = 0
+        for action_row in action_rows:
+            rule_ids = self.ledger.get(action_row.row_key, ledger_max_age)
+            if rule_ids is not None:
+                self.class_logger.info(f'Taking items online with the keyword: {action_row.keyword}')
+                self.class_logger.info(f'Found {len(rule_ids)} rules created by t4auto.')
+                if use_rule_cache:
+                    # Rules that no longer exist, e.g. deleted on the website or by an overlapping row, are skipped.
+                    existing_rule_ids = [rule_id for rule_id in rule_ids if self.rule_cache.exists(rule_id)]
+                    n_skipped += len(rule_ids) - len(existing_rule_ids)
+                    rule_ids = existing_rule_ids
+                row_item_ids.append((action_row, rule_ids))
+                continue
+
+            # The ledger has no fresh entry for the row; fall back to searching the rules by keyword.
+            if action_row.keyword not in items_by_keyword:
+                items_by_keyword[action_row.keyword] = self._search_items_from_api(action_row.keyword,
+                                                                                   URL.UPDATE_ITEMS_API)
+            items = items_by_keyword[action_row.keyword]
+            self.class_logger.info(f'Taking items online with the keyword: {action_row.keyword}')
+            if items:
+                self.class_logger.info(f'{len(items)} items were searched.')
+                if self.settings.log_item_details:
+                    self.class_logger.debug('The following items were searched:\n' + '\n'.join(
+                        f'\t* ID: {item.id}, online name: {item.long_name}' for item in items
+                    ))
+            else:
+                self.class_logger.info('No items were searched. Skipped.')
+                continue
+            row_item_ids.append((action_row, [item.id for item in items]))
+
+        # Rules that rows outside this batch still hold, e.g. an overlapping row whose window is still open, are kept.
+        held_rule_ids = self.ledger.held_rule_ids(
+            (item_id for _, ids in row_item_ids for item_id in ids),
+            [action_row.row_key for action_row in action_rows]
+        )
+        if held_rule_ids:
+            row_item_ids = [
+                (action_row, [item_id for item_id in ids if str(item_id) not in held_rule_ids])
+                for action_row, ids in row_item_ids
+            ]
+            self.class_logger.info(f'{len(held_rule_ids)} rules are still held by other rows. Kept.')
+        if n_skipped:
+            self.class_logger.info(f'{n_skipped} rules no longer exist. Skipped.')
+            self.metrics.inc('t4auto_rules_skipped_total', n_skipped, action='online')
+        if not row_item_ids:
+            self._log_summary('online', action_rows, [], 0, 0, 0, None)
             return
 
-        item_ids = [item['ID'] for item in items]
-        payload = {
-            'IDs': item_ids,
+        item_ids = dict.fromkeys(item_id for _, ids in row_item_ids for item_id in ids)
+        payloads = [{'IDs': chunk} for chunk in split_into_chunks(list(item_ids), self.settings.update_chunk_size)]
+        responses = self._send_updates('DELETE', payloads, 'online')
+        lateness = self._log_lateness(action_rows[0], 'online')
+        deleted_ids = {
+            item_id for payload, response in zip(payloads, responses) if response is not None
+            for item_id in payload['IDs']
         }
-        response = self.session.delete(URL.UPDATE_ITEMS_API, data=payload).json()
-        if response['success']:
-            self.class_logger.info(f'The items were online, total {len(items)} items.')
-        else:
-            self.class_logger.error(f'Failed to take items online.')
-            self.class_logger.debug(f'response["success"] == False')
-            self.class_logger.debug(f'response: {response}')
+        self.rule_cache.remove(deleted_ids)
 
-    def start_scheduler(self, actions: list[ActionRowV2]):
-        time_set = set()
-        for action in actions:
-            if action.action_type == ActionType.START:
-                func = self._take_items_offline_by_search
+        applied_rows = []
+        remaining_ids_by_row_key = {}
+        for action_row, ids in row_item_ids:
+            remaining_ids = [item_id for item_id in ids if item_id not in deleted_ids]
+            if not remaining_ids:
+                self.class_logger.info(f'The items were online with the keyword: {action_row.keyword}, '
+                                       f'total {len(ids)} items.')
+                applied_rows.append(action_row)
             else:
-                func = self._take_items_online_by_search
-
-            action_time = action.action_time
-            while action_time in time_set:
-                action_time += datetime.timedelta(seconds=SECONDS_REQUEST_INTERVAL)
-            time_set.add(action_time)
-
-            self._scheduler.add_job(
-                func,
-                'interval',
-                args=(action,),
-                days=1,
-                start_date=action_time,
+                self.class_logger.error(f'Failed to take items online with the keyword: {action_row.keyword}, '
+                                        f'{len(remaining_ids)} of {len(ids)} items are still offline.')
+                # The next attempt deletes only the rules that are left.
+                remaining_ids_by_row_key[action_row.row_key] = remaining_ids
+        self.ledger.remove([action_row.row_key for action_row in applied_rows])
+        if remaining_ids_by_row_key:
+            self.ledger.record_many(remaining_ids_by_row_key)
+        self.job_store.record_applied(applied_rows, datetime.datetime.now())
+        self._log_summary('online', action_rows, applied_rows, len(deleted_ids), len(payloads),
+                          responses.count(None), lateness)
+
+    def _reconcile(self, actions: list[ActionRowV2], cancel_event: Event | None = None):
+        # Brings every row to the state it should be in now, e.g. after a restart in the middle of an offline window.
+        now = datetime.datetime.now()
+        offline_actions = {action.row_key: action for action in actions if action.action_type == ActionType.START}
+        online_actions = {action.row_key: action for action in actions if action.action_type == ActionType.END}
+        applied_states = self.job_store.load_applied_states()
+
+        action_rows = []
+        for row_key, offline_action in offline_actions.items():
+            online_action = online_actions[row_key]
+            applied_state = applied_states.pop(row_key, None)
+            is_offline = applied_state is not None and applied_state.action_type == ActionType.START
+            if is_within_offline_window(offline_action, online_action, now):
+                if not is_offline:
+                    action_rows.append(replace(offline_action, action_time=now))
+            elif is_offline:
+                action_rows.append(replace(online_action, action_time=now))
+
+        # Rows that were taken offline but have since been removed from the schedule are taken online.
+        for applied_state in applied_states.values():
+            if applied_state.action_type == ActionType.START:
+                action_rows.append(ActionRowV2(applied_state.keyword, now, ActionType.END, applied_state.reason,
+                                               applied_state.store_id, row_key=applied_state.row_key))
+
+        if action_rows:
+            self._refresh_rule_cache(cancel_event)
+        if cancel_event is not None and cancel_event.is_set():
+            raise Cancelled('Cancelled before reconciling the rows')
+        batches = {}
+        for action_row in action_rows:
+            batches.setdefault((action_row.action_type, action_row.reason), []).append(action_row)
+        for batch in batches.values():
+            self.class_logger.info(f'Reconciling {len(batch)} rows with the current time.')
+            self._dispatch(batch)
+
+    def _dispatch(self, action_rows: list[ActionRowV2]):
+        # Stores with the same keywords resolve to the same PLU codes, so they stay in one task and share its requests.
+        # Other stores are taken offline or online by their own tasks. Tasks of the same store and keyword run in order.
+        if action_rows[0].action_type == ActionType.START:
+            func = self._take_items_offline_by_search
+        else:
+            func = self._take_items_online_by_search
+
+        keywords_by_store = {}
+        for action_row in action_rows:
+            keywords_by_store.setdefault(action_row.store_id, set()).add(action_row.keyword)
+        rows_by_keywords = {}
+        for action_row in action_rows:
+            rows_by_keywords.setdefault(frozenset(keywords_by_store[action_row.store_id]), []).append(action_row)
+        for group_rows in rows_by_keywords.values():
+            self.dispatcher.submit([(action_row.store_id, action_row.keyword) for action_row in group_rows],
+                                   func, group_rows)
+
+    @property
+    def jobs(self) -> list[TimelineEvent]:
+        events = [event for _, batch_events in self._batch_events.values() for event in batch_events]
+        if self._catalog_event is not None:
+            events.append(self._catalog_event)
+        return events
+
+    def start_scheduler(self, actions: list[ActionRowV2], progress: Callable[[str], None] | None = None,
+                        cancel_event: Event | None = None):
+        """
+        Loads the catalog, brings the rows up to date and schedules the actions. Reports every step to progress, and
+        raises Cancelled if cancel_event is set before the rows are brought up to date; the caller then stops the
+        scheduler.
+        """
+        progress = progress if progress else lambda message: None
+        if self.settings.metrics_port and self._owns_metrics and self._metrics_server is None:
+            try:
+                self._metrics_server = MetricsServer(self.metrics, self.settings.metrics_port)
+            except OSError as e:
+                self.class_logger.error(f'Failed to serve the metrics on port {self.settings.metrics_port}: {e}')
+
+        if self.settings.local_catalog and self._catalog_event is None:
+            progress('Loading the catalog')
+            self._load_catalog(cancel_event)
+            refresh_interval = datetime.timedelta(minutes=self.settings.catalog_refresh_minutes)
+            self._catalog_event = self._timeline.add(
+                self._refresh_catalog,
+                IntervalTrigger(datetime.datetime.now() + refresh_interval, refresh_interval),
+                executor=self._job_executor,
             )
-            self.class_logger.info(f'Added in the scheduler:')
-            if action.action_type == ActionType.START:
-                self.class_logger.info(f'\t* Action: taking items offline')
-            else:
-                self.class_logger.info(f'\t* Action: taking items online')
-            self.class_logger.info(f'\t* Keyword: {action.keyword}')
-            self.class_logger.info(f'\t* Start time: {action_time.strftime('%Y-%m-%d %H:%M:%S')}')
+
+        progress('Bringing the rows up to date')
+        self._reconcile(actions, cancel_event)
+        progress('Scheduling the actions')
+        self.update_schedule(actions)
+
+    def update_schedule(self, actions: list[ActionRowV2]):
+        """
+        Schedules the actions, keeping the events of the batches that did not change, so that editing a few rows of a
+        large schedule only replaces the events of their batches.
+        """
+        # Actions sharing the fire time, the action type, the reason and the recurrence are sent together instead of
+        # being staggered.
+        batches = batch_action_rows(actions)
+        for batch_key, (action_rows, events) in list(self._batch_events.items()):
+            if batches.get(batch_key) != action_rows:
+                for event in events:
+                    self._timeline.remove(event)
+                del self._batch_events[batch_key]
+
+        for batch_key, action_rows in batches.items():
+            if batch_key not in self._batch_events:
+                self._batch_events[batch_key] = (action_rows, self._schedule_batch(action_rows))
+
+    def _schedule_batch(self, action_rows: list[ActionRowV2]) -> list[TimelineEvent]:
+        action_type = action_rows[0].action_type
+        # _dispatch only queues the actions, so it runs on the timer thread itself.
+        events = [self._timeline.add(self._dispatch, action_trigger(action_rows[0]), args=(action_rows,),
+                                     misfire_grace_seconds=self.settings.misfire_grace_seconds)]
+        if events[0].next_fire_time is None:
+            self.class_logger.info(f'{len(action_rows)} rows are not scheduled, as they have no days left to run.')
+            return events
+
+        if action_type == ActionType.START:
+            # Loading every rule can take many pages, so it is done only ahead of the offline actions. The online
+            # actions use the view while it is fresh, as t4auto keeps it up to date with its own changes.
+            events.append(self._timeline.add(
+                self._prefetch_items,
+                action_trigger(action_rows[0], datetime.timedelta(seconds=self.settings.prefetch_lead_seconds)),
+                args=(action_rows,),
+                misfire_grace_seconds=self.settings.misfire_grace_seconds,
+                executor=self._job_executor,
+            ))
+
+        self.class_logger.info(f'Added in the scheduler:')
+        if action_type == ActionType.START:
+            self.class_logger.info(f'\t* Action: taking items offline')
+        else:
+            self.class_logger.info(f'\t* Action: taking items online')
+        for action_row in action_rows:
+            self.class_logger.info(f'\t* Keyword: {action_row.keyword}')
+        self.class_logger.info(f'\t* Start time: {events[0].next_fire_time.strftime('%Y-%m-%d %H:%M:%S')}')
+        return events
 
     def stop_scheduler(self):
-        self._scheduler.remove_all_jobs()
+        for event in self.jobs:
+            self._timeline.remove(event)
+        self._batch_events = {}
+        self._catalog_event = None
+        self._prefetched_items = {}
+        self.dispatcher.clear()
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+            self._metrics_server = None
         self.class_logger.info('The scheduler stopped.')
@@ -0,0 +1,117 @@
+import logging
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Callable, Hashable, Iterable
+
+from t4autolibs.metrics import Metrics
+
+
+@dataclass(eq=False)
+class _Task:
+    lanes: tuple
+    func: Callable
+    args: tuple
+    submitted_at: float
+    future: Future = field(default_factory=Future)
+    started: bool = False
+
+
+class Dispatcher:
+    """
+    Runs tasks on a pool of max_workers threads. Every task names its lanes, e.g. (store ID, keyword) pairs: tasks that
+    share a lane run one after another in the order they were submitted, and other tasks run in parallel.
+
+    A task starts once it is at the head of all of its lanes, so a slow store never holds up another store, while the
+    offline and online actions of one row never overtake each other.
+    """
+
+    def __init__(self, max_workers: int, metrics: Metrics | None = None,
+                 logger: logging.Logger | logging.LoggerAdapter | None = None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='t4auto-dispatcher')
+        self._lock = Lock()
+        self._lanes = {}  # lane -> deque of the tasks holding it, the running one first
+        self._tasks = set()  # submitted tasks that have not finished
+        self._n_queued = 0
+        self.metrics = metrics if metrics else Metrics()
+        self.class_logger = logger if logger else logging.getLogger('t4auto')
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        The number of tasks that have been submitted but have not started running.
+        """
+        return self._n_queued
+
+    def submit(self, lanes: Iterable[Hashable], func: Callable, *args) -> Future:
+        task = _Task(tuple(dict.fromkeys(lanes)), func, args, time.monotonic())
+        with self._lock:
+            self._tasks.add(task)
+            for lane in task.lanes:
+                self._lanes.setdefault(lane, deque()).append(task)
+            self._n_queued += 1
+            is_ready = self._mark_started_if_ready(task)
+            self.metrics.set('t4auto_dispatch_queue_depth', self._n_queued)
+        if is_ready:
+            self._executor.submit(self._run, task)
+        return task.future
+
+    def _mark_started_if_ready(self, task: _Task) -> bool:
+        if task.started or any(self._lanes[lane][0] is not task for lane in task.lanes):
+            return False
+        task.started = True
+        return True
+
+    def _run(self, task: _Task):
+        with self._lock:
+            self._n_queued -= 1
+            self.metrics.set('t4auto_dispatch_queue_depth', self._n_queued)
+        self.metrics.observe('t4auto_dispatch_wait_seconds', time.monotonic() - task.submitted_at)
+
+        try:
+            if task.future.set_running_or_notify_cancel():
+                try:
+                    task.future.set_result(task.func(*task.args))
+                except Exception as e:
+                    self.class_logger.exception(f'{getattr(task.func, "__name__", task.func)} failed: {e}')
+                    task.future.set_exception(e)
+        finally:
+            self._finish(task)
+
+    def _finish(self, task: _Task):
+        ready_tasks = []
+        with self._lock:
+            self._tasks.discard(task)
+            for lane in task.lanes:
+                lane_tasks = self._lanes[lane]
+                lane_tasks.popleft()
+                if not lane_tasks:
+                    del self._lanes[lane]
+                elif self._mark_started_if_ready(lane_tasks[0]):
+                    ready_tasks.append(lane_tasks[0])
+        for ready_task in ready_tasks:
+            self._executor.submit(self._run, ready_task)
+
+    def clear(self):
+        """
+        Cancels the tasks that have not started running. Running tasks finish.
+        """
+        with self._lock:
+            for task in list(self._tasks):
+                task.future.cancel()
+                if task.started:
+                    # Waiting for a worker; _run releases its lanes.
+                    continue
+                self._tasks.discard(task)
+                self._n_queued -= 1
+                for lane in task.lanes:
+                    self._lanes[lane].remove(task)
+                    if not self._lanes[lane]:
+                        del self._lanes[lane]
+            self.metrics.set('t4auto_dispatch_queue_depth', self._n_queued)
+
+    def shutdown(self, wait: bool = True):
+        self.clear()
+        self._executor.shutdown(wait=wait)
@@ -17,3 +17,11 @@ class AgentStatus(QLabel):
     def set_running_status(self):
         self.setText('• Running')
         self.setStyleSheet('color: blue;')
+
+    def set_busy_status(self, message: str):
+        self.setText(f'• {message}...')
+        self.setStyleSheet('color: darkorange;')
+
+    def set_error_status(self, message: str):
+        self.setText(f'• {message}')
+        self.setStyleSheet('color: red;')
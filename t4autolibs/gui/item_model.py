@@ -0,0 +1,382 @@
+from dataclasses import dataclass
+from enum import IntEnum
+
+from PySide6.QtCore import QAbstractTableModel, QModelIndex, QTime, Qt, Signal, QEvent, QTimer, QStringListModel, Slot
+from PySide6.QtWidgets import QStyledItemDelegate, QTimeEdit, QLineEdit, QCompleter, QStyleOptionButton, QStyle, \
+    QApplication
+
+from t4autolibs.cores import row_stores
+from t4autolibs.recurrence import Recurrence
+from t4autolibs.stores import Store, StoreIndex
+
+COLUMN_NAMES = ['Location', 'Search items by keyword', 'Offline time', 'Online time', 'Repeat', 'Reason',
+                'Delete the row']
+REPEAT_TOOLTIP = ('The days to take the items offline, e.g.\n'
+                  'Mon-Fri from 2026-11-01 until 2026-12-31 except 2026-12-25\n'
+                  'Every part is optional. If the online time is earlier, the items are taken online the next day.')
+LOCATION_TOOLTIP = 'One or more stores separated by semicolons. Type a part of a name to search the stores.'
+STORE_SEPARATOR = ';'
+# The completer lists at most this many stores; typing more of a name narrows them down.
+MAX_STORE_COMPLETIONS = 50
+
+
+class ColumnIdx(IntEnum):
+    LOCATION = 0
+    KEYWORD = 1
+    START = 2
+    END = 3
+    REPEAT = 4
+    REASON = 5
+    DELETE = 6
+
+
+@dataclass(slots=True)
+class ScheduleRow:
+    stores: list[Store]
+    keyword: str
+    start_time: tuple[int, int]
+    end_time: tuple[int, int]
+    recurrence: Recurrence
+    reason: str
+
+    @classmethod
+    def empty(cls) -> 'ScheduleRow':
+        return cls([], '', (0, 0), (23, 59), Recurrence(), '')
+
+    @classmethod
+    def from_config(cls, row: dict) -> 'ScheduleRow':
+        return cls(
+            stores=row_stores(row),
+            keyword=row['keyword'],
+            start_time=tuple(row['start_time']),
+            end_time=tuple(row['end_time']),
+            recurrence=Recurrence.from_dict(row.get('recurrence')),
+            reason=row['reason'],
+        )
+
+    def to_config(self, row_idx: int) -> dict:
+        return {
+            'row_idx': row_idx,
+            # The first store is also kept under 'store', which is all that earlier versions read.
+            'store': {
+                'id': self.stores[0].id if self.stores else -1,
+                'name': self.stores[0].name if self.stores else '',
+            },
+            'stores': [{'id': store.id, 'name': store.name} for store in self.stores],
+            'keyword': self.keyword,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'recurrence': self.recurrence.to_dict(),
+            'reason': self.reason,
+        }
+
+    @property
+    def location(self) -> str:
+        return f'{STORE_SEPARATOR} '.join(store.name for store in self.stores)
+
+
+SORT_KEYS = {
+    ColumnIdx.LOCATION: lambda row: row.location.lower(),
+    ColumnIdx.KEYWORD: lambda row: row.keyword.lower(),
+    ColumnIdx.START: lambda row: row.start_time,
+    ColumnIdx.END: lambda row: row.end_time,
+    ColumnIdx.REPEAT: lambda row: row.recurrence.to_text(),
+    ColumnIdx.REASON: lambda row: row.reason.lower(),
+}
+
+
+class ItemTableModel(QAbstractTableModel):
+    """
+    The schedule rows, kept as plain records instead of a widget per cell.
+
+    The view shows the rows matching the filter, in the sort order, as a list of indexes into the rows; filtering and
+    sorting rebuild that list in one pass and reset the model once. The rows themselves keep the order they were added
+    in, which is the order saved in config.json.
+    """
+    # Emitted with the reason when an edit is rejected, e.g. an invalid Repeat text.
+    edit_rejected = Signal(str)
+
+    def __init__(self):
+        super().__init__()
+        self._rows = []  # type: list[ScheduleRow]
+        self._visible = []  # indexes into self._rows, in the order of the view
+        self._filter_text = ''
+        self._sort_column = -1
+        self._sort_order = Qt.SortOrder.AscendingOrder
+
+    @property
+    def rows(self) -> list[ScheduleRow]:
+        return self._rows
+
+    def set_rows(self, rows: list[ScheduleRow]):
+        self.beginResetModel()
+        self._rows = rows
+        self._update_visible()
+        self.endResetModel()
+
+    def append_row(self, row: ScheduleRow):
+        # A new row is shown at the bottom even if it does not match the filter, so that it can be filled in.
+        self.beginInsertRows(QModelIndex(), len(self._visible), len(self._visible))
+        self._rows.append(row)
+        self._visible.append(len(self._rows) - 1)
+        self.endInsertRows()
+
+    def row_at(self, view_row: int) -> ScheduleRow:
+        return self._rows[self._visible[view_row]]
+
+    def set_filter(self, text: str):
+        self.beginResetModel()
+        self._filter_text = text.strip().lower()
+        self._update_visible()
+        self.endResetModel()
+
+    def _matches_filter(self, row: ScheduleRow) -> bool:
+        text = self._filter_text
+        return text in row.location.lower() or text in row.keyword.lower() or text in row.reason.lower()
+
+    def _update_visible(self):
+        if self._filter_text:
+            self._visible = [i for i, row in enumerate(self._rows) if self._matches_filter(row)]
+        else:
+            self._visible = list(range(len(self._rows)))
+        sort_key = SORT_KEYS.get(self._sort_column)
+        if sort_key is not None:
+            self._visible.sort(key=lambda i: sort_key(self._rows[i]),
+                               reverse=self._sort_order == Qt.SortOrder.DescendingOrder)
+
+    def sort(self, column: int, order: Qt.SortOrder = Qt.SortOrder.AscendingOrder):
+        self.beginResetModel()
+        self._sort_column = column
+        self._sort_order = order
+        self._update_visible()
+        self.endResetModel()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._visible)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(COLUMN_NAMES)
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return COLUMN_NAMES[section]
+        return super().headerData(section, orientation, role)
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlag:
+        flags = Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
+        if index.column() != ColumnIdx.DELETE:
+            flags |= Qt.ItemFlag.ItemIsEditable
+        return flags
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+
+        row = self.row_at(index.row())
+        column = index.column()
+        if role == Qt.ItemDataRole.DisplayRole:
+            match column:
+                case ColumnIdx.LOCATION:
+                    return row.location
+                case ColumnIdx.KEYWORD:
+                    return row.keyword
+                case ColumnIdx.START:
+                    return f'{row.start_time[0]:02}:{row.start_time[1]:02}'
+                case ColumnIdx.END:
+                    return f'{row.end_time[0]:02}:{row.end_time[1]:02}'
+                case ColumnIdx.REPEAT:
+                    return row.recurrence.to_text()
+                case ColumnIdx.REASON:
+                    return row.reason
+                case ColumnIdx.DELETE:
+                    return 'Delete'
+        elif role == Qt.ItemDataRole.EditRole:
+            match column:
+                case ColumnIdx.LOCATION:
+                    return row.stores
+                case ColumnIdx.START:
+                    return QTime(*row.start_time)
+                case ColumnIdx.END:
+                    return QTime(*row.end_time)
+                case _:
+                    return self.data(index, Qt.ItemDataRole.DisplayRole)
+        elif role == Qt.ItemDataRole.ToolTipRole:
+            match column:
+                case ColumnIdx.LOCATION:
+                    return LOCATION_TOOLTIP
+                case ColumnIdx.REPEAT:
+                    return REPEAT_TOOLTIP
+        return None
+
+    def setData(self, index: QModelIndex, value, role: int = Qt.ItemDataRole.EditRole) -> bool:
+        if not index.isValid() or role != Qt.ItemDataRole.EditRole:
+            return False
+
+        row = self.row_at(index.row())
+        match index.column():
+            case ColumnIdx.LOCATION:
+                row.stores = value
+            case ColumnIdx.KEYWORD:
+                row.keyword = value
+            case ColumnIdx.START:
+                row.start_time = (value.hour(), value.minute())
+            case ColumnIdx.END:
+                row.end_time = (value.hour(), value.minute())
+            case ColumnIdx.REPEAT:
+                try:
+                    row.recurrence = Recurrence.from_text(value)
+                except ValueError as e:
+                    # The last valid recurrence is kept.
+                    self.edit_rejected.emit(str(e))
+                    return False
+            case ColumnIdx.REASON:
+                row.reason = value
+            case _:
+                return False
+        self.dataChanged.emit(index, index)
+        return True
+
+    def removeRows(self, view_row: int, count: int, parent: QModelIndex = QModelIndex()) -> bool:
+        if parent.isValid() or view_row < 0 or view_row + count > len(self._visible):
+            return False
+
+        self.beginRemoveRows(parent, view_row, view_row + count - 1)
+        removed = set(self._visible[view_row:view_row + count])
+        del self._visible[view_row:view_row + count]
+        # The rows after a removed row move up, and so do their indexes.
+        new_indexes = {}
+        rows = []
+        for i, row in enumerate(self._rows):
+            if i not in removed:
+                new_indexes[i] = len(rows)
+                rows.append(row)
+        self._rows = rows
+        self._visible = [new_indexes[i] for i in self._visible]
+        self.endRemoveRows()
+        return True
+
+
+class TimeDelegate(QStyledItemDelegate):
+
+    def createEditor(self, parent, option, index):
+        editor = QTimeEdit(parent)
+        editor.setDisplayFormat('hh:mm')
+        editor.setFrame(False)
+        return editor
+
+    def setEditorData(self, editor: QTimeEdit, index: QModelIndex):
+        editor.setTime(index.data(Qt.ItemDataRole.EditRole))
+
+    def setModelData(self, editor: QTimeEdit, model: QAbstractTableModel, index: QModelIndex):
+        model.setData(index, editor.time())
+
+
+class StorePicker(QLineEdit):
+    """
+    Edits the locations of a row as store names separated by semicolons. The name being typed is completed from the
+    store index, so that a store is found by any part of its name without listing every store of the account.
+    """
+
+    def __init__(self, store_index: StoreIndex, parent=None):
+        super().__init__(parent)
+        self.store_index = store_index
+        self._stores = []  # type: list[Store]
+        self._completions = QStringListModel(self)
+        self._completer = QCompleter(self._completions, self)
+        self._completer.setWidget(self)
+        # The index has already filtered and ranked the stores.
+        self._completer.setCompletionMode(QCompleter.CompletionMode.UnfilteredPopupCompletion)
+        self._completer.activated.connect(self.pick)
+        self.textEdited.connect(self.complete)
+        self.setFrame(False)
+        self.setPlaceholderText('Type to search the stores')
+
+    def _names(self) -> list[str]:
+        return [name.strip() for name in self.text().split(STORE_SEPARATOR)]
+
+    def set_stores(self, stores: list[Store]):
+        self._stores = stores
+        # Ends with a separator, so that typing adds a store.
+        self.setText(''.join(f'{store.name}{STORE_SEPARATOR} ' for store in stores))
+
+    def stores(self) -> list[Store]:
+        """
+        Returns the stores named in the text. Raises ValueError if a name is not a store of the account.
+        """
+        # The stores the row had are kept even if the index no longer lists them, e.g. before login.
+        known = {store.name.casefold(): store for store in self._stores}
+        stores = []
+        for name in self._names():
+            if not name:
+                continue
+            store = self.store_index.find(name) or known.get(name.casefold())
+            if store is None:
+                raise ValueError(f'"{name}" is not a store of this account')
+            if store not in stores:
+                stores.append(store)
+        return stores
+
+    @Slot()
+    def complete(self):
+        *picked, term = self._names()
+        picked = {name.casefold() for name in picked}
+        names = [store.name for store in self.store_index.search(term) if store.name.casefold() not in picked]
+        self._completions.setStringList(names[:MAX_STORE_COMPLETIONS])
+        if names:
+            self._completer.complete()
+        else:
+            self._completer.popup().hide()
+
+    @Slot(str)
+    def pick(self, name: str):
+        picked = [picked_name for picked_name in self._names()[:-1] if picked_name]
+        self.setText(''.join(f'{picked_name}{STORE_SEPARATOR} ' for picked_name in picked + [name]))
+
+
+class LocationDelegate(QStyledItemDelegate):
+    """
+    Picks the locations of a row from the stores of the logged-in account.
+    """
+
+    def __init__(self, store_index, parent=None):
+        super().__init__(parent)
+        self.store_index = store_index  # callable returning the StoreIndex of the account
+
+    def createEditor(self, parent, option, index):
+        editor = StorePicker(self.store_index(), parent)
+        # Opens the list at once, as the menu of the location cell did.
+        QTimer.singleShot(0, editor, editor.complete)
+        return editor
+
+    def setEditorData(self, editor: StorePicker, index: QModelIndex):
+        editor.set_stores(index.data(Qt.ItemDataRole.EditRole))
+
+    def setModelData(self, editor: StorePicker, model: ItemTableModel, index: QModelIndex):
+        try:
+            stores = editor.stores()
+        except ValueError as e:
+            # The last valid locations are kept.
+            model.edit_rejected.emit(str(e))
+            return
+        model.setData(index, stores)
+
+
+class DeleteButtonDelegate(QStyledItemDelegate):
+    """
+    Paints a Delete button in the cell and removes the row when it is clicked, without a widget per row.
+    """
+
+    def paint(self, painter, option, index):
+        button = QStyleOptionButton()
+        button.rect = option.rect
+        button.text = index.data(Qt.ItemDataRole.DisplayRole)
+        button.state = QStyle.StateFlag.State_Raised
+        if option.state & QStyle.StateFlag.State_Enabled:
+            button.state |= QStyle.StateFlag.State_Enabled
+        QApplication.style().drawControl(QStyle.ControlElement.CE_PushButton, button, painter)
+
+    def editorEvent(self, event, model, option, index) -> bool:
+        if event.type() == QEvent.Type.MouseButtonRelease and option.rect.contains(event.position().toPoint()):
+            model.removeRow(index.row())
+            return True
+        return False
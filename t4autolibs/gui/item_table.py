@@ -1,28 +1,17 @@
 import datetime
-from enum import IntEnum
-from functools import partial
-from typing import NoReturn
+from typing import Callable, NoReturn
 
 from PySide6 import QtGui
-from PySide6.QtCore import Slot, QTime, Qt
-from PySide6.QtGui import QAction
-from PySide6.QtWidgets import QGridLayout, QGroupBox, QTableWidget, QPushButton, QHeaderView, QTableWidgetItem, \
-    QTimeEdit, QMenu
+from PySide6.QtCore import Slot, Qt
+from PySide6.QtWidgets import QGridLayout, QGroupBox, QTableView, QPushButton, QHeaderView, QLineEdit, QToolTip, \
+    QAbstractItemView
 
-from t4autolibs.cores import ActionRowV2, ActionType, Store, AgentV2
+from t4autolibs.cores import AgentV2, collect_action_rows_from_config
 from t4autolibs.gui.agent_status import AgentStatus
 from t4autolibs.gui.config import Configurable
-
-COLUMN_NAMES = ['Location', 'Search items by keyword', 'Offline time', 'Online time', 'Reason', 'Delete the row']
-
-
-class ColumnIdx(IntEnum):
-    LOCATION = 0
-    KEYWORD = 1
-    START = 2
-    END = 3
-    REASON = 4
-    DELETE = 5
+from t4autolibs.gui.item_model import ColumnIdx, ItemTableModel, ScheduleRow, TimeDelegate, LocationDelegate, \
+    DeleteButtonDelegate
+from t4autolibs.gui.worker import Worker
 
 
 class ItemTable(Configurable):
@@ -30,222 +19,190 @@ class ItemTable(Configurable):
     def __init__(self, agent: AgentV2, agent_status: AgentStatus):
         self.agent = agent
         self.agent_status = agent_status
+        self._start_worker = None  # type: Worker | None
+        # Called once the start in progress has returned, e.g. to log out after cancelling it.
+        self._after_start = None  # type: Callable[[], None] | None
 
         # Take items offline group
         self.layout = QGridLayout()
         self.group = QGroupBox('Take items offline')
         self.group.setLayout(self.layout)
 
+        # Take items offline group / filter
+        self.filter_edit = QLineEdit()
+        self.filter_edit.setPlaceholderText('Filter by location, keyword or reason')
+        self.filter_edit.setClearButtonEnabled(True)
+        self.filter_edit.textChanged.connect(self.filter_rows)
+        self.layout.addWidget(self.filter_edit, 0, 0, 1, 3)
+
         # Take items offline group / table
-        self.table = QTableWidget()
+        self.model = ItemTableModel()
+        self.model.edit_rejected.connect(self.show_rejected_edit)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setEditTriggers(QAbstractItemView.EditTrigger.DoubleClicked
+                                   | QAbstractItemView.EditTrigger.SelectedClicked
+                                   | QAbstractItemView.EditTrigger.EditKeyPressed
+                                   | QAbstractItemView.EditTrigger.AnyKeyPressed)
+        # The delegates are owned by the table; a widget per cell would have to be created for every row.
+        self.time_delegate = TimeDelegate(self.table)
+        self.location_delegate = LocationDelegate(lambda: self.agent.store_index, self.table)
+        self.delete_delegate = DeleteButtonDelegate(self.table)
+        self.table.setItemDelegateForColumn(ColumnIdx.START, self.time_delegate)
+        self.table.setItemDelegateForColumn(ColumnIdx.END, self.time_delegate)
+        self.table.setItemDelegateForColumn(ColumnIdx.LOCATION, self.location_delegate)
+        self.table.setItemDelegateForColumn(ColumnIdx.DELETE, self.delete_delegate)
         self.draw_table_header()
-        self.table.cellClicked.connect(self.show_location)
-        self.layout.addWidget(self.table, 0, 0, 1, 3)
+        self.layout.addWidget(self.table, 1, 0, 1, 3)
 
         self.add_row_button = QPushButton('Add a row')
         self.add_row_button.setIcon(QtGui.QIcon('_internal/icons/add.svg'))
         self.add_row_button.clicked.connect(self.add_empty_row)
-        self.layout.addWidget(self.add_row_button, 1, 0)
+        self.layout.addWidget(self.add_row_button, 2, 0)
 
         self.start_automation_button = QPushButton('Start taking items offline')
         self.start_automation_button.setIcon(QtGui.QIcon('_internal/icons/play.svg'))
         self.start_automation_button.clicked.connect(self.start_automation)
-        self.layout.addWidget(self.start_automation_button, 1, 1)
+        self.layout.addWidget(self.start_automation_button, 2, 1)
 
         self.stop_automation_button = QPushButton('Stop')
         self.stop_automation_button.setIcon(QtGui.QIcon('_internal/icons/stop.svg'))
         self.stop_automation_button.clicked.connect(self.stop_automation)
-        self.layout.addWidget(self.stop_automation_button, 1, 2)
+        self.layout.addWidget(self.stop_automation_button, 2, 2)
 
         self.set_initial_state()
 
     def set_initial_state(self):
-        for table_widget in self.group.findChildren(QTableWidget):  # type: QTableWidget
-            table_widget.setEnabled(False)
-
+        self.table.setEnabled(False)
         self.add_row_button.setEnabled(False)
         self.start_automation_button.setEnabled(False)
         self.stop_automation_button.setEnabled(False)
 
     def set_ready_state(self):
-        for table_widget in self.group.findChildren(QTableWidget):  # type: QTableWidget
-            table_widget.setEnabled(True)
-
+        self.table.setEnabled(True)
         self.add_row_button.setEnabled(True)
         self.start_automation_button.setEnabled(True)
         self.stop_automation_button.setEnabled(False)
 
     def set_running_state(self):
-        for table_widget in self.group.findChildren(QTableWidget):  # type: QTableWidget
-            table_widget.setEnabled(False)
-
+        self.table.setEnabled(False)
         self.add_row_button.setEnabled(False)
         self.start_automation_button.setEnabled(False)
         self.stop_automation_button.setEnabled(True)
 
-    def show_location(self, row, column):
-        if column != 0:
-            return
-
-        menu = QMenu()
-        action_list = []
-        for store in self.agent.stores:
-            action = QAction(store.name)
-            action.triggered.connect(partial(self.edit_location, row, column, store))
-            action_list.append(action)
-
-        menu.addActions(action_list)
-
-        cell_rect = self.table.visualItemRect(self.table.item(row, column))
-        global_position = self.table.viewport().mapToGlobal(cell_rect.bottomLeft())
-        action = menu.exec(global_position)
-
-    def edit_location(self, row, column, store):
-        item = self.table.item(row, column)
-        if item:
-            item.setText(store.name)
-            item.setData(Qt.UserRole, store)
-
     def draw_table_header(self):
-        self.table.setColumnCount(len(COLUMN_NAMES))
-        self.table.setHorizontalHeaderLabels(COLUMN_NAMES)
-        self.table.horizontalHeader().setSectionResizeMode(ColumnIdx.LOCATION, QHeaderView.ResizeMode.ResizeToContents)
-        self.table.horizontalHeader().setSectionResizeMode(ColumnIdx.KEYWORD, QHeaderView.ResizeMode.Stretch)
-        self.table.horizontalHeader().setSectionResizeMode(ColumnIdx.START, QHeaderView.ResizeMode.ResizeToContents)
-        self.table.horizontalHeader().setSectionResizeMode(ColumnIdx.END, QHeaderView.ResizeMode.ResizeToContents)
-        self.table.horizontalHeader().setSectionResizeMode(ColumnIdx.REASON, QHeaderView.ResizeMode.ResizeToContents)
-        self.table.horizontalHeader().setSectionResizeMode(ColumnIdx.DELETE, QHeaderView.ResizeMode.ResizeToContents)
+        header = self.table.horizontalHeader()
+        # Only the rows in view are measured, however many rows the table has.
+        header.setResizeContentsPrecision(0)
+        header.setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(ColumnIdx.KEYWORD, QHeaderView.ResizeMode.Stretch)
+        # No column is sorted until a header is clicked, so the rows keep their saved order.
+        header.setSortIndicator(-1, Qt.SortOrder.AscendingOrder)
+        self.table.setSortingEnabled(True)
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+
+    @Slot(str)
+    def filter_rows(self, text: str):
+        self.model.set_filter(text)
+
+    @Slot(str)
+    def show_rejected_edit(self, message: str):
+        QToolTip.showText(QtGui.QCursor.pos(), message, self.table)
 
     @Slot()
     def add_empty_row(self):
-        row_idx = self.table.rowCount()
-        store = {
-            'id': -1,
-            'name': '',
-        }
-        self.add_row(row_idx, store, '', (0, 0), (23, 59), '')
-
-    def add_row(self, row_idx: int, store: dict, keyword: str, start_time: tuple[int, int], end_time: tuple[int, int],
-                reason: str):
-        self.table.insertRow(row_idx)
-
-        store = Store(store['id'], store['name'])
-        store_item = QTableWidgetItem(store.name)
-        store_item.setData(Qt.UserRole, store)
-        self.table.setItem(row_idx, ColumnIdx.LOCATION, store_item)
-
-        keyword_item = QTableWidgetItem(keyword)
-        self.table.setItem(row_idx, ColumnIdx.KEYWORD, keyword_item)
-
-        start_time_edit = QTimeEdit(QTime(*start_time))
-        start_time_edit.setDisplayFormat('hh:mm')
-        start_time_edit.setFrame(False)
-        self.table.setCellWidget(row_idx, ColumnIdx.START, start_time_edit)
-
-        end_time_edit = QTimeEdit(QTime(*end_time))
-        end_time_edit.setDisplayFormat('hh:mm')
-        end_time_edit.setFrame(False)
-        self.table.setCellWidget(row_idx, ColumnIdx.END, end_time_edit)
-
-        reason_edit = QTableWidgetItem(reason)
-        self.table.setItem(row_idx, ColumnIdx.REASON, reason_edit)
-
-        delete_button = QPushButton('Delete')
-        delete_button.clicked.connect(self.del_row)
-        self.table.setCellWidget(row_idx, ColumnIdx.DELETE, delete_button)
-
-    @Slot()
-    def del_row(self):
-        self.table.removeRow(self.table.currentRow())
+        self.model.append_row(ScheduleRow.empty())
+        self.table.scrollToBottom()
 
     @Slot()
     def start_automation(self):
         action_row_list = self.collect_action_rows_from_table()
         if len(action_row_list) > 0:
             self.set_running_state()
-            self.agent_status.set_running_status()
-            self.agent.start_scheduler(action_row_list)
+            self.agent_status.set_busy_status('Starting')
+            # Loading the catalog and bringing the rows up to date may take minutes; the window stays responsive and
+            # Stop cancels it.
+            self._start_worker = Worker(self.agent.start_scheduler, action_row_list, cancellable=True)
+            signals = self._start_worker.signals
+            signals.progress.connect(self.show_start_progress)
+            signals.succeeded.connect(self.show_started)
+            signals.failed.connect(self.show_start_failed)
+            signals.cancelled.connect(self.show_start_cancelled)
+            self._start_worker.start()
         else:
             self.set_ready_state()
 
+    @Slot(str)
+    def show_start_progress(self, message: str):
+        if not self._start_worker.cancel_event.is_set():
+            self.agent_status.set_busy_status(message)
+
+    @Slot(object)
+    def show_started(self, _):
+        if self._start_worker.cancel_event.is_set():
+            # Stop was clicked after the start had returned, but before this was handled.
+            self.show_start_cancelled()
+            return
+        self._end_start()
+        self.agent_status.set_running_status()
+
+    @Slot(str)
+    def show_start_failed(self, message: str):
+        self.agent.stop_scheduler()
+        self.set_ready_state()
+        self.agent_status.set_error_status(f'Failed to start: {message}')
+        self._end_start()
+
+    @Slot()
+    def show_start_cancelled(self):
+        self.agent.stop_scheduler()
+        self.set_ready_state()
+        self.agent_status.set_logged_in_status()
+        self._end_start()
+
+    def _end_start(self):
+        self._start_worker = None
+        after_start, self._after_start = self._after_start, None
+        if after_start is not None:
+            after_start()
+
     @Slot()
     def stop_automation(self):
+        if self._start_worker is not None:
+            # The scheduler is stopped once the worker has returned, so that the two never change it at once.
+            self._start_worker.cancel()
+            self.stop_automation_button.setEnabled(False)
+            self.agent_status.set_busy_status('Cancelling')
+            return
+
         self.set_ready_state()
         self.agent_status.set_logged_in_status()
         self.agent.stop_scheduler()
 
+    @property
+    def is_starting(self) -> bool:
+        return self._start_worker is not None
+
+    def cancel_start(self, then: Callable[[], None]):
+        """
+        Cancels the start in progress and calls then once the start has returned.
+        """
+        self._after_start = then
+        self.stop_automation()
+
     def collect_action_rows_from_table(self):
-        action_row_list = []
-        now = datetime.datetime.now()
-        for row_idx in range(self.table.rowCount()):
-            keyword = self.table.item(row_idx, ColumnIdx.KEYWORD).text()
-            if keyword == '':
-                # Keyword is not set; skipped.
-                continue
-
-            store = self.table.item(row_idx, ColumnIdx.LOCATION).data(Qt.UserRole)
-            if store.id == -1:
-                # Location is not set; skipped.
-                continue
-
-            start_time = self.table.cellWidget(row_idx, ColumnIdx.START).time().toPython()  # type: datetime.time
-            start_datetime = now.replace(hour=start_time.hour, minute=start_time.minute, second=start_time.second)
-            end_time = self.table.cellWidget(row_idx, ColumnIdx.END).time().toPython()  # type: datetime.time
-            end_datetime = now.replace(hour=end_time.hour, minute=end_time.minute, second=end_time.second)
-            reason = self.table.item(row_idx, ColumnIdx.REASON).text()
-
-            item_row = ActionRowV2(
-                keyword=keyword,
-                action_time=start_datetime,
-                action_type=ActionType.START,
-                reason=reason,
-                store_id=store.id,
-            )
-            action_row_list.append(item_row)
-            item_row = ActionRowV2(
-                keyword=keyword,
-                action_time=end_datetime,
-                action_type=ActionType.END,
-                reason=reason,
-                store_id=store.id,
-            )
-            action_row_list.append(item_row)
-
-        return action_row_list
+        return collect_action_rows_from_config(self.dump_config(), datetime.datetime.now())
 
     def load_config(self, config: dict) -> NoReturn:
         if config['ItemTable'] is None:
             return
 
-        for row in config['ItemTable']:
-            self.add_row(
-                row['row_idx'], row['store'], row['keyword'], row['start_time'], row['end_time'], row['reason']
-            )
+        # The rows are loaded at once, with a single reset of the view.
+        rows = sorted(config['ItemTable'], key=lambda row: row['row_idx'])
+        self.model.set_rows([ScheduleRow.from_config(row) for row in rows])
 
     def dump_config(self) -> dict:
         config = {
-            'ItemTable': [],
+            'ItemTable': [row.to_config(row_idx) for row_idx, row in enumerate(self.model.rows)],
         }
-        for row_idx in range(self.table.rowCount()):
-            row = {
-                'row_idx': row_idx,
-            }
-            store = self.table.item(row_idx, ColumnIdx.LOCATION).data(Qt.UserRole)  # type: Store
-            row['store'] = {
-                'id': store.id,
-                'name': store.name,
-            }
-            row['keyword'] = self.table.item(row_idx, ColumnIdx.KEYWORD).text() \
-                if self.table.item(row_idx, ColumnIdx.KEYWORD) else ''
-
-            start_time = self.table.cellWidget(row_idx, ColumnIdx.START).time().toPython()  # type: datetime.time
-            row['start_time'] = (start_time.hour, start_time.minute)
-            end_time = self.table.cellWidget(row_idx, ColumnIdx.END).time().toPython()  # type: datetime.time
-            row['end_time'] = (end_time.hour, end_time.minute)
-            reason = self.table.item(row_idx, ColumnIdx.REASON).text() \
-                if self.table.item(row_idx, ColumnIdx.REASON) else ''
-            row['reason'] = reason
-
-            config['ItemTable'].append(row)
-
         return config
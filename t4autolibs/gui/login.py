@@ -5,6 +5,7 @@ from PySide6.QtWidgets import QFormLayout, QGroupBox, QLineEdit, QHBoxLayout, QC
 from t4autolibs.cores import UserInfo, LoginStatus, AgentV2
 from t4autolibs.gui.agent_status import AgentStatus
 from t4autolibs.gui.item_table import ItemTable
+from t4autolibs.gui.worker import Worker
 
 
 class Login:
@@ -36,6 +37,7 @@ class Login:
         self.checkbox_layout.addWidget(self.display_password)
 
         self._is_logged_in = False
+        self._worker = None  # type: Worker | None
         self.login_button = QPushButton('Login')
         self.login_button.setIcon(QtGui.QIcon('_internal/icons/login.svg'))
         self.login_button.clicked.connect(self.login)
@@ -60,35 +62,69 @@ class Login:
         elif Qt.CheckState(state) == Qt.CheckState.Unchecked:
             self.password_edit.setEchoMode(QLineEdit.EchoMode.Password)
 
+    def _run(self, worker: Worker, message: str):
+        # The request runs on a worker thread; the buttons stay disabled until it returns.
+        self._worker = worker
+        self._worker.signals.failed.connect(self.show_error)
+        self.set_busy_state(message)
+        self._worker.start()
+
     @Slot()
     def login(self):
-        if not self._is_logged_in:
+        if not self._is_logged_in and self._worker is None:
             user_info = UserInfo(self.username_edit.text(), self.password_edit.text())
-            login_status = self.agent.login(user_info)  # type: LoginStatus
-
-            if login_status.success:
-                self._is_logged_in = True
-                self.set_login_state()
-                self.login_message.setStyleSheet('color: green')
-            else:
-                self._is_logged_in = False
-                self.set_logout_state()
-                self.login_message.setStyleSheet('color: red')
-            self.login_message.setText(login_status.message)
+            worker = Worker(self.agent.login, user_info)
+            worker.signals.succeeded.connect(self.show_login_status)
+            self._run(worker, 'Logging in...')
+
+    @Slot(object)
+    def show_login_status(self, login_status: LoginStatus):
+        self._worker = None
+        if login_status.success:
+            self._is_logged_in = True
+            self.set_login_state()
+            self.login_message.setStyleSheet('color: green')
+        else:
+            self._is_logged_in = False
+            self.set_logout_state()
+            self.login_message.setStyleSheet('color: red')
+        self.login_message.setText(login_status.message)
 
     @Slot()
     def logout(self):
+        if self.item_table.is_starting:
+            # The start is cancelled first, so that the scheduler is never started after the session has ended.
+            self.set_busy_state('Cancelling the start...')
+            self.item_table.cancel_start(self.logout)
+            return
+
         self.set_logout_state()
+        if self._is_logged_in and self._worker is None:
+            worker = Worker(self.agent.logout)
+            worker.signals.succeeded.connect(self.show_logout_status)
+            self._run(worker, 'Logging out...')
+
+    @Slot(object)
+    def show_logout_status(self, login_status: LoginStatus):
+        self._worker = None
+        if login_status.success:
+            self._is_logged_in = False
+            self.set_logout_state()
+            self.login_message.setStyleSheet('color: green')
+        else:
+            self.set_login_state()
+            self.login_message.setStyleSheet('color: red')
+        self.login_message.setText(login_status.message)
+
+    @Slot(str)
+    def show_error(self, message: str):
+        self._worker = None
         if self._is_logged_in:
-            login_status = self.agent.logout()  # type:LoginStatus
-
-            if login_status.success:
-                self._is_logged_in = False
-                self.set_logout_state()
-                self.login_message.setStyleSheet('color: green')
-            else:
-                self.login_message.setStyleSheet('color: red')
-            self.login_message.setText(login_status.message)
+            self.set_login_state()
+        else:
+            self.set_logout_state()
+        self.login_message.setStyleSheet('color: red')
+        self.login_message.setText(message)
 
     def set_logout_state(self):
         self.login_button.setEnabled(True)
@@ -100,6 +136,15 @@ class Login:
         self.item_table.set_initial_state()
         self.agent_status.set_not_logged_in_status()
 
+    def set_busy_state(self, message: str):
+        self.login_button.setEnabled(False)
+        self.logout_button.setEnabled(False)
+        self.username_edit.setEnabled(False)
+        self.password_edit.setEnabled(False)
+        self.display_password.setEnabled(False)
+        self.login_message.setStyleSheet('')
+        self.login_message.setText(message)
+
     def set_login_state(self):
         self.login_button.setEnabled(False)
         self.logout_button.setEnabled(True)
@@ -36,6 +36,7 @@ class Composition(QWidget):
             with open(config_file, 'r', encoding='utf-8') as f:
                 config = json.load(f)
 
+            self.agent.load_config(config)
             self.window_size.load_config(config)
             self.item_table.load_config(config)
         else:
@@ -43,6 +44,7 @@ class Composition(QWidget):
 
     def dump_config_to_file(self) -> NoReturn:
         config = {}
+        config |= self.agent.dump_config()
         config |= self.window_size.dump_config()
         config |= self.item_table.dump_config()
         config_file = Path('config.json')
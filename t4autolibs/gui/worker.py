@@ -0,0 +1,66 @@
+import logging
+from threading import Event
+from typing import Callable
+
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal
+
+from t4autolibs.cores import Cancelled
+
+
+class WorkerSignals(QObject):
+    # Emitted with a step of the call, e.g. 'Loading the catalog'.
+    progress = Signal(str)
+    # Emitted with the return value of the call.
+    succeeded = Signal(object)
+    # Emitted with the error message when the call raises.
+    failed = Signal(str)
+    # Emitted when the call stops at the cancellation, or finishes after it.
+    cancelled = Signal()
+
+
+class Worker(QRunnable):
+    """
+    Runs a blocking call of the agent, e.g. a login or a catalog download, on the global thread pool, so that the event
+    loop keeps painting the window and handling input meanwhile.
+
+    The outcome is reported through signals, which Qt delivers on the GUI thread. A cancellable call also receives the
+    progress and cancel_event keyword arguments.
+    """
+
+    def __init__(self, func: Callable, *args, cancellable: bool = False):
+        super().__init__()
+        self.func = func
+        self.args = args
+        self.cancellable = cancellable
+        self.cancel_event = Event()
+        self.signals = WorkerSignals()
+        # The worker is kept by its owner until its signals are handled, not deleted by the pool after run.
+        self.setAutoDelete(False)
+        self.class_logger = logging.getLogger('t4auto')
+
+    def start(self):
+        QThreadPool.globalInstance().start(self)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        kwargs = {}
+        if self.cancellable:
+            kwargs = {'progress': self.signals.progress.emit, 'cancel_event': self.cancel_event}
+        try:
+            result = self.func(*self.args, **kwargs)
+        except Cancelled as e:
+            self.class_logger.info(f'{e}')
+            self.signals.cancelled.emit()
+            return
+        except Exception as e:
+            self.class_logger.exception(f'{getattr(self.func, '__name__', self.func)} failed: {e}')
+            self.signals.failed.emit(str(e))
+            return
+
+        if self.cancel_event.is_set():
+            # Cancelled too late to stop the call; the receiver undoes it.
+            self.signals.cancelled.emit()
+        else:
+            self.signals.succeeded.emit(result)
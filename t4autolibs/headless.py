@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import datetime
+import getpass
+import json
+import logging
+import os
+import signal
+from contextlib import AsyncExitStack
+from pathlib import Path
+from threading import Event
+
+import aiohttp
+
+from t4autolibs.async_cores import AsyncAgent
+from t4autolibs.cores import AgentV2, AgentSettings, UserInfo, collect_action_rows_from_config
+from t4autolibs.metrics import Metrics, MetricsServer
+from t4autolibs.session_pool import ACCOUNTS_DIR, SessionPool
+from t4autolibs.timeline import IntervalTrigger
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Runs the schedule saved in config.json without the GUI.')
+    parser.add_argument('--config', type=Path, default=Path('config.json'), help='the config.json saved by the GUI')
+    parser.add_argument('--username', default=os.environ.get('T4AUTO_USERNAME'),
+                        help='defaults to $T4AUTO_USERNAME; the password is read from $T4AUTO_PASSWORD or prompted')
+    parser.add_argument('--account', nargs=2, action='append', metavar=('USERNAME', 'CONFIG'), dest='accounts',
+                        help='runs several accounts in one process, each with its own config.json; '
+                             'the passwords are prompted')
+    parser.add_argument('--status-minutes', type=int, default=60,
+                        help='how often the accounts are summarized in the log when running several accounts')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='serves the metrics of all accounts on this port when running several accounts or with '
+                             'the asyncio engine; the metrics_port of their configs is ignored')
+    parser.add_argument('--engine', choices=['threads', 'asyncio'], default='threads',
+                        help='asyncio runs every account on one event loop, sharing one connection pool, instead of '
+                             'on worker threads; it has no local catalog, rule cache or catch-up after a restart')
+    return parser.parse_args()
+
+
+def wait_for_stop_signal():
+    stop_event = Event()
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    # Waiting with a timeout keeps the main thread responsive to signals on every platform.
+    while not stop_event.wait(1):
+        pass
+
+
+def run_accounts(args) -> int:
+    pool = SessionPool(metrics_port=args.metrics_port)
+    for username, config_path in args.accounts:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+        login_status = pool.add_account(UserInfo(username, getpass.getpass(f'Password for {username}: ')), config)
+        if not login_status.success:
+            pool.close()
+            return 1
+        pool.start_scheduler(username, collect_action_rows_from_config(config, datetime.datetime.now()))
+
+    pool.log_status()
+    status_interval = datetime.timedelta(minutes=args.status_minutes)
+    pool.timeline.add(pool.log_status, IntervalTrigger(datetime.datetime.now() + status_interval, status_interval))
+    wait_for_stop_signal()
+    pool.close()
+    return 0
+
+
+async def run_async_agents(accounts: list[tuple[UserInfo, dict]], several: bool, metrics_port: int) -> int:
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    signal.signal(signal.SIGINT, lambda *_: loop.call_soon_threadsafe(stop_event.set))
+    signal.signal(signal.SIGTERM, lambda *_: loop.call_soon_threadsafe(stop_event.set))
+
+    metrics = Metrics()
+    async with AsyncExitStack() as stack:
+        # One connection pool for every account.
+        connector = aiohttp.TCPConnector()
+        stack.push_async_callback(connector.close)
+        agents = []
+        for user_info, config in accounts:
+            agent = await stack.enter_async_context(AsyncAgent(
+                AgentSettings.from_dict(config.get('AgentSettings') or {}),
+                data_dir=Path(ACCOUNTS_DIR) / user_info.username if several else Path('.'),
+                connector=connector,
+                metrics=metrics,
+                metrics_dir=Path(ACCOUNTS_DIR) if several else None,
+                account=user_info.username if several else '',
+            ))
+            login_status = await agent.login(user_info)
+            if not login_status.success:
+                return 1
+            agents.append((agent, collect_action_rows_from_config(config, datetime.datetime.now())))
+        if metrics_port:
+            try:
+                stack.callback(MetricsServer(metrics, metrics_port).close)
+            except OSError as e:
+                logging.getLogger('t4auto').error(f'Failed to serve the metrics on port {metrics_port}: {e}')
+
+        tasks = [asyncio.create_task(agent.run_scheduler(actions)) for agent, actions in agents]
+        await stop_event.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for agent, _ in agents:
+            await agent.logout()
+    return 0
+
+
+def run_async(args) -> int:
+    accounts = []
+    if args.accounts:
+        for username, config_path in args.accounts:
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            accounts.append((UserInfo(username, getpass.getpass(f'Password for {username}: ')), config))
+    else:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        username = args.username if args.username else input('Username: ')
+        password = os.environ.get('T4AUTO_PASSWORD') or getpass.getpass('Password: ')
+        accounts.append((UserInfo(username, password), config))
+    return asyncio.run(run_async_agents(accounts, bool(args.accounts), args.metrics_port))
+
+
+def main() -> int:
+    args = parse_args()
+    if args.engine == 'asyncio':
+        return run_async(args)
+    if args.accounts:
+        return run_accounts(args)
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    username = args.username if args.username else input('Username: ')
+    password = os.environ.get('T4AUTO_PASSWORD') or getpass.getpass('Password: ')
+
+    agent = AgentV2()
+    agent.load_config(config)
+    login_status = agent.login(UserInfo(username, password))
+    if not login_status.success:
+        return 1
+
+    action_row_list = collect_action_rows_from_config(config, datetime.datetime.now())
+    if len(action_row_list) == 0:
+        agent.class_logger.error(f'No rows with both a location and a keyword in {args.config}.')
+        agent.logout()
+        return 1
+
+    agent.start_scheduler(action_row_list)
+    wait_for_stop_signal()
+    agent.stop_scheduler()
+    agent.logout()
+    return 0
@@ -0,0 +1,17 @@
+from dataclasses import dataclass
+
+
+@dataclass(slots=True)
+class Item:
+    """
+    The fields of a searched item or availability rule that t4auto uses. The rest of the JSON record is dropped as soon
+    as its page arrives.
+    """
+    plu_code: int | str
+    long_name: str
+    id: int | None = None
+    store_id: int | None = None
+
+    @classmethod
+    def from_json(cls, data: dict):
+        return cls(data['PLUCode'], data['LongName'], data.get('ID'), data.get('StoreID'))
@@ -0,0 +1,53 @@
+import datetime
+import sqlite3
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+
+JOB_STORE_FILE = 't4auto_jobs.sqlite3'
+
+
+@dataclass
+class AppliedState:
+    row_key: str
+    keyword: str
+    store_id: int
+    reason: str
+    action_type: int
+    applied_at: datetime.datetime
+
+
+class JobStore:
+    """
+    The last action applied to each schedule row, kept on disk so that a restart knows which items are offline.
+    """
+
+    def __init__(self, path: Path = Path(JOB_STORE_FILE)):
+        self.path = path
+        with closing(self._connect()) as connection, connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS applied_states ('
+                               'row_key TEXT PRIMARY KEY, keyword TEXT, store_id INTEGER, reason TEXT, '
+                               'action_type INTEGER, applied_at TEXT)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+    def record_applied(self, action_rows: list, applied_at: datetime.datetime):
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO applied_states VALUES (?, ?, ?, ?, ?, ?)',
+                [
+                    (action_row.row_key, action_row.keyword, action_row.store_id, action_row.reason,
+                     int(action_row.action_type), applied_at.isoformat())
+                    for action_row in action_rows
+                ]
+            )
+
+    def load_applied_states(self) -> dict[str, AppliedState]:
+        with closing(self._connect()) as connection:
+            rows = connection.execute('SELECT * FROM applied_states').fetchall()
+        return {
+            row_key: AppliedState(row_key, keyword, store_id, reason, action_type,
+                                  datetime.datetime.fromisoformat(applied_at))
+            for row_key, keyword, store_id, reason, action_type, applied_at in rows
+        }
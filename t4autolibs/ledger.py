@@ -0,0 +1,85 @@
+import datetime
+import json
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import Iterable
+
+LEDGER_FILE = 't4auto_ledger.sqlite3'
+
+
+class RuleLedger:
+    """
+    Availability-rule IDs created by the offline actions, keyed by schedule row, so that the online actions can delete
+    exactly those rules without searching for them. Rules that t4auto did not create are never recorded.
+
+    Every row is stored separately, so recording or removing a few rows does not rewrite the whole ledger.
+    """
+
+    def __init__(self, path: Path = Path(LEDGER_FILE)):
+        self.path = path
+        with closing(self._connect()) as connection, connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS rule_ids ('
+                               'row_key TEXT PRIMARY KEY, recorded_at TEXT, rule_ids TEXT)')
+            has_rule_rows = connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rule_rows'"
+            ).fetchone()
+            if not has_rule_rows:
+                # Which rows hold each rule, so that a shared rule is looked up without reading the whole ledger.
+                connection.execute('CREATE TABLE rule_rows ('
+                                   'rule_id TEXT, row_key TEXT, PRIMARY KEY (rule_id, row_key)) WITHOUT ROWID')
+                connection.execute('CREATE INDEX rule_rows_row_key ON rule_rows (row_key)')
+                connection.execute('INSERT OR IGNORE INTO rule_rows '
+                                   'SELECT CAST(json_each.value AS TEXT), row_key FROM rule_ids, json_each(rule_ids)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def record(self, row_key: str, rule_ids: list):
+        self.record_many({row_key: rule_ids})
+
+    def record_many(self, rule_ids_by_row_key: dict[str, list]):
+        recorded_at = datetime.datetime.now().isoformat()
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO rule_ids VALUES (?, ?, ?)',
+                [(row_key, recorded_at, json.dumps(rule_ids)) for row_key, rule_ids in rule_ids_by_row_key.items()]
+            )
+            connection.executemany('DELETE FROM rule_rows WHERE row_key = ?',
+                                   [(row_key,) for row_key in rule_ids_by_row_key])
+            connection.executemany(
+                'INSERT OR IGNORE INTO rule_rows VALUES (?, ?)',
+                [(str(rule_id), row_key) for row_key, rule_ids in rule_ids_by_row_key.items() for rule_id in rule_ids]
+            )
+
+    def get(self, row_key: str, max_age: datetime.timedelta) -> list | None:
+        """
+        Returns the recorded rule IDs, or None if the row has no entry or the entry is older than max_age.
+        """
+        with closing(self._connect()) as connection:
+            entry = connection.execute('SELECT recorded_at, rule_ids FROM rule_ids WHERE row_key = ?',
+                                       (row_key,)).fetchone()
+        if entry is None:
+            return None
+        recorded_at, rule_ids = entry
+        if datetime.datetime.now() - datetime.datetime.fromisoformat(recorded_at) > max_age:
+            return None
+        return json.loads(rule_ids)
+
+    def held_rule_ids(self, rule_ids: Iterable, excluded_row_keys: Iterable[str] = ()) -> set[str]:
+        """
+        Returns those of the rule IDs that a row other than the excluded ones holds, as strings, however old its entry
+        is. A rule that several rows share is deleted only by the last of them to take its items online.
+        """
+        with closing(self._connect()) as connection:
+            entries = connection.execute(
+                'SELECT DISTINCT rule_id FROM rule_rows WHERE rule_id IN (SELECT value FROM json_each(?)) '
+                'AND row_key NOT IN (SELECT value FROM json_each(?))',
+                (json.dumps([str(rule_id) for rule_id in rule_ids]), json.dumps(list(excluded_row_keys)))
+            ).fetchall()
+        return {rule_id for rule_id, in entries}
+
+    def remove(self, row_keys: list[str]):
+        with closing(self._connect()) as connection, connection:
+            connection.executemany('DELETE FROM rule_ids WHERE row_key = ?', [(row_key,) for row_key in row_keys])
+            connection.executemany('DELETE FROM rule_rows WHERE row_key = ?', [(row_key,) for row_key in row_keys])
@@ -0,0 +1,123 @@
+import atexit
+import datetime
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from threading import Lock
+
+LOG_FILE = 't4auto_log.txt'
+SUMMARY_LOG_FILE = 't4auto_actions.jsonl'
+
+_lock = Lock()
+_listener = None
+_queue_handler = None
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats the summary attached to a record, e.g. logger.info(message, extra={'summary': {...}}), as one JSON line.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+        } | record.summary, default=str)
+
+
+class AccountLogger(logging.LoggerAdapter):
+    """
+    Prefixes the messages of an account, e.g. one of a SessionPool, with its username, and adds it to their summaries.
+    """
+
+    def process(self, msg, kwargs):
+        account = self.extra['account']
+        extra = kwargs.get('extra', {})
+        if 'summary' in extra:
+            extra = extra | {'summary': {'account': account} | extra['summary']}
+        return f'{account}: {msg}', kwargs | {'extra': self.extra | extra}
+
+
+def _has_summary(record: logging.LogRecord) -> bool:
+    return hasattr(record, 'summary')
+
+
+def _gzip_namer(name: str) -> str:
+    return name + '.gz'
+
+
+def _gzip_rotator(source: str, dest: str):
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def _create_file_handler(path: str, max_bytes: int, backup_count: int, rotate_when: str) -> logging.Handler:
+    if rotate_when:
+        handler = TimedRotatingFileHandler(path, when=rotate_when, backupCount=backup_count, encoding='utf-8')
+    else:
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    # Rotated files are compressed, e.g. t4auto_log.txt.1.gz.
+    handler.namer = _gzip_namer
+    handler.rotator = _gzip_rotator
+    return handler
+
+
+def configure_logging(max_bytes: int, backup_count: int, rotate_when: str = '', console_level: int = logging.INFO):
+    """
+    Sets up the t4auto logger once per process; later calls, e.g. from further agents, keep the existing handlers.
+
+    Records are put on a queue and written by a background thread, so the thread logging them never waits on the disk
+    or the console. The log file rotates when it reaches max_bytes, or at rotate_when (e.g. 'midnight') if set.
+    """
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is not None:
+            return
+
+        formatter = logging.Formatter('[%(asctime)s] %(name)s (%(levelname)s): %(message)s', '%Y-%m-%d %H:%M:%S')
+        fh = _create_file_handler(LOG_FILE, max_bytes, backup_count, rotate_when)
+        fh.setLevel(logging.DEBUG)
+        fh.setFormatter(formatter)
+
+        ch = logging.StreamHandler()
+        ch.setLevel(console_level)
+        ch.setFormatter(formatter)
+
+        sh = _create_file_handler(SUMMARY_LOG_FILE, max_bytes, backup_count, rotate_when)
+        sh.setLevel(logging.INFO)
+        sh.setFormatter(JsonLinesFormatter())
+        sh.addFilter(_has_summary)
+
+        log_queue = queue.SimpleQueue()
+        _queue_handler = QueueHandler(log_queue)
+        _listener = QueueListener(log_queue, fh, ch, sh, respect_handler_level=True)
+        _listener.start()
+
+        logger = logging.getLogger('t4auto')
+        logger.setLevel(logging.DEBUG)
+        logger.addHandler(_queue_handler)
+
+
+def shutdown_logging():
+    """
+    Writes the queued records and closes the handlers, so that configure_logging can set them up again.
+    """
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is None:
+            return
+
+        logging.getLogger('t4auto').removeHandler(_queue_handler)
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+        _queue_handler = None
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from threading import Lock, Thread
+
+METRICS_FILE = 't4auto_metrics.prom'
+METRICS_SUMMARY_FILE = 't4auto_metrics.json'
+# In seconds, from a fast request to a job that is several minutes late.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class Histogram:
+    """
+    Counts of observations per bucket, plus their sum; an observation costs one bisection.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last count is the +Inf bucket.
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float | None:
+        """
+        Returns the upper bound of the bucket holding the q-quantile, or the maximum for the +Inf bucket.
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative_count = 0
+        for upper_bound, count in zip(self.buckets, self.counts):
+            cumulative_count += count
+            if cumulative_count >= rank:
+                return min(upper_bound, self.max)
+        return self.max
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms keyed by name and labels, exported in the Prometheus text format and as a JSON
+    summary.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        # Jobs on several dispatcher threads export the metrics at once; they share the temporary files.
+        self._write_lock = Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def labelled(self, **labels) -> 'LabelledMetrics':
+        return LabelledMetrics(self, labels)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def time(self, name: str, **labels):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started_at, **labels)
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for metric_type, values in [('counter', self._counters), ('gauge', self._gauges)]:
+                typed_names = set()
+                for (name, labels), value in sorted(values.items()):
+                    if name not in typed_names:
+                        lines.append(f'# TYPE {name} {metric_type}')
+                        typed_names.add(name)
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+
+            typed_names = set()
+            for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                if name not in typed_names:
+                    lines.append(f'# TYPE {name} histogram')
+                    typed_names.add(name)
+                cumulative_count = 0
+                for upper_bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative_count += count
+                    lines.append(f'{name}_bucket{_format_labels(labels + (('le', str(upper_bound)),))} '
+                                 f'{cumulative_count}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+                lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> dict:
+        def entry(name, labels, **values):
+            return {'name': name, 'labels': dict(labels)} | values
+
+        with self._lock:
+            return {
+                'counters': [
+                    entry(name, labels, value=value) for (name, labels), value in sorted(self._counters.items())
+                ],
+                'gauges': [
+                    entry(name, labels, value=value) for (name, labels), value in sorted(self._gauges.items())
+                ],
+                'histograms': [
+                    entry(name, labels, count=histogram.count, sum=histogram.sum, max=histogram.max,
+                          p50=histogram.quantile(0.5), p95=histogram.quantile(0.95), p99=histogram.quantile(0.99))
+                    for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0])
+                ],
+            }
+
+    def write(self, directory: Path):
+        """
+        Writes the Prometheus text file and the JSON summary into the directory, replacing the previous ones at once so
+        that a reader never sees a partial file.
+        """
+        with self._write_lock:
+            for file_name, content in [(METRICS_FILE, self.to_prometheus()),
+                                       (METRICS_SUMMARY_FILE, json.dumps(self.summary(), indent=4))]:
+                path = directory / file_name
+                temp_path = path.with_name(path.name + '.tmp')
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                os.replace(temp_path, path)
+
+
+class LabelledMetrics(Metrics):
+    """
+    A view of a registry that adds the labels to everything it records, e.g. the account of an agent in a SessionPool.
+    It exports the whole registry, so the accounts of a process share one set of files and one endpoint.
+    """
+
+    def __init__(self, metrics: Metrics, labels: dict):
+        self._lock = metrics._lock
+        self._write_lock = metrics._write_lock
+        self._counters = metrics._counters
+        self._gauges = metrics._gauges
+        self._histograms = metrics._histograms
+        self.labels = labels
+
+    def _key(self, name: str, labels: dict) -> tuple:
+        return Metrics._key(name, self.labels | labels)
+
+
+class MetricsServer:
+    """
+    Serves /metrics in the Prometheus text format and /metrics.json as the JSON summary on localhost.
+    """
+
+    def __init__(self, metrics: Metrics, port: int):
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = metrics.to_prometheus().encode()
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(metrics.summary()).encode()
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logging.getLogger('t4auto').info(f'Serving metrics at http://127.0.0.1:{self.port}/metrics')
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,246 @@
+import argparse
+import itertools
+import json
+import random
+import secrets
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Lock, Thread
+from urllib.parse import urlsplit, parse_qs
+
+WORDS = ['beef', 'chicken', 'pork', 'veggie', 'burger', 'wrap', 'salad', 'fries', 'cola', 'tea', 'milk', 'latte',
+         'spicy', 'cheese', 'bacon', 'rice', 'noodle', 'soup', 'cake', 'juice', 'mango', 'peach', 'lemon', 'ice']
+
+
+@dataclass
+class MockServerSettings:
+    n_items: int = 1000
+    n_stores: int = 20
+    latency_seconds: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 503
+    seed: int = 0
+
+
+class MockT4State:
+    """
+    The catalog, stores, availability rules and sessions of the stand-in server, plus what it has been asked to do.
+    """
+
+    def __init__(self, settings: MockServerSettings):
+        self.settings = settings
+        self.lock = Lock()
+        self.request_counts = Counter()
+        self.request_times = defaultdict(list)  # 'METHOD path' -> completion times of successful requests
+        self.sessions = set()
+        self.random = random.Random(settings.seed)
+        self.rule_ids = itertools.count(1)
+
+        self.items = []
+        for plu_code in range(1000, 1000 + settings.n_items):
+            long_name = ' '.join(self.random.sample(WORDS, 3)).title()
+            # The other columns of a real record, which t4auto does not use.
+            self.items.append({
+                'ID': plu_code,
+                'PLUCode': plu_code,
+                'LongName': long_name,
+                'ShortName': long_name[:12],
+                'KitchenName': long_name.upper(),
+                'Price': round(self.random.uniform(2, 20), 2),
+                'CostPrice': round(self.random.uniform(1, 10), 2),
+                'TaxCode': 'GST',
+                'CategoryID': self.random.randint(1, 40),
+                'Barcode': f'{self.random.randrange(10 ** 12):013d}',
+                'Active': True,
+                'Modified': '2024-05-01T09:30:00',
+            })
+        self.names = {item['PLUCode']: item['LongName'] for item in self.items}
+        self.stores = [{'name': f'Store {store_id}', 'value': store_id} for store_id in range(1, settings.n_stores + 1)]
+        self.rules = {}
+        # Search results by (table, keyword), invalidated whenever the rules change.
+        self.matches = {}
+
+
+class MockT4Handler(BaseHTTPRequestHandler):
+    """
+    Implements the T4 APIs listed in URL, with the same paging and form encoding, plus GET /mock/stats.
+    """
+    state: MockT4State
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, body: dict, status: int = 200, headers: dict | None = None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_form(self) -> dict:
+        length = int(self.headers.get('Content-Length', 0))
+        return parse_qs(self.rfile.read(length).decode()) if length else {}
+
+    def _is_authenticated(self) -> bool:
+        cookies = dict(
+            cookie.strip().split('=', 1) for cookie in self.headers.get('Cookie', '').split(';') if '=' in cookie
+        )
+        return cookies.get('session') in self.state.sessions
+
+    def _handle(self, method: str):
+        url = urlsplit(self.path)
+        path = url.path.rstrip('/')
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if (method, path) == ('GET', '/mock/stats'):
+            with self.state.lock:
+                self._send_json({
+                    'request_counts': dict(self.state.request_counts),
+                    'request_times': dict(self.state.request_times),
+                    'n_rules': len(self.state.rules),
+                })
+            return
+
+        with self.state.lock:
+            self.state.request_counts[f'{method} {path}'] += 1
+            is_error = self.state.random.random() < self.state.settings.error_rate
+
+        if self.state.settings.latency_seconds:
+            time.sleep(self.state.settings.latency_seconds)
+        if is_error:
+            self._send_json({'success': False}, status=self.state.settings.error_status, headers={'Retry-After': '0'})
+            return
+
+        self._route(method, path, query)
+        with self.state.lock:
+            self.state.request_times[f'{method} {path}'].append(time.time())
+
+    def _route(self, method: str, path: str, query: dict):
+        if (method, path) == ('POST', '/api/v1/login'):
+            form = self._read_form()
+            if form.get('username') and form.get('psw'):
+                token = secrets.token_hex(8)
+                self.state.sessions.add(token)
+                self._send_json({'success': True}, headers={'Set-Cookie': f'session={token}; Path=/'})
+            else:
+                self._send_json({'success': False, 'additional_info': {
+                    'validation_errors': [{'msg': 'Invalid username or password'}]}})
+            return
+
+        if not self._is_authenticated():
+            self._send_json({'success': False, 'message': 'Not authenticated'}, status=401)
+            return
+
+        if (method, path) == ('GET', '/auth/logout'):
+            self._send_json({'success': True}, headers={'Set-Cookie': 'session=; Path=/; Max-Age=0'})
+        elif (method, path) == ('GET', '/api/v1/config/lookup/stores'):
+            self._send_json({'success': True, 'data': self.state.stores})
+        elif (method, path) == ('GET', '/api/v1/plus-active'):
+            self._send_page('items', lambda: self.state.items, query)
+        elif (method, path) == ('GET', '/api/v1/pluavailabilityrules'):
+            self._send_page('rules', lambda: list(self.state.rules.values()), query)
+        elif (method, path) == ('POST', '/api/v1/pluavailabilityrules'):
+            form = self._read_form()
+            created = []
+            with self.state.lock:
+                for store_id in form.get('StoreID', []):
+                    for plu_code in form.get('PLUCode', []):
+                        rule = {
+                            'ID': next(self.state.rule_ids),
+                            'PLUCode': int(plu_code),
+                            'StoreID': int(store_id),
+                            'LongName': self.state.names.get(int(plu_code), ''),
+                        }
+                        self.state.rules[rule['ID']] = rule
+                        created.append(rule)
+                self.state.matches = {}
+            self._send_json({'success': True, 'data': created})
+        elif (method, path) == ('DELETE', '/api/v1/pluavailabilityrules'):
+            form = self._read_form()
+            with self.state.lock:
+                for rule_id in form.get('IDs', []):
+                    self.state.rules.pop(int(rule_id), None)
+                self.state.matches = {}
+            self._send_json({'success': True})
+        else:
+            self._send_json({'success': False}, status=404)
+
+    def _send_page(self, table: str, get_rows, query: dict):
+        keyword = query.get('qv', '').lower()
+        with self.state.lock:
+            matched = self.state.matches.get((table, keyword))
+            if matched is None:
+                matched = [row for row in get_rows() if keyword in f'{row["LongName"]} {row["PLUCode"]}'.lower()]
+                self.state.matches[(table, keyword)] = matched
+        start = int(query.get('start', 0))
+        limit = int(query.get('limit', 100))
+        page = matched[start:start + limit]
+        self._send_json({'success': True, 'data': page, 'count': len(page), 'total': len(matched)})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class MockT4Server:
+
+    def __init__(self, settings: MockServerSettings | None = None, port: int = 0):
+        self.state = MockT4State(settings if settings else MockServerSettings())
+        handler = type('BoundMockT4Handler', (MockT4Handler,), {'state': self.state})
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self._server.daemon_threads = True
+        self._thread = Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def wait(self):
+        self._thread.join()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Runs a local stand-in for the T4 APIs.')
+    parser.add_argument('--port', type=int, default=0, help='0 picks a free port')
+    parser.add_argument('--items', type=int, default=MockServerSettings.n_items, help='size of the catalog')
+    parser.add_argument('--stores', type=int, default=MockServerSettings.n_stores)
+    parser.add_argument('--latency', type=float, default=MockServerSettings.latency_seconds,
+                        help='seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=MockServerSettings.error_rate,
+                        help='fraction of requests answered with --error-status')
+    parser.add_argument('--error-status', type=int, default=MockServerSettings.error_status)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    settings = MockServerSettings(n_items=args.items, n_stores=args.stores, latency_seconds=args.latency,
+                                  error_rate=args.error_rate, error_status=args.error_status)
+    with MockT4Server(settings, port=args.port) as server:
+        # The first line of the output is the host, for scripts that start the server in a subprocess.
+        print(server.host, flush=True)
+        try:
+            server.wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
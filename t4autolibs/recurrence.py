@@ -0,0 +1,171 @@
+import datetime
+from dataclasses import dataclass
+
+WEEKDAY_NAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+EVERY_DAY = frozenset(range(7))
+
+
+@dataclass(frozen=True)
+class Recurrence:
+    """
+    The days on which a schedule row runs: a set of weekdays (0 is Monday), an optional range of dates and one-off
+    exceptions.
+    """
+    weekdays: frozenset[int] = EVERY_DAY
+    start_date: datetime.date | None = None
+    end_date: datetime.date | None = None
+    exceptions: frozenset[datetime.date] = frozenset()
+
+    @classmethod
+    def from_dict(cls, config: dict | None) -> 'Recurrence':
+        if not config:
+            return cls()
+        return cls(
+            weekdays=frozenset(config.get('weekdays', EVERY_DAY)),
+            start_date=datetime.date.fromisoformat(config['start_date']) if config.get('start_date') else None,
+            end_date=datetime.date.fromisoformat(config['end_date']) if config.get('end_date') else None,
+            exceptions=frozenset(datetime.date.fromisoformat(day) for day in config.get('exceptions', [])),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            'weekdays': sorted(self.weekdays),
+            'start_date': self.start_date.isoformat() if self.start_date else None,
+            'end_date': self.end_date.isoformat() if self.end_date else None,
+            'exceptions': sorted(day.isoformat() for day in self.exceptions),
+        }
+
+    @classmethod
+    def from_text(cls, text: str) -> 'Recurrence':
+        """
+        Parses e.g. 'Mon-Fri from 2026-11-01 until 2026-12-31 except 2026-12-25, 2027-01-01'. Every part is optional;
+        an empty text or 'Every day' runs every day. Raises ValueError if the text is invalid.
+        """
+        weekdays = set()
+        never = False
+        dates = {'from': None, 'until': None}
+        exceptions = set()
+        part = 'weekdays'
+        for token in text.replace(',', ' ').lower().split():
+            if token in ['from', 'until', 'except']:
+                part = token
+            elif part == 'weekdays':
+                if token == 'never':
+                    never = True
+                elif token not in ['every', 'day', 'daily']:
+                    weekdays |= _parse_weekdays(token)
+            elif part == 'except':
+                exceptions.add(_parse_date(token))
+            elif part in dates and dates[part] is None:
+                dates[part] = _parse_date(token)
+            else:
+                raise ValueError(f'Unexpected "{token}" after "{part}"')
+
+        if dates['from'] and dates['until'] and dates['from'] > dates['until']:
+            raise ValueError(f'{dates["from"]} is after {dates["until"]}')
+        if never:
+            weekdays = set()
+        elif not weekdays:
+            weekdays = EVERY_DAY
+        return cls(frozenset(weekdays), dates['from'], dates['until'], frozenset(exceptions))
+
+    def to_text(self) -> str:
+        parts = [_format_weekdays(self.weekdays)]
+        if self.start_date:
+            parts.append(f'from {self.start_date.isoformat()}')
+        if self.end_date:
+            parts.append(f'until {self.end_date.isoformat()}')
+        if self.exceptions:
+            parts.append('except ' + ', '.join(sorted(day.isoformat() for day in self.exceptions)))
+        return ' '.join(parts)
+
+    def shifted(self, n_days: int) -> 'Recurrence':
+        """
+        Returns the recurrence n_days later, e.g. of the online time of a window that crosses midnight.
+        """
+        delta = datetime.timedelta(days=n_days)
+        return Recurrence(
+            weekdays=frozenset((weekday + n_days) % 7 for weekday in self.weekdays),
+            start_date=self.start_date + delta if self.start_date else None,
+            end_date=self.end_date + delta if self.end_date else None,
+            exceptions=frozenset(day + delta for day in self.exceptions),
+        )
+
+    def occurs_on(self, day: datetime.date) -> bool:
+        return (day.weekday() in self.weekdays
+                and (self.start_date is None or self.start_date <= day)
+                and (self.end_date is None or day <= self.end_date)
+                and day not in self.exceptions)
+
+    def next_date(self, day: datetime.date) -> datetime.date | None:
+        """
+        Returns the first date on or after day on which the row runs, or None if there is none. Jumps straight to the
+        next allowed weekday, so it takes at most one step per exception.
+        """
+        if not self.weekdays:
+            return None
+        if self.start_date and day < self.start_date:
+            day = self.start_date
+        while True:
+            day += datetime.timedelta(days=min((weekday - day.weekday()) % 7 for weekday in self.weekdays))
+            if self.end_date and day > self.end_date:
+                return None
+            if day not in self.exceptions:
+                return day
+            day += datetime.timedelta(days=1)
+
+
+@dataclass(frozen=True)
+class RecurrenceTrigger:
+    """
+    Fires at a time of day on the days of a recurrence.
+    """
+    time: datetime.time
+    recurrence: Recurrence
+
+    def next_fire_time(self, previous: datetime.datetime | None,
+                       now: datetime.datetime) -> datetime.datetime | None:
+        day = previous.date() + datetime.timedelta(days=1) if previous else now.date()
+        while (day := self.recurrence.next_date(day)) is not None:
+            fire_time = datetime.datetime.combine(day, self.time)
+            if previous is not None or fire_time >= now:
+                return fire_time
+            day += datetime.timedelta(days=1)
+        return None
+
+
+def _parse_weekdays(token: str) -> set[int]:
+    names = [name[:3].title() for name in token.split('-')]
+    if len(names) > 2 or any(name not in WEEKDAY_NAMES for name in names):
+        raise ValueError(f'"{token}" is not a weekday or a range of weekdays, e.g. Mon-Fri')
+    first, last = WEEKDAY_NAMES.index(names[0]), WEEKDAY_NAMES.index(names[-1])
+    # A range may wrap around the week, e.g. Fri-Mon.
+    return {(first + i) % 7 for i in range((last - first) % 7 + 1)}
+
+
+def _parse_date(token: str) -> datetime.date:
+    try:
+        return datetime.date.fromisoformat(token)
+    except ValueError:
+        raise ValueError(f'"{token}" is not a date, e.g. 2026-12-25')
+
+
+def _format_weekdays(weekdays: frozenset[int]) -> str:
+    if weekdays == EVERY_DAY:
+        return 'Every day'
+    if not weekdays:
+        return 'Never'
+    # Consecutive weekdays are written as ranges, e.g. Mon-Fri, Sun.
+    runs = []
+    for weekday in sorted(weekdays):
+        if runs and runs[-1][1] == weekday - 1:
+            runs[-1][1] = weekday
+        else:
+            runs.append([weekday, weekday])
+    if len(runs) > 1 and runs[0][0] == 0 and runs[-1][1] == 6:
+        # A run wraps around the week, e.g. Sat-Mon.
+        runs[-1][1] = runs.pop(0)[1]
+    return ', '.join(
+        WEEKDAY_NAMES[first] if first == last else f'{WEEKDAY_NAMES[first]}-{WEEKDAY_NAMES[last]}'
+        for first, last in runs
+    )
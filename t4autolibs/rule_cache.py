@@ -0,0 +1,118 @@
+import datetime
+from threading import Lock
+
+from t4autolibs.items import Item
+
+
+class RuleCache:
+    """
+    The availability rules that exist on the server, by store and PLU code, so that an offline action posts only the
+    PLUs without a rule and an online action deletes only rules that still exist.
+
+    The view is replaced by a full search of the rules and then kept up to date with the rules that t4auto creates and
+    deletes itself. It is trusted only for max_age after the search, since rules can also be changed on the website.
+    """
+
+    def __init__(self, max_age: datetime.timedelta):
+        self.max_age = max_age
+        self._lock = Lock()
+        self._rule_ids = {}  # store ID -> PLU code -> rule IDs, with the IDs and codes as strings
+        self._locations_by_rule_id = {}
+        self._changes = []  # (time, added rules, removed rule IDs) since the oldest load in progress
+        self._n_loads = 0
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self._locations_by_rule_id)
+
+    def is_fresh(self, margin: datetime.timedelta = datetime.timedelta()) -> bool:
+        """
+        Returns whether the view can still be trusted after margin, e.g. at an action that fires later.
+        """
+        return (self.loaded_at is not None
+                and datetime.datetime.now() + margin - self.loaded_at <= self.max_age)
+
+    def begin_load(self) -> datetime.datetime:
+        """
+        Returns the time to pass to replace once the search of the rules is done.
+        """
+        with self._lock:
+            self._n_loads += 1
+            return datetime.datetime.now()
+
+    def replace(self, rules: list[Item], load_started_at: datetime.datetime):
+        """
+        Replaces the view with the searched rules, then applies again the changes made by t4auto since the search
+        started, which the pages may have missed.
+        """
+        with self._lock:
+            self._rule_ids = {}
+            self._locations_by_rule_id = {}
+            self._add(rules)
+            for changed_at, added_rules, removed_rule_ids in self._changes:
+                if changed_at >= load_started_at:
+                    self._add(added_rules)
+                    self._remove(removed_rule_ids)
+            self.loaded_at = load_started_at
+            self._end_load()
+
+    def abort_load(self):
+        with self._lock:
+            self._end_load()
+
+    def _end_load(self):
+        self._n_loads -= 1
+        if self._n_loads == 0:
+            self._changes = []
+
+    def invalidate(self):
+        with self._lock:
+            self.loaded_at = None
+
+    def _add(self, rules: list[Item]):
+        for rule in rules:
+            if str(rule.id) in self._locations_by_rule_id:
+                continue
+            store_id = str(rule.store_id)
+            self._rule_ids.setdefault(store_id, {}).setdefault(str(rule.plu_code), []).append(rule.id)
+            self._locations_by_rule_id[str(rule.id)] = (store_id, str(rule.plu_code))
+
+    def add(self, rules: list[Item]):
+        with self._lock:
+            self._add(rules)
+            if self._n_loads:
+                self._changes.append((datetime.datetime.now(), rules, []))
+
+    def remove(self, rule_ids):
+        with self._lock:
+            self._remove(rule_ids)
+            if self._n_loads:
+                self._changes.append((datetime.datetime.now(), [], list(rule_ids)))
+
+    def _remove(self, rule_ids):
+        for rule_id in rule_ids:
+            location = self._locations_by_rule_id.pop(str(rule_id), None)
+            if location is None:
+                continue
+            store_id, plu_code = location
+            rule_ids_by_plu_code = self._rule_ids[store_id]
+            rule_ids_by_plu_code[plu_code] = [
+                cached_id for cached_id in rule_ids_by_plu_code[plu_code] if str(cached_id) != str(rule_id)
+            ]
+            if not rule_ids_by_plu_code[plu_code]:
+                del rule_ids_by_plu_code[plu_code]
+
+    def rule_ids_by_plu_code(self, store_id, plu_codes) -> dict[str, list]:
+        """
+        Returns the IDs of the existing rules of the store, for the PLU codes that have any.
+        """
+        with self._lock:
+            rule_ids_by_plu_code = self._rule_ids.get(str(store_id), {})
+            return {
+                str(plu_code): list(rule_ids_by_plu_code[str(plu_code)])
+                for plu_code in plu_codes if str(plu_code) in rule_ids_by_plu_code
+            }
+
+    def exists(self, rule_id) -> bool:
+        with self._lock:
+            return str(rule_id) in self._locations_by_rule_id
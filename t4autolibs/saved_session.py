@@ -0,0 +1,107 @@
+import ctypes
+import datetime
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from requests.cookies import RequestsCookieJar, create_cookie
+
+SESSION_FILE = 't4auto_session.json'
+CRYPTPROTECT_UI_FORBIDDEN = 0x1
+
+
+class _DataBlob(ctypes.Structure):
+    _fields_ = [('cbData', ctypes.c_uint32), ('pbData', ctypes.POINTER(ctypes.c_char))]
+
+
+def _call_dpapi(func, data: bytes) -> bytes:
+    buffer = ctypes.create_string_buffer(data, len(data))
+    data_in = _DataBlob(len(data), ctypes.cast(buffer, ctypes.POINTER(ctypes.c_char)))
+    data_out = _DataBlob()
+    if not func(ctypes.byref(data_in), None, None, None, None, CRYPTPROTECT_UI_FORBIDDEN, ctypes.byref(data_out)):
+        raise ctypes.WinError()
+    try:
+        return ctypes.string_at(data_out.pbData, data_out.cbData)
+    finally:
+        ctypes.windll.kernel32.LocalFree(data_out.pbData)
+
+
+def _protect(data: bytes) -> bytes:
+    """
+    Encrypts data for the current Windows user with DPAPI, so that other users of the machine and copies of the file
+    on other machines cannot read it. Elsewhere, the data is returned as is and only the file mode protects it.
+    """
+    if sys.platform != 'win32':
+        return data
+    return _call_dpapi(ctypes.windll.crypt32.CryptProtectData, data)
+
+
+def _unprotect(data: bytes) -> bytes:
+    """
+    Reverses _protect. Raises OSError if the data was protected by another user or on another machine.
+    """
+    if sys.platform != 'win32':
+        return data
+    return _call_dpapi(ctypes.windll.crypt32.CryptUnprotectData, data)
+
+
+class SavedSession:
+    """
+    The cookies of a logged-in session on disk, so that a restart can reuse the session instead of logging in again.
+
+    Whoever holds the cookies is logged in as the account, so the file is created readable and writable by its owner
+    only. Windows ignores that mode, so there the file is encrypted for the current user instead.
+    """
+
+    def __init__(self, path: Path = Path(SESSION_FILE)):
+        self.path = path
+
+    def save(self, username: str, cookies: RequestsCookieJar):
+        entry = {
+            'username': username,
+            'saved_at': datetime.datetime.now().isoformat(),
+            'cookies': [
+                {
+                    'name': cookie.name,
+                    'value': cookie.value,
+                    'domain': cookie.domain,
+                    'path': cookie.path,
+                    'secure': cookie.secure,
+                    'expires': cookie.expires,
+                }
+                for cookie in cookies
+            ],
+        }
+        # The file is written in full next to the old one, then replaces it, so a crash never leaves half a file. Every
+        # save has its own temporary file, created readable by its owner only, as threads that log in again may save
+        # at once.
+        fd, temp_path = tempfile.mkstemp(dir=self.path.parent, prefix=self.path.name + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_protect(json.dumps(entry).encode('utf-8')))
+            os.replace(temp_path, self.path)
+        except BaseException:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+
+    def load(self, username: str) -> RequestsCookieJar | None:
+        """
+        Returns the saved cookies of the account, or None if there are none.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                entry = json.loads(_unprotect(f.read()))
+        except (OSError, ValueError):
+            return None
+        if entry.get('username') != username:
+            return None
+
+        cookies = RequestsCookieJar()
+        for cookie in entry['cookies']:
+            cookies.set_cookie(create_cookie(**cookie))
+        return cookies
+
+    def delete(self):
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,90 @@
+import datetime
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+
+from t4autolibs.cores import AgentV2, AgentSettings, LoginStatus, UserInfo, ActionRowV2
+from t4autolibs.metrics import Metrics, MetricsServer
+from t4autolibs.timeline import Timeline
+
+ACCOUNTS_DIR = 'accounts'
+
+
+@dataclass
+class AccountStatus:
+    username: str
+    n_stores: int
+    n_jobs: int
+    next_run_time: datetime.datetime | None
+
+
+class SessionPool:
+    """
+    Several logged-in accounts in one process, each with its own session, store list and schedule.
+
+    All accounts share one timeline, so that one timer serves every schedule. Every account runs its actions on its own
+    dispatcher and keeps its files under accounts/<username>. The accounts share one metrics registry, labelled with
+    the username, which is written into accounts/ and served on metrics_port; their log lines start with the username.
+    """
+
+    def __init__(self, timeline: Timeline | None = None, metrics_port: int = 0):
+        self.timeline = timeline if timeline else Timeline()
+        if not self.timeline.running:
+            self.timeline.start()
+        self.agents = {}  # username -> AgentV2
+        self.class_logger = logging.getLogger('t4auto')
+        self.metrics = Metrics()
+        self._metrics_server = None
+        if metrics_port:
+            try:
+                self._metrics_server = MetricsServer(self.metrics, metrics_port)
+            except OSError as e:
+                self.class_logger.error(f'Failed to serve the metrics on port {metrics_port}: {e}')
+
+    def add_account(self, user_info: UserInfo, config: dict) -> LoginStatus:
+        if user_info.username in self.agents:
+            return LoginStatus(False, f'{user_info.username} is already in the pool')
+
+        settings = AgentSettings.from_dict(config.get('AgentSettings') or {})
+        agent = AgentV2(settings, timeline=self.timeline, data_dir=Path(ACCOUNTS_DIR) / user_info.username,
+                        metrics=self.metrics, metrics_dir=Path(ACCOUNTS_DIR), account=user_info.username)
+        login_status = agent.login(user_info)
+        if not login_status.success:
+            return login_status
+
+        self.agents[user_info.username] = agent
+        return login_status
+
+    def start_scheduler(self, username: str, actions: list[ActionRowV2]):
+        self.agents[username].start_scheduler(actions)
+
+    def remove_account(self, username: str) -> LoginStatus:
+        agent = self.agents.pop(username)
+        agent.stop_scheduler()
+        return agent.logout()
+
+    def close(self):
+        for username in list(self.agents):
+            self.remove_account(username)
+        self.timeline.shutdown()
+        if self._metrics_server is not None:
+            self._metrics_server.close()
+            self._metrics_server = None
+
+    def status(self) -> list[AccountStatus]:
+        statuses = []
+        for username, agent in self.agents.items():
+            next_run_times = [job.next_fire_time for job in agent.jobs if job.next_fire_time is not None]
+            statuses.append(AccountStatus(
+                username=username,
+                n_stores=len(agent.stores),
+                n_jobs=len(agent.jobs),
+                next_run_time=min(next_run_times) if next_run_times else None,
+            ))
+        return statuses
+
+    def log_status(self):
+        for status in self.status():
+            next_run_time = status.next_run_time.strftime('%Y-%m-%d %H:%M:%S') if status.next_run_time else '-'
+            self.class_logger.info(f'{status.username}: {status.n_stores} stores, {status.n_jobs} jobs, '
+                                   f'next run at {next_run_time}')
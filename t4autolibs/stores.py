@@ -0,0 +1,104 @@
+import datetime
+import sqlite3
+from bisect import bisect_left
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+
+STORE_CACHE_FILE = 't4auto_stores.sqlite3'
+
+
+@dataclass
+class Store:
+    id: int
+    name: str
+
+
+class StoreIndex:
+    """
+    The stores of an account by ID and by name, built once after login.
+
+    Every suffix of every store name is kept in one sorted list, so that finding the stores whose names contain a text
+    is a binary search for the suffixes starting with it rather than a scan of every name. Matches at the start of a
+    name come first, then matches at the start of a word, then the rest.
+    """
+
+    def __init__(self, stores: list[Store] = ()):
+        # A store listed twice is kept once.
+        self.by_id = {store.id: store for store in stores}
+        self._by_name = {store.name.casefold(): store for store in self.by_id.values()}
+        self._sorted = sorted(self.by_id.values(), key=lambda store: store.name.casefold())
+        self._suffixes = sorted(
+            (name[position:], position, store.id)
+            for store in self.by_id.values()
+            for name in [store.name.casefold()]
+            for position in range(len(name))
+        )
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def __iter__(self):
+        return iter(self._sorted)
+
+    def find(self, name: str) -> Store | None:
+        """
+        Returns the store with exactly this name, ignoring case.
+        """
+        return self._by_name.get(name.strip().casefold())
+
+    def search(self, text: str, limit: int | None = None) -> list[Store]:
+        """
+        Returns the stores whose names contain text, ignoring case, best matches first. An empty text matches every
+        store.
+        """
+        text = text.strip().casefold()
+        if not text:
+            return self._sorted[:limit]
+
+        ranks = {}
+        for i in range(bisect_left(self._suffixes, (text,)), len(self._suffixes)):
+            suffix, position, store_id = self._suffixes[i]
+            if not suffix.startswith(text):
+                break
+            name = self.by_id[store_id].name.casefold()
+            rank = 0 if position == 0 else 1 if not name[position - 1].isalnum() else 2
+            ranks[store_id] = min(rank, ranks.get(store_id, rank))
+        matches = sorted(ranks, key=lambda store_id: (ranks[store_id], self.by_id[store_id].name.casefold()))
+        return [self.by_id[store_id] for store_id in matches[:limit]]
+
+
+class StoreCache:
+    """
+    On-disk copy of the store list of every account, keyed by username and store ID, so that logging in does not wait
+    for the store lookup.
+    """
+
+    def __init__(self, path: Path = Path(STORE_CACHE_FILE)):
+        self.path = path
+        with closing(self._connect()) as connection, connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS stores ('
+                               'username TEXT, id INTEGER, name TEXT NOT NULL, PRIMARY KEY (username, id))')
+            connection.execute('CREATE TABLE IF NOT EXISTS synced (username TEXT PRIMARY KEY, synced_at TEXT)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def load(self, username: str) -> tuple[list[Store], datetime.datetime | None]:
+        """
+        Returns the cached stores of the account and when they were fetched, or None if they never were.
+        """
+        with closing(self._connect()) as connection:
+            rows = connection.execute('SELECT id, name FROM stores WHERE username = ? ORDER BY rowid',
+                                      (username,)).fetchall()
+            synced = connection.execute('SELECT synced_at FROM synced WHERE username = ?', (username,)).fetchone()
+        synced_at = datetime.datetime.fromisoformat(synced[0]) if synced else None
+        return [Store(store_id, name) for store_id, name in rows], synced_at
+
+    def save(self, username: str, stores: list[Store]):
+        with closing(self._connect()) as connection, connection:
+            connection.execute('DELETE FROM stores WHERE username = ?', (username,))
+            connection.executemany('INSERT OR REPLACE INTO stores (username, id, name) VALUES (?, ?, ?)',
+                                   [(username, store.id, store.name) for store in stores])
+            connection.execute('INSERT OR REPLACE INTO synced (username, synced_at) VALUES (?, ?)',
+                               (username, datetime.datetime.now().isoformat()))
@@ -0,0 +1,215 @@
+import datetime
+import heapq
+import itertools
+import logging
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from threading import Condition, Thread, current_thread
+from typing import Callable, Protocol
+
+# The timer wakes up at least this often, so that a jump of the wall clock, e.g. after the computer slept, is noticed.
+MAX_SLEEP_SECONDS = 60
+
+
+def _name(func: Callable) -> str:
+    return getattr(func, '__name__', repr(func))
+
+
+class Trigger(Protocol):
+    def next_fire_time(self, previous: datetime.datetime | None,
+                       now: datetime.datetime) -> datetime.datetime | None:
+        """
+        Returns the fire time after previous, or the first one that is not before now if previous is None. Returns None
+        when there are no more fire times.
+        """
+
+
+@dataclass(frozen=True)
+class DateTrigger:
+    """
+    Fires once.
+    """
+    fire_time: datetime.datetime
+
+    def next_fire_time(self, previous: datetime.datetime | None,
+                       now: datetime.datetime) -> datetime.datetime | None:
+        return self.fire_time if previous is None else None
+
+
+@dataclass(frozen=True)
+class IntervalTrigger:
+    """
+    Fires at start, then every interval. If start has passed, the first fire time is its next occurrence.
+    """
+    start: datetime.datetime
+    interval: datetime.timedelta
+
+    def next_fire_time(self, previous: datetime.datetime | None,
+                       now: datetime.datetime) -> datetime.datetime | None:
+        if previous is not None:
+            return previous + self.interval
+        if self.start >= now:
+            return self.start
+        return self.start - (self.start - now) // self.interval * self.interval
+
+
+@dataclass(eq=False)
+class TimelineEvent:
+    func: Callable
+    args: tuple
+    trigger: Trigger
+    next_fire_time: datetime.datetime | None
+    misfire_grace_seconds: float | None
+    executor: Executor | None
+    # The sequence number of the event's entry in the heap; other entries of the event are stale.
+    sequence: int = -1
+
+
+class Timeline:
+    """
+    Fires the events of every schedule from one heap of upcoming fire times, with one thread that sleeps until the
+    earliest event. Adding, removing or rescheduling an event costs O(log n) and leaves the other events untouched.
+
+    An event runs on its executor, or on the timer thread if it has none, which suits callbacks that return at once.
+    Every event computes its own next fire time from its trigger, so the timer never scans the events. An event that is
+    more than misfire_grace_seconds late is skipped, and the missed occurrences of a recurring event are merged into one
+    run.
+    """
+
+    def __init__(self):
+        self._condition = Condition()
+        self._heap = []  # (fire time, sequence, event), including stale entries of removed or rescheduled events
+        self._sequence = itertools.count()
+        self._n_events = 0
+        self._thread = None
+        self.class_logger = logging.getLogger('t4auto')
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def __len__(self) -> int:
+        return self._n_events
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._thread = Thread(target=self._run, name='t4auto-timeline', daemon=True)
+            self._thread.start()
+
+    def shutdown(self):
+        with self._condition:
+            thread = self._thread
+            self._thread = None
+            self._condition.notify()
+        if thread is not None and thread is not current_thread():
+            thread.join()
+
+    def add(self, func: Callable, trigger: Trigger, args: tuple = (), misfire_grace_seconds: float | None = None,
+            executor: Executor | None = None) -> TimelineEvent:
+        """
+        Fires func(*args) at the fire times of the trigger.
+        """
+        event = TimelineEvent(func, args, trigger, None, misfire_grace_seconds, executor)
+        self.reschedule(event, trigger)
+        return event
+
+    def reschedule(self, event: TimelineEvent, trigger: Trigger):
+        with self._condition:
+            if event.next_fire_time is not None:
+                self._deactivate(event)
+            event.trigger = trigger
+            fire_time = trigger.next_fire_time(None, datetime.datetime.now())
+            if fire_time is not None:
+                self._n_events += 1
+                self._push(event, fire_time)
+
+    def remove(self, event: TimelineEvent):
+        with self._condition:
+            if event.next_fire_time is None:
+                # The last occurrence may be due but not started yet; it does not run either.
+                event.sequence = -1
+                return
+            self._deactivate(event)
+            if len(self._heap) > 2 * self._n_events + 64:
+                self._heap = [entry for entry in self._heap if entry[1] == entry[2].sequence]
+                heapq.heapify(self._heap)
+
+    def _deactivate(self, event: TimelineEvent):
+        # The entry stays in the heap until it reaches the top or the heap is compacted.
+        event.next_fire_time = None
+        event.sequence = -1
+        self._n_events -= 1
+
+    def _push(self, event: TimelineEvent, fire_time: datetime.datetime):
+        event.next_fire_time = fire_time
+        event.sequence = next(self._sequence)
+        heapq.heappush(self._heap, (fire_time, event.sequence, event))
+        if self._heap[0][2] is event:
+            # The event is now the earliest one; the timer sleeps until it instead.
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            due_events = []
+            with self._condition:
+                if self._thread is not current_thread():
+                    return
+                now = datetime.datetime.now()
+                while self._heap and self._heap[0][0] <= now:
+                    fire_time, sequence, event = heapq.heappop(self._heap)
+                    if sequence == event.sequence and self._advance(event, fire_time, now):
+                        due_events.append((event, event.sequence))
+
+                if not due_events:
+                    timeout = MAX_SLEEP_SECONDS
+                    if self._heap:
+                        timeout = min(timeout, (self._heap[0][0] - now).total_seconds())
+                    self._condition.wait(timeout)
+                    continue
+
+            # The events run without the lock, so that they may add or remove events.
+            for event, sequence in due_events:
+                if sequence == event.sequence:
+                    # Not removed or rescheduled in the meantime.
+                    self._start(event)
+
+    def _advance(self, event: TimelineEvent, fire_time: datetime.datetime, now: datetime.datetime) -> bool:
+        """
+        Schedules the next occurrence of the event, then returns whether the due one should run.
+        """
+        # Missed occurrences are merged into the latest one.
+        next_fire_time = event.trigger.next_fire_time(fire_time, now)
+        while next_fire_time is not None and next_fire_time <= now:
+            fire_time = next_fire_time
+            next_fire_time = event.trigger.next_fire_time(fire_time, now)
+        if next_fire_time is None:
+            self._deactivate(event)
+            # The due occurrence still runs unless the event is removed or rescheduled before it starts.
+            event.sequence = next(self._sequence)
+        else:
+            self._push(event, next_fire_time)
+
+        lateness = (now - fire_time).total_seconds()
+        if event.misfire_grace_seconds is not None and lateness > event.misfire_grace_seconds:
+            self.class_logger.warning(f'Skipped {_name(event.func)}, which was due at '
+                                      f'{fire_time.strftime('%Y-%m-%d %H:%M:%S')}, {lateness:.0f} seconds ago.')
+            return False
+        return True
+
+    def _start(self, event: TimelineEvent):
+        if event.executor is None:
+            self._call(event)
+            return
+        try:
+            event.executor.submit(self._call, event)
+        except RuntimeError as e:
+            # The executor has been shut down.
+            self.class_logger.error(f'Failed to run {_name(event.func)}: {e}')
+
+    def _call(self, event: TimelineEvent):
+        try:
+            event.func(*event.args)
+        except Exception as e:
+            self.class_logger.exception(f'{_name(event.func)} failed: {e}')
@@ -0,0 +1,159 @@
+import datetime
+import email.utils
+import logging
+import random
+import time
+from threading import Lock
+from typing import Callable
+from urllib.parse import urlsplit
+
+import requests
+
+from t4autolibs.metrics import Metrics
+
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+THROTTLING_STATUS_CODES = {429, 503}
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Returns the seconds to wait from a Retry-After header, which holds either seconds or an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0)
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose rate is halved whenever the server throttles (429 or 503) and recovers gradually while requests
+    succeed.
+    """
+
+    def __init__(self, max_rate: float, min_rate: float, burst: int):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.rate = max_rate
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = Lock()
+
+    def acquire(self):
+        while (wait_seconds := self.try_acquire()) > 0:
+            time.sleep(wait_seconds)
+
+    def try_acquire(self) -> float:
+        """
+        Takes a token and returns 0 if one is available, or else returns the seconds to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            wait_seconds = self._paused_until - now
+            if wait_seconds <= 0:
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return 0
+                wait_seconds = (1 - self._tokens) / self.rate
+            return wait_seconds
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+    def on_throttled(self, retry_after_seconds: float | None):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_after_seconds:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after_seconds)
+
+
+class Transport:
+    """
+    Sends every T4 request with a timeout, through the rate limiter, retrying when it is safe to do so.
+
+    Throttled requests (429) are retried for every method, since the server did not process them. Server errors and
+    connection failures are retried only for idempotent methods. When the session has expired, the relogin callback
+    is called once with the time.perf_counter() at which the request was sent, and the request is sent again.
+    """
+
+    def __init__(self, session: requests.Session, rate_limiter: AdaptiveRateLimiter, timeout_seconds: float,
+                 max_retries: int, backoff_base_seconds: float, backoff_max_seconds: float,
+                 relogin: Callable[[float], bool] | None = None, metrics: Metrics | None = None,
+                 logger: logging.Logger | logging.LoggerAdapter | None = None):
+        self.session = session
+        self.rate_limiter = rate_limiter
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max_retries
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.relogin = relogin
+        self.metrics = metrics if metrics else Metrics()
+        self.class_logger = logger if logger else logging.getLogger('t4auto')
+
+    def _backoff_seconds(self, attempt: int) -> float:
+        # Full jitter keeps retries of concurrent requests from arriving together.
+        return random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** attempt))
+
+    @staticmethod
+    def _is_session_expired(response: requests.Response) -> bool:
+        if response.status_code in (401, 403):
+            return True
+        # An expired session is redirected to the login page.
+        return bool(response.history) and 'login' in response.url
+
+    def _record(self, method: str, path: str, status, started_at: float):
+        self.metrics.observe('t4auto_request_seconds', time.perf_counter() - started_at, method=method, path=path)
+        self.metrics.inc('t4auto_requests_total', method=method, path=path, status=status)
+
+    def request(self, method: str, url: str, allow_relogin: bool = True, **kwargs) -> requests.Response:
+        is_idempotent = method.upper() in IDEMPOTENT_METHODS
+        path = urlsplit(url).path.rstrip('/')
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            started_at = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=self.timeout_seconds, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(method, path, 'error', started_at)
+                if not is_idempotent or attempt >= self.max_retries:
+                    raise
+                self.class_logger.debug(f'{method} {url} failed: {e}. Retrying.')
+                time.sleep(self._backoff_seconds(attempt))
+                attempt += 1
+                continue
+
+            self._record(method, path, response.status_code, started_at)
+            if response.status_code == 429 or response.status_code >= 500:
+                retry_after_seconds = parse_retry_after(response.headers.get('Retry-After'))
+                if response.status_code in THROTTLING_STATUS_CODES:
+                    self.rate_limiter.on_throttled(retry_after_seconds)
+                can_retry = response.status_code == 429 or is_idempotent
+                if not can_retry or attempt >= self.max_retries:
+                    return response
+                self.class_logger.debug(f'{method} {url} returned HTTP {response.status_code}. Retrying.')
+                time.sleep(max(self._backoff_seconds(attempt), retry_after_seconds or 0))
+                attempt += 1
+                continue
+
+            if allow_relogin and self.relogin and self._is_session_expired(response):
+                self.class_logger.info('The session has expired. Logging in again.')
+                allow_relogin = False
+                if self.relogin(started_at):
+                    continue
+                return response
+
+            self.rate_limiter.on_success()
+            return response
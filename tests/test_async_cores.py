@@ -0,0 +1,148 @@
+import asyncio
+import datetime
+import math
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from t4autolibs.async_cores import AsyncAgent
+from t4autolibs.cores import URL, ActionRowV2, ActionType, AgentSettings, UserInfo
+from t4autolibs.logs import shutdown_logging
+from t4autolibs.mock_server import MockServerSettings, MockT4Server
+
+USER_INFO = UserInfo('franchise-a', 'password')
+
+
+def action_rows(keyword: str, store_id: int, offline_time: datetime.datetime,
+                online_time: datetime.datetime) -> list[ActionRowV2]:
+    return [ActionRowV2(keyword, offline_time, ActionType.START, '', store_id),
+            ActionRowV2(keyword, online_time, ActionType.END, '', store_id)]
+
+
+class AsyncAgentTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # The agent writes its log next to the working directory.
+        cls.working_dir = os.getcwd()
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(cls.temp_dir.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutdown_logging()
+        os.chdir(cls.working_dir)
+        cls.temp_dir.cleanup()
+
+    def setUp(self):
+        self.server = MockT4Server(MockServerSettings(n_items=300, n_stores=3))
+        self.server.__enter__()
+        self.original_host = URL.HOST
+        URL.use_host(self.server.host)
+        self.data_dir = Path(tempfile.mkdtemp(dir=self.temp_dir.name))
+        self.settings = AgentSettings(update_chunk_size=10, backoff_base_seconds=0.01, backoff_max_seconds=0.05)
+
+    def tearDown(self):
+        URL.use_host(self.original_host)
+        self.server.__exit__(None, None, None)
+
+    def matching_plu_codes(self, keyword: str) -> set[int]:
+        return {item['PLUCode'] for item in self.server.state.items if keyword in item['LongName'].lower()}
+
+    async def test_login_loads_the_stores(self):
+        async with AsyncAgent(self.settings, self.data_dir) as agent:
+            self.assertTrue((await agent.login(USER_INFO)).success)
+            self.assertEqual([store.id for store in agent.stores], [1, 2, 3])
+            self.assertTrue((await agent.logout()).success)
+
+    async def test_login_with_a_wrong_password_fails(self):
+        async with AsyncAgent(self.settings, self.data_dir) as agent:
+            self.assertFalse((await agent.login(UserInfo('franchise-a', ''))).success)
+
+    async def test_online_deletes_the_rules_created_offline_in_chunks(self):
+        now = datetime.datetime.now()
+        offline_row, online_row = action_rows('chicken', 2, now, now)
+        plu_codes = self.matching_plu_codes('chicken')
+        async with AsyncAgent(self.settings, self.data_dir) as agent:
+            await agent.login(USER_INFO)
+            await agent.take_items_offline([offline_row])
+            rules = list(self.server.state.rules.values())
+            self.assertEqual({rule['PLUCode'] for rule in rules}, plu_codes)
+            self.assertEqual({rule['StoreID'] for rule in rules}, {2})
+            self.assertEqual(self.server.state.request_counts['POST /api/v1/pluavailabilityrules'],
+                             math.ceil(len(plu_codes) / 10))
+            self.assertCountEqual(agent.ledger.get(offline_row.row_key, datetime.timedelta(hours=1)),
+                                  [rule['ID'] for rule in rules])
+
+            await agent.take_items_online([online_row])
+            self.assertEqual(self.server.state.rules, {})
+            self.assertIsNone(agent.ledger.get(online_row.row_key, datetime.timedelta(hours=1)))
+            # The rules were found in the ledger, not searched.
+            self.assertEqual(self.server.state.request_counts['GET /api/v1/pluavailabilityrules'], 0)
+
+    async def test_online_keeps_rules_it_did_not_create(self):
+        hand_made_rule = {'ID': 999999, 'PLUCode': min(self.matching_plu_codes('chicken')), 'StoreID': 2,
+                          'LongName': 'Made on the website'}
+        self.server.state.rules[hand_made_rule['ID']] = hand_made_rule
+        now = datetime.datetime.now()
+        offline_row, online_row = action_rows('chicken', 2, now, now)
+        async with AsyncAgent(self.settings, self.data_dir) as agent:
+            await agent.login(USER_INFO)
+            await agent.take_items_offline([offline_row])
+            await agent.take_items_online([online_row])
+        self.assertEqual(list(self.server.state.rules.values()), [hand_made_rule])
+
+    async def test_online_keeps_rules_that_an_overlapping_row_holds(self):
+        now = datetime.datetime.now()
+        offline_row, online_row = action_rows('chicken', 2, now, now)
+        other_row = ActionRowV2('chicken', now, ActionType.START, '', 2, row_key='other')
+        async with AsyncAgent(self.settings, self.data_dir) as agent:
+            await agent.login(USER_INFO)
+            await agent.take_items_offline([offline_row])
+            agent.ledger.record(other_row.row_key, list(self.server.state.rules))
+            await agent.take_items_online([online_row])
+        self.assertEqual({rule['PLUCode'] for rule in self.server.state.rules.values()},
+                         self.matching_plu_codes('chicken'))
+
+    async def test_expired_session_logs_in_again_once(self):
+        async with AsyncAgent(self.settings, self.data_dir) as agent:
+            await agent.login(USER_INFO)
+            self.server.state.sessions.clear()
+            items = await asyncio.gather(*[
+                agent._search_items_from_api(keyword, URL.GET_ITEMS_API) for keyword in ['beef', 'pork', 'tea']
+            ])
+        self.assertTrue(all(items))
+        self.assertEqual(self.server.state.request_counts['POST /api/v1/login'], 2)
+
+    async def test_throttled_requests_are_retried(self):
+        self.server.state.settings.error_status = 429
+        self.server.state.settings.error_rate = 0.3
+        now = datetime.datetime.now()
+        offline_row, online_row = action_rows('beef', 1, now, now)
+        async with AsyncAgent(self.settings, self.data_dir) as agent:
+            self.assertTrue((await agent.login(USER_INFO)).success)
+            await agent.take_items_offline([offline_row])
+            self.assertEqual({rule['PLUCode'] for rule in self.server.state.rules.values()},
+                             self.matching_plu_codes('beef'))
+            await agent.take_items_online([online_row])
+        self.assertEqual(self.server.state.rules, {})
+
+    async def test_scheduler_takes_items_offline_and_online_on_time(self):
+        now = datetime.datetime.now()
+        rows = action_rows('tea', 3, now + datetime.timedelta(seconds=0.5), now + datetime.timedelta(seconds=1.5))
+        async with AsyncAgent(self.settings, self.data_dir) as agent:
+            await agent.login(USER_INFO)
+            scheduler = asyncio.create_task(agent.run_scheduler(rows))
+            await asyncio.sleep(1)
+            self.assertEqual({rule['PLUCode'] for rule in self.server.state.rules.values()},
+                             self.matching_plu_codes('tea'))
+            await asyncio.sleep(1)
+            self.assertEqual(self.server.state.rules, {})
+            scheduler.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await scheduler
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import threading
+import time
+import unittest
+
+from t4autolibs.dispatcher import Dispatcher
+
+TIMEOUT_SECONDS = 5
+
+
+class DispatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = Dispatcher(max_workers=4)
+
+    def tearDown(self):
+        self.dispatcher.shutdown()
+
+    def test_tasks_of_a_lane_run_one_after_another_in_order(self):
+        steps = []
+
+        def task(i):
+            steps.append(('start', i))
+            time.sleep(0.01)
+            steps.append(('end', i))
+
+        futures = [self.dispatcher.submit([('store 1', 'burger')], task, i) for i in range(5)]
+        for future in futures:
+            future.result(TIMEOUT_SECONDS)
+        self.assertEqual(steps, [(step, i) for i in range(5) for step in ['start', 'end']])
+
+    def test_tasks_of_other_lanes_run_in_parallel(self):
+        # Each task waits for the other, so they only finish if they run at once.
+        barrier = threading.Barrier(2, timeout=TIMEOUT_SECONDS)
+        futures = [self.dispatcher.submit([lane], barrier.wait) for lane in ['store 1', 'store 2']]
+        for future in futures:
+            future.result(TIMEOUT_SECONDS)
+
+    def test_task_waits_for_every_lane_it_names(self):
+        release = threading.Event()
+        steps = []
+        blocking = self.dispatcher.submit(['store 1'], release.wait, TIMEOUT_SECONDS)
+        both = self.dispatcher.submit(['store 1', 'store 2'], steps.append, 'both')
+        # Submitted after the task naming both lanes, so it runs after it although its lane is free now.
+        later = self.dispatcher.submit(['store 2'], steps.append, 'later')
+        time.sleep(0.05)
+        self.assertEqual(steps, [])
+        self.assertEqual(self.dispatcher.queue_depth, 2)
+
+        release.set()
+        for future in [blocking, both, later]:
+            future.result(TIMEOUT_SECONDS)
+        self.assertEqual(steps, ['both', 'later'])
+        self.assertEqual(self.dispatcher.queue_depth, 0)
+
+    def test_clear_cancels_waiting_tasks_and_lets_the_running_one_finish(self):
+        release = threading.Event()
+        steps = []
+        running = self.dispatcher.submit(['store 1'], release.wait, TIMEOUT_SECONDS)
+        waiting = self.dispatcher.submit(['store 1'], steps.append, 'waiting')
+        self.dispatcher.clear()
+        self.assertTrue(waiting.cancelled())
+        self.assertEqual(self.dispatcher.queue_depth, 0)
+
+        release.set()
+        self.assertTrue(running.result(TIMEOUT_SECONDS))
+        # The lane is free again for new tasks.
+        self.dispatcher.submit(['store 1'], steps.append, 'new').result(TIMEOUT_SECONDS)
+        self.assertEqual(steps, ['new'])
+
+    def test_failed_task_releases_its_lane(self):
+        def fail():
+            raise ValueError('failed')
+
+        with self.assertLogs('t4auto', 'ERROR'):
+            failed = self.dispatcher.submit(['store 1'], fail)
+            after = self.dispatcher.submit(['store 1'], lambda: 'after')
+            self.assertEqual(after.result(TIMEOUT_SECONDS), 'after')
+        self.assertIsInstance(failed.exception(TIMEOUT_SECONDS), ValueError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import datetime
+import unittest
+
+from t4autolibs.cores import ActionRowV2, ActionType, action_trigger, is_within_offline_window
+from t4autolibs.recurrence import Recurrence, RecurrenceTrigger
+
+# 2026-11-06 is a Friday.
+FRIDAY = datetime.date(2026, 11, 6)
+SATURDAY = FRIDAY + datetime.timedelta(days=1)
+SUNDAY = FRIDAY + datetime.timedelta(days=2)
+MONDAY = FRIDAY + datetime.timedelta(days=3)
+
+
+def at(day: datetime.date, hour: int, minute: int = 0, second: int = 0) -> datetime.datetime:
+    return datetime.datetime.combine(day, datetime.time(hour, minute, second))
+
+
+class RecurrenceTextTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for text in ['Every day', 'Never', 'Mon-Fri', 'Mon, Wed, Fri', 'Sat-Mon', 'Wed, Sat-Mon',
+                     'Mon-Fri from 2026-11-01 until 2026-12-31 except 2026-12-25, 2026-12-26']:
+            with self.subTest(text=text):
+                self.assertEqual(Recurrence.from_text(text).to_text(), text)
+
+    def test_text_of_a_parsed_recurrence_parses_to_the_same_recurrence(self):
+        recurrence = Recurrence.from_text('fri-sun until 2027-01-10 except 2026-12-25,2027-01-01')
+        self.assertEqual(Recurrence.from_text(recurrence.to_text()), recurrence)
+
+    def test_empty_text_runs_every_day(self):
+        self.assertEqual(Recurrence.from_text(''), Recurrence())
+
+    def test_invalid_text_raises(self):
+        for text in ['Mon-Fri-Sun', 'Someday', 'from 2026-13-01', 'from 2026-12-31 until 2026-11-01']:
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    Recurrence.from_text(text)
+
+
+class RecurrenceDaysTest(unittest.TestCase):
+
+    def test_range_wraps_around_the_week(self):
+        recurrence = Recurrence.from_text('Sat-Mon')
+        self.assertEqual(recurrence.weekdays, {5, 6, 0})
+        self.assertEqual([recurrence.occurs_on(day) for day in [FRIDAY, SATURDAY, SUNDAY, MONDAY]],
+                         [False, True, True, True])
+        self.assertEqual(recurrence.next_date(FRIDAY), SATURDAY)
+
+    def test_exception_on_the_end_date_leaves_no_days(self):
+        recurrence = Recurrence(end_date=FRIDAY, exceptions=frozenset({FRIDAY}))
+        self.assertFalse(recurrence.occurs_on(FRIDAY))
+        self.assertIsNone(recurrence.next_date(FRIDAY))
+        self.assertEqual(recurrence.next_date(FRIDAY - datetime.timedelta(days=1)),
+                         FRIDAY - datetime.timedelta(days=1))
+
+    def test_trigger_stops_after_the_end_date(self):
+        trigger = RecurrenceTrigger(datetime.time(9), Recurrence(end_date=SATURDAY, exceptions=frozenset({FRIDAY})))
+        first = trigger.next_fire_time(None, at(FRIDAY, 8))
+        self.assertEqual(first, at(SATURDAY, 9))
+        self.assertIsNone(trigger.next_fire_time(first, first))
+
+
+class ActionTriggerTest(unittest.TestCase):
+
+    def test_lead_before_midnight_fires_on_the_day_before(self):
+        # Mondays at 00:00:30, prefetched a minute earlier, i.e. on Sundays at 23:59:30.
+        action_row = ActionRowV2('burger', at(MONDAY, 0, 0, 30), ActionType.START, '', 1,
+                                 Recurrence.from_text('Mon'))
+        trigger = action_trigger(action_row, datetime.timedelta(minutes=1))
+        self.assertEqual(trigger.time, datetime.time(23, 59, 30))
+        self.assertEqual(trigger.next_fire_time(None, at(FRIDAY, 12)), at(SUNDAY, 23, 59, 30))
+
+    def test_without_lead_fires_at_the_action_time(self):
+        action_row = ActionRowV2('burger', at(MONDAY, 0, 0, 30), ActionType.START, '', 1,
+                                 Recurrence.from_text('Mon'))
+        self.assertEqual(action_trigger(action_row).next_fire_time(None, at(FRIDAY, 12)), at(MONDAY, 0, 0, 30))
+
+
+class OfflineWindowTest(unittest.TestCase):
+
+    def setUp(self):
+        # Fridays from 22:00 to 02:00 on Saturdays.
+        recurrence = Recurrence.from_text('Fri')
+        self.offline_action = ActionRowV2('burger', at(FRIDAY, 22), ActionType.START, '', 1, recurrence)
+        self.online_action = ActionRowV2('burger', at(FRIDAY, 2), ActionType.END, '', 1, recurrence.shifted(1))
+
+    def assertWithin(self, moment: datetime.datetime, expected: bool):
+        self.assertEqual(is_within_offline_window(self.offline_action, self.online_action, moment), expected,
+                         moment)
+
+    def test_window_crossing_midnight(self):
+        self.assertWithin(at(FRIDAY, 21, 59), False)
+        self.assertWithin(at(FRIDAY, 22), True)
+        self.assertWithin(at(FRIDAY, 23, 59), True)
+        self.assertWithin(at(SATURDAY, 1, 59), True)
+        self.assertWithin(at(SATURDAY, 2), False)
+
+    def test_window_of_a_day_without_the_row(self):
+        # The row does not run on Thursdays, so early Friday is outside any window.
+        self.assertWithin(at(FRIDAY, 1), False)
+        self.assertWithin(at(SATURDAY, 22, 30), False)
+
+
+if __name__ == '__main__':
+    unittest.main()
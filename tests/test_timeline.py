@@ -0,0 +1,116 @@
+import datetime
+import threading
+import time
+import unittest
+from dataclasses import dataclass
+
+from t4autolibs.timeline import DateTrigger, Timeline
+
+TIMEOUT_SECONDS = 5
+
+
+def seconds_from_now(seconds: float) -> datetime.datetime:
+    return datetime.datetime.now() + datetime.timedelta(seconds=seconds)
+
+
+@dataclass(frozen=True)
+class ListTrigger:
+    """
+    Fires at the listed times, in order, whether or not they have passed.
+    """
+    fire_times: tuple[datetime.datetime, ...]
+
+    def next_fire_time(self, previous: datetime.datetime | None,
+                       now: datetime.datetime) -> datetime.datetime | None:
+        if previous is None:
+            return self.fire_times[0]
+        later_fire_times = [fire_time for fire_time in self.fire_times if fire_time > previous]
+        return later_fire_times[0] if later_fire_times else None
+
+
+class TimelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.timeline = Timeline()
+
+    def tearDown(self):
+        self.timeline.shutdown()
+
+    def test_events_fire_in_order_of_their_fire_times(self):
+        fired = []
+        done = threading.Event()
+        self.timeline.add(lambda: (fired.append('second'), done.set()), DateTrigger(seconds_from_now(0.2)))
+        self.timeline.add(fired.append, DateTrigger(seconds_from_now(0.1)), args=('first',))
+        self.timeline.start()
+        self.assertTrue(done.wait(TIMEOUT_SECONDS))
+        self.assertEqual(fired, ['first', 'second'])
+        self.assertEqual(len(self.timeline), 0)
+
+    def test_event_removed_while_due_does_not_run(self):
+        # Both events are due in the same pass of the timer; the first one removes the second before it runs.
+        fired = []
+        fire_time = seconds_from_now(0.1)
+        self.timeline.add(lambda: self.timeline.remove(removed), DateTrigger(fire_time))
+        removed = self.timeline.add(fired.append, DateTrigger(fire_time), args=('removed',))
+        done = threading.Event()
+        self.timeline.add(done.set, DateTrigger(seconds_from_now(0.3)))
+        self.timeline.start()
+        self.assertTrue(done.wait(TIMEOUT_SECONDS))
+        self.assertEqual(fired, [])
+        self.assertIsNone(removed.next_fire_time)
+
+    def test_event_rescheduled_while_due_runs_at_its_new_time(self):
+        fired = []
+        done = threading.Event()
+        fire_time = seconds_from_now(0.1)
+        new_fire_time = seconds_from_now(0.3)
+        self.timeline.add(lambda: self.timeline.reschedule(rescheduled, DateTrigger(new_fire_time)),
+                          DateTrigger(fire_time))
+        rescheduled = self.timeline.add(lambda: (fired.append(datetime.datetime.now()), done.set()),
+                                        DateTrigger(fire_time))
+        self.timeline.start()
+        self.assertTrue(done.wait(TIMEOUT_SECONDS))
+        time.sleep(0.1)
+        self.assertEqual(len(fired), 1)
+        self.assertGreaterEqual(fired[0], new_fire_time)
+
+    def test_removed_entries_are_compacted(self):
+        events = [self.timeline.add(print, DateTrigger(seconds_from_now(3600 + i))) for i in range(300)]
+        for event in events[:250]:
+            self.timeline.remove(event)
+        self.assertEqual(len(self.timeline), 50)
+        self.assertLessEqual(len(self.timeline._heap), 2 * 50 + 64)
+        self.assertEqual({event for _, sequence, event in self.timeline._heap if sequence == event.sequence},
+                         set(events[250:]))
+
+    def test_event_later_than_the_grace_is_skipped(self):
+        fired = []
+        done = threading.Event()
+        self.timeline.add(fired.append, DateTrigger(seconds_from_now(-10)), args=('late',), misfire_grace_seconds=5)
+        self.timeline.add(fired.append, DateTrigger(seconds_from_now(-1)), args=('in time',), misfire_grace_seconds=5)
+        self.timeline.add(done.set, DateTrigger(seconds_from_now(0.1)))
+        with self.assertLogs('t4auto', 'WARNING') as logs:
+            self.timeline.start()
+            self.assertTrue(done.wait(TIMEOUT_SECONDS))
+        self.assertEqual(fired, ['in time'])
+        self.assertEqual(len(logs.records), 1)
+
+    def test_missed_runs_are_merged_into_the_latest(self):
+        fired = []
+        done = threading.Event()
+        next_fire_time = seconds_from_now(3600)
+        # The earliest missed run is later than the grace, but the latest is not, so the merged run is not skipped.
+        event = self.timeline.add(
+            lambda: (fired.append(1), done.set()),
+            ListTrigger((seconds_from_now(-3), seconds_from_now(-2), seconds_from_now(-1), next_fire_time)),
+            misfire_grace_seconds=1.5,
+        )
+        self.timeline.start()
+        self.assertTrue(done.wait(TIMEOUT_SECONDS))
+        time.sleep(0.1)
+        self.assertEqual(fired, [1])
+        self.assertEqual(event.next_fire_time, next_fire_time)
+
+
+if __name__ == '__main__':
+    unittest.main()